@@ -163,6 +163,128 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
 
+# OCR
+# Languages loaded by the shared EasyOCR readers, and whether each worker
+# loads them at boot instead of on the first scan.
+OCR_LANGUAGES = ['fr']
+OCR_WARMUP = os.getenv('OCR_WARMUP', 'False').lower() in ('1', 'true', 'yes')
+
+# 'roi' reads only the name / birth date / number zones of the located card
+# (the whole photo is read for the fields they do not give), 'full' always reads the whole photo.
+CIN_OCR_MODE = os.getenv('CIN_OCR_MODE', 'roi')
+
+# Adaptive OCR resolution: pages (CV) and cards (CIN) are first read at the
+# lowest DPI and only re-rendered at the next one when the email / phone / CIN
+# parsers found nothing. A single value disables the ladder.
+CV_OCR_DPI_LADDER = [int(d) for d in os.getenv('CV_OCR_DPI_LADDER', '150,300').split(',')]
+CIN_OCR_DPI_LADDER = [int(d) for d in os.getenv('CIN_OCR_DPI_LADDER', '200,300').split(',')]
+
+# Cache of CIN / CV extraction results, keyed by the SHA-256 of the uploaded file.
+# BACKEND is 'db' (OcrResult table, shared by all workers), 'cache' (the
+# Django cache named by CACHE_ALIAS) or 'none'.
+OCR_CACHE = {
+    'BACKEND': os.getenv('OCR_CACHE_BACKEND', 'db'),
+    'CACHE_ALIAS': 'ocr',
+    'TTL': int(os.getenv('OCR_CACHE_TTL', 7 * 24 * 3600)),
+    'MAX_ENTRIES': int(os.getenv('OCR_CACHE_MAX_ENTRIES', 1000)),
+}
+
+# Asynchronous OCR jobs (scan_cin_async / process_cv_async), run by `manage.py ocr_worker`
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', 2))
+OCR_JOB_TIMEOUT = int(os.getenv('OCR_JOB_TIMEOUT', 600))
+OCR_JOB_RETENTION = int(os.getenv('OCR_JOB_RETENTION', 24 * 3600))
+
+# Batch OCR endpoint (ocr_batch/): files are queued as OCR jobs, so the
+# concurrency is capped by the number of ocr_worker processes (OCR_WORKERS).
+# The response does not wait for the OCR, clients follow each job with ocr_jobs/<job_id>/.
+OCR_BATCH_MAX_FILES = int(os.getenv('OCR_BATCH_MAX_FILES', 500))
+OCR_BATCH_MAX_FILE_SIZE = int(os.getenv('OCR_BATCH_MAX_FILE_SIZE', 20 * 1024 * 1024))
+
+# DOCX -> PDF conversion: 'libreoffice' (pool of headless LibreOffice processes
+# behind unoserver, one pool per worker process) or 'docx2pdf' (Microsoft Word, Windows only).
+DOCX_PDF_BACKEND = os.getenv('DOCX_PDF_BACKEND', 'docx2pdf' if os.name == 'nt' else 'libreoffice')
+DOCX_PDF_WARMUP = os.getenv('DOCX_PDF_WARMUP', 'False').lower() in ('1', 'true', 'yes')
+LIBREOFFICE_POOL = {
+    # Python interpreter with the LibreOffice UNO bindings, running unoserver
+    'COMMAND': os.getenv('LIBREOFFICE_COMMAND', 'python3 -m unoserver.server'),
+    'SIZE': int(os.getenv('LIBREOFFICE_POOL_SIZE', 2)),
+    # Jobs waiting for a free process beyond this are refused (503)
+    'QUEUE_SIZE': int(os.getenv('LIBREOFFICE_QUEUE_SIZE', 8)),
+    'QUEUE_TIMEOUT': int(os.getenv('LIBREOFFICE_QUEUE_TIMEOUT', 30)),
+    'JOB_TIMEOUT': int(os.getenv('LIBREOFFICE_JOB_TIMEOUT', 60)),
+    'STARTUP_TIMEOUT': int(os.getenv('LIBREOFFICE_STARTUP_TIMEOUT', 30)),
+}
+
+# Background rendering of the demande de stage after creer_stage: threads per
+# worker process, seconds after which a pending rendering is considered lost
+# and started again, and the Retry-After sent while it is pending.
+DOCUMENT_RENDER_WORKERS = int(os.getenv('DOCUMENT_RENDER_WORKERS', 2))
+DOCUMENT_RENDER_TIMEOUT = int(os.getenv('DOCUMENT_RENDER_TIMEOUT', 300))
+DOCUMENT_RENDER_RETRY_AFTER = int(os.getenv('DOCUMENT_RENDER_RETRY_AFTER', 3))
+
+# Seconds between two reads of the active document template versions by a
+# worker process: an uploaded template is used by every worker after this delay.
+TEMPLATE_REGISTRY_CHECK_INTERVAL = int(os.getenv('TEMPLATE_REGISTRY_CHECK_INTERVAL', 10))
+
+# Storage of the stage / stagiaire documents, addressed by the SHA-256 of their
+# content: 'local' (directory LOCATION) or 's3' (S3 compatible bucket, needs boto3;
+# credentials come from the AWS_* environment variables).
+# Documents stored in the tables before are moved with `manage.py migrate_blobs`.
+BLOB_STORE = {
+    'BACKEND': os.getenv('BLOB_STORE_BACKEND', 'local'),
+    'LOCATION': os.getenv('BLOB_STORE_LOCATION', os.path.join(BASE_DIR, 'blobs')),
+    'S3_BUCKET': os.getenv('BLOB_STORE_S3_BUCKET', ''),
+    'S3_PREFIX': os.getenv('BLOB_STORE_S3_PREFIX', 'blobs/'),
+    'S3_ENDPOINT_URL': os.getenv('BLOB_STORE_S3_ENDPOINT_URL') or None,
+    'S3_REGION': os.getenv('BLOB_STORE_S3_REGION') or None,
+}
+
+# Chunked, resumable uploads of the documents (uploads/ endpoints): chunks are
+# written to TEMP_DIR (shared by the worker processes) until the upload is
+# finished; unfinished uploads are deleted by `manage.py purge_uploads` after EXPIRY seconds.
+CHUNKED_UPLOADS = {
+    'TEMP_DIR': os.getenv('CHUNKED_UPLOADS_TEMP_DIR', os.path.join(BASE_DIR, 'uploads')),
+    'MAX_SIZE': int(os.getenv('CHUNKED_UPLOADS_MAX_SIZE', 50 * 1024 * 1024)),
+    'CHUNK_SIZE': int(os.getenv('CHUNKED_UPLOADS_CHUNK_SIZE', 1024 * 1024)),
+    'MAX_CHUNK_SIZE': int(os.getenv('CHUNKED_UPLOADS_MAX_CHUNK_SIZE', 8 * 1024 * 1024)),
+    'EXPIRY': int(os.getenv('CHUNKED_UPLOADS_EXPIRY', 24 * 3600)),
+}
+
+# Stages exported by one export_dossiers_stages request: the ZIP is streamed by
+# the request, it must finish before the Gunicorn worker timeout (--timeout 120
+# in entrypoint.sh). Larger selections are refused and exported in batches.
+EXPORT_MAX_STAGES = int(os.getenv('EXPORT_MAX_STAGES', 50))
+
+# Rendered documents (filled DOCX, PDF conversions) reused when the same values
+# are rendered again: 'memory' (per worker process, bounded by MAX_BYTES),
+# 'cache' (the 'documents' Django cache, e.g. shared with Redis) or 'none'.
+RENDER_CACHE = {
+    'BACKEND': os.getenv('RENDER_CACHE_BACKEND', 'memory'),
+    'CACHE_ALIAS': 'documents',
+    'TTL': int(os.getenv('RENDER_CACHE_TTL', 24 * 3600)),
+    'MAX_BYTES': int(os.getenv('RENDER_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    'MAX_ENTRY_BYTES': int(os.getenv('RENDER_CACHE_MAX_ENTRY_BYTES', 8 * 1024 * 1024)),
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'ocr': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ocr-results',
+        'TIMEOUT': OCR_CACHE['TTL'],
+        'OPTIONS': {
+            'MAX_ENTRIES': OCR_CACHE['MAX_ENTRIES'],
+        },
+    },
+    'documents': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'rendered-documents',
+        'TIMEOUT': RENDER_CACHE['TTL'],
+    },
+}
+
 # Allow specific headers
 CORS_ALLOW_HEADERS = [
     'accept',
@@ -174,6 +296,21 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    # Conditional and partial document downloads
+    'if-none-match',
+    'if-range',
+    'range',
+    # Chunked uploads
+    'upload-offset',
+]
+
+# Headers of the document downloads readable by the front-end
+CORS_EXPOSE_HEADERS = [
+    'accept-ranges',
+    'content-disposition',
+    'content-length',
+    'content-range',
+    'etag',
 ]
 
 # Allow specific methods
@@ -13,6 +13,16 @@ fi
 # Apply migrations and collect static (no static root configured here)
 python manage.py migrate --noinput
 
+# Run another command in the same image, e.g. `python manage.py ocr_worker`
+if [ "$#" -gt 0 ]; then
+  exec "$@"
+fi
+
+# Load the OCR models when each Gunicorn worker boots (set OCR_WARMUP=False to disable)
+export OCR_WARMUP="${OCR_WARMUP:-True}"
+# Start the LibreOffice converter processes of each Gunicorn worker at boot
+export DOCX_PDF_WARMUP="${DOCX_PDF_WARMUP:-True}"
+
 # Start Gunicorn
 exec gunicorn Cosumar_Digital_Recrutement.wsgi:application \
   --bind 0.0.0.0:8000 \
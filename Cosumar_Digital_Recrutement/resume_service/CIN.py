@@ -1,20 +1,40 @@
 from io import BytesIO
-import easyocr
 from PIL import Image
 import numpy as np
 import torch
 import json
 import re
 from datetime import datetime
+import time
+import cv2
+from django.conf import settings
+from .ocr import get_reader, get_ocr_languages, record_ocr_attempt, ocr_stage
+
+# Bump when the CIN extraction changes, so cached results of the old version are ignored
+CIN_EXTRACTOR_VERSION = 'cin-4'
+
+# Physical size of the card (ID-1 format) and default pixel size once straightened
+CARD_SIZE_MM = (85.6, 54.0)
+CARD_SIZE = (1000, 630)
+
+# Zones of the front of the CIN, as fractions (x0, y0, x1, y1) of the straightened card.
+# 'identite' holds the names and the "Né le" line, 'numero' the CIN number.
+DEFAULT_CIN_ZONES = {
+    'identite': (0.28, 0.18, 1.00, 0.68),
+    'numero': (0.00, 0.66, 0.55, 1.00),
+}
+
+CIN_NUMBER_ALLOWLIST = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
 
 def scan_cin(img):
     print("🆔 Starting CIN OCR...")
     print("✅ Using GPU" if torch.cuda.is_available() else "⚠️ Using CPU")
 
-    img = img.convert("RGB")
-    img_np = np.array(img)
+    with ocr_stage('decode'):
+        img = img.convert("RGB")
+        img_np = np.array(img)
 
-    reader = easyocr.Reader(['fr'], gpu=torch.cuda.is_available())
+    reader = get_reader(get_ocr_languages())
 
     result = reader.readtext(img_np, detail=0, paragraph=False)
 
@@ -24,6 +44,168 @@ def scan_cin(img):
     return clean_lines
 
 
+def _order_corners(points):
+    """Order 4 points as top-left, top-right, bottom-right, bottom-left"""
+    points = points.reshape(4, 2).astype("float32")
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array([
+        points[np.argmin(sums)],
+        points[np.argmin(diffs)],
+        points[np.argmax(sums)],
+        points[np.argmax(diffs)],
+    ], dtype="float32")
+
+
+def card_size_for_dpi(dpi):
+    """Pixel size of a straightened card scanned at the given resolution"""
+    return tuple(int(round(dpi * mm / 25.4)) for mm in CARD_SIZE_MM)
+
+
+def find_card_corners(img_np):
+    """
+    Find the card in a photo
+
+    The card is the largest 4-sided contour covering a reasonable part of the
+    photo.
+
+    Returns:
+        The 4 corners (top-left, top-right, bottom-right, bottom-left) in
+        image coordinates, or None when no card outline is found (tight scan,
+        busy background)
+    """
+    height, width = img_np.shape[:2]
+
+    # Contours are searched on a small copy, the warp uses the full image
+    scale = 800 / max(height, width) if max(height, width) > 800 else 1.0
+    small = cv2.resize(img_np, (int(width * scale), int(height * scale))) if scale != 1.0 else img_np
+
+    gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+    edges = cv2.Canny(gray, 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8), iterations=2)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    min_area = 0.2 * small.shape[0] * small.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        if cv2.contourArea(contour) < min_area:
+            break
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(approx) == 4:
+            return _order_corners(approx) / scale
+
+    return None
+
+
+def straighten_card(img_np, corners, size=CARD_SIZE):
+    """
+    Warp the card delimited by corners to a landscape image of the given size
+
+    When corners is None the whole image is used. Portrait results are
+    rotated to landscape.
+    """
+    card = img_np
+    if corners is not None:
+        top_width = np.linalg.norm(corners[1] - corners[0])
+        side_height = np.linalg.norm(corners[3] - corners[0])
+        target_w, target_h = size if top_width >= side_height else size[::-1]
+        target = np.array([[0, 0], [target_w - 1, 0], [target_w - 1, target_h - 1], [0, target_h - 1]], dtype="float32")
+        matrix = cv2.getPerspectiveTransform(corners, target)
+        card = cv2.warpPerspective(img_np, matrix, (target_w, target_h))
+
+    if card.shape[0] > card.shape[1]:
+        card = cv2.rotate(card, cv2.ROTATE_90_CLOCKWISE)
+
+    if (card.shape[1], card.shape[0]) == tuple(size):
+        return card
+    return cv2.resize(card, tuple(size), interpolation=cv2.INTER_AREA)
+
+
+def crop_zone(card, zone):
+    x0, y0, x1, y1 = zone
+    height, width = card.shape[:2]
+    return card[int(y0 * height):int(y1 * height), int(x0 * width):int(x1 * width)]
+
+
+def get_cin_zones():
+    zones = dict(DEFAULT_CIN_ZONES)
+    zones.update(getattr(settings, 'CIN_ZONES', {}))
+    return zones
+
+
+def read_cin_zones(card, reader=None):
+    """
+    Recognise only the identity and CIN-number zones of a straightened card
+
+    Returns:
+        Tuple (identity lines, CIN number or None)
+    """
+    reader = reader or get_reader(get_ocr_languages())
+    zones = get_cin_zones()
+
+    identity = reader.readtext(crop_zone(card, zones['identite']), detail=0, paragraph=False)
+    identity_lines = [str(line).strip() for line in identity if str(line).strip()]
+
+    number_lines = reader.readtext(crop_zone(card, zones['numero']), detail=0, paragraph=False,
+                                   allowlist=CIN_NUMBER_ALLOWLIST)
+    cin = extract_cin([str(line).replace(' ', '') for line in number_lines])
+
+    return identity_lines, cin
+
+
+def get_cin_dpi_ladder():
+    return getattr(settings, 'CIN_OCR_DPI_LADDER', [200, 300])
+
+
+def scan_cin_roi(img, dpi_ladder=None, timings=None):
+    """
+    CIN-aware OCR: locate and straighten the card, then read only the useful zones
+
+    The card is read at the lowest resolution of the DPI ladder first and
+    straightened again at the next one only while the CIN number or the
+    birth date is missing. The card is read upright, then upside down when
+    the CIN number was not found; the first orientation giving the number is
+    the only one read at the next resolutions.
+
+    Returns:
+        Dict with 'lines' (identity zone text) and 'cin', or None when the zones gave nothing
+    """
+    print("🆔 Starting CIN zone OCR...")
+    with ocr_stage('decode'):
+        img_np = np.array(img.convert("RGB"))
+    with ocr_stage('rasterise'):
+        corners = find_card_corners(img_np)
+    reader = get_reader(get_ocr_languages())
+
+    best_score, best = 0, None
+    rotations = (None, cv2.ROTATE_180)
+    for dpi in dpi_ladder or get_cin_dpi_ladder():
+        started = time.perf_counter()
+        with ocr_stage('rasterise'):
+            card = straighten_card(img_np, corners, card_size_for_dpi(dpi))
+
+        for rotation in rotations:
+            attempt = card if rotation is None else cv2.rotate(card, rotation)
+            lines, cin = read_cin_zones(attempt, reader)
+            with ocr_stage('parse'):
+                score = bool(cin) + bool(extract_birth_date(lines))
+            if score > best_score:
+                best_score, best = score, {'lines': lines, 'cin': cin}
+            if cin:
+                # Right orientation, the other one is not read again
+                rotations = (rotation,)
+                break
+
+        found = best_score == 2
+        record_ocr_attempt(timings, 'cin', 'card', dpi, time.perf_counter() - started, found)
+        if found:
+            break
+
+    if best is not None:
+        print(f"Extracted {len(best['lines'])} identity lines from CIN zones.")
+    return best
+
+
 def extract_birth_date(lines):
     birth_date = None
     for i, line in enumerate(lines):
@@ -88,19 +270,52 @@ def extract_cin(lines):
     return None
 
 
-def extract_cin_data(image_bytes):
+def extract_cin_data(image_bytes, mode=None, dpi_ladder=None, timings=None):
+    """
+    Extract birth date, names and CIN number from a CIN photo
+
+    Args:
+        image_bytes: Image content as bytes
+        mode: 'roi' to read only the card zones (the whole image is read
+              for the fields they do not give) or 'full' for whole-image OCR.
+              Defaults to settings.CIN_OCR_MODE.
+        dpi_ladder: Zone OCR resolutions, defaults to settings.CIN_OCR_DPI_LADDER
+        timings: Optional list receiving the time of each zone OCR attempt
+    """
     # Convert bytes to PIL Image
     try:
-        img = Image.open(BytesIO(image_bytes))
+        with ocr_stage('decode'):
+            img = Image.open(BytesIO(image_bytes))
+            img.load()
     except Exception as e:
         print(f"Error opening image from bytes: {e}")
         return {}
-    
-    lines = scan_cin(img)
+
+    mode = mode or getattr(settings, 'CIN_OCR_MODE', 'roi')
+
+    zones = None
+    if mode == 'roi':
+        try:
+            zones = scan_cin_roi(img, dpi_ladder, timings)
+        except Exception as e:
+            print(f"⚠️ CIN zone OCR failed, falling back to full image: {e}")
+
+    lines = zones['lines'] if zones else []
+    with ocr_stage('parse'):
+        cin = (zones and zones['cin']) or extract_cin(lines)
+        birth_date = extract_birth_date(lines)
+        first_name, last_name = extract_name(lines)
+
+    if not (cin and birth_date and first_name and last_name):
+        # Fields the zones did not give are read on the whole image
+        lines = scan_cin(img)
+        with ocr_stage('parse'):
+            cin = cin or extract_cin(lines)
+            birth_date = birth_date or extract_birth_date(lines)
+            if not (first_name and last_name):
+                first_name, last_name = extract_name(lines)
+
     cin_data = {}
-    birth_date = extract_birth_date(lines)
-    first_name, last_name = extract_name(lines)
-    cin = extract_cin(lines)
     if birth_date:
         cin_data["date_naissance"] = birth_date
     if first_name:
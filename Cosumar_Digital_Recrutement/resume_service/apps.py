@@ -6,6 +6,20 @@ class ResumeServiceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'resume_service'
 
+    def ready(self):
+        from django.conf import settings
+
+        # Load the OCR models in the background so the first scan_cin / process_cv
+        # request of each worker does not pay for it
+        if getattr(settings, 'OCR_WARMUP', False):
+            from resume_service.ocr import warm_up_readers
+            threading.Thread(target=warm_up_readers, daemon=True).start()
+
+        # Same for the LibreOffice processes converting the stage documents to PDF
+        if getattr(settings, 'DOCX_PDF_WARMUP', False):
+            from resume_service.converters import warm_up_converter
+            threading.Thread(target=warm_up_converter, daemon=True).start()
+
     """
     def ready(self):
         if os.environ.get('RUN_MAIN') and os.environ.get('RUN_MAIN', None) != 'true':
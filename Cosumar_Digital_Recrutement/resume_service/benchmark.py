@@ -0,0 +1,239 @@
+import io
+import json
+import os
+import random
+import re
+import time
+import fitz
+from PIL import Image
+
+# Helpers shared by the OCR benchmark management commands: synthetic documents
+# (so the benchmarks run offline without real CINs or CVs), timing, accuracy
+# and baseline comparison.
+
+SYNTHETIC_IDENTITIES = [
+    ('Ahmed', 'Alaoui', '12.03.2001', 'AB123456'),
+    ('Fatima', 'Bennani', '05.11.1999', 'BE654321'),
+    ('Youssef', 'El Idrissi', '23.07.2002', 'J456789'),
+    ('Salma', 'Tazi', '30.01.2000', 'BK98765'),
+    ('Omar', 'Chraibi', '17.09.1998', 'C234567'),
+]
+
+
+def _rgb(r, g, b):
+    return (r / 255, g / 255, b / 255)
+
+
+def make_synthetic_cin(prenom, nom, birth_date, number, angle=0.0, on_background=True, seed=None):
+    """
+    Draw a CIN-like card (front side layout) and return it as JPEG bytes
+
+    The text lines follow the order the CIN parsers expect: first name, a
+    label, last name, "Né le", then the birth date; the number sits in the
+    bottom-left corner. The card is drawn with PyMuPDF so the built-in fonts
+    cover accented letters without any font installed on the machine.
+    """
+    rng = random.Random(seed)
+
+    document = fitz.open()
+    page = document.new_page(width=1000, height=630)
+    page.draw_rect(page.rect, color=None, fill=_rgb(236, 232, 220))
+    page.insert_text((300, 60), "ROYAUME DU MAROC", fontsize=34, color=_rgb(40, 40, 40))
+    page.insert_text((300, 105), "CARTE NATIONALE D'IDENTITE", fontsize=30, color=_rgb(40, 40, 40))
+    page.draw_rect(fitz.Rect(40, 130, 260, 400), color=None, fill=_rgb(170, 170, 175))
+
+    lines = [prenom.upper(), "Nom", nom.upper(), "Né le", birth_date]
+    for i, line in enumerate(lines):
+        page.insert_text((320, 175 + i * 55), line, fontsize=38, color=_rgb(10, 10, 10))
+
+    page.insert_text((40, 515), number, fontsize=48, color=_rgb(10, 10, 10))
+    page.insert_text((560, 505), "Valable jusqu'au 01.01.2034", fontsize=26, color=_rgb(60, 60, 60))
+
+    pixmap = page.get_pixmap()
+    card = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+    document.close()
+
+    image = card
+    if on_background:
+        background = Image.new("RGB", (1400, 1000), (rng.randint(20, 80),) * 3)
+        rotated = card.rotate(angle, expand=True, fillcolor=background.getpixel((0, 0)))
+        background.paste(rotated, ((1400 - rotated.width) // 2, (1000 - rotated.height) // 2))
+        image = background
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def synthetic_cin_corpus(count, seed=0):
+    """Return a list of (expected fields, jpeg bytes) for `count` synthetic CINs"""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        prenom, nom, birth_date, number = SYNTHETIC_IDENTITIES[i % len(SYNTHETIC_IDENTITIES)]
+        expected = {
+            'prenom': prenom.title(),
+            'nom': nom.title(),
+            'date_naissance': '-'.join(reversed(birth_date.split('.'))),
+            'cin': number,
+        }
+        corpus.append((expected, make_synthetic_cin(prenom, nom, birth_date, number,
+                                                    angle=rng.uniform(-6, 6), seed=i)))
+    return corpus
+
+
+SYNTHETIC_CONTACTS = [
+    ('ahmed.alaoui@gmail.com', '+212 6 12 34 56 78'),
+    ('f.bennani@outlook.fr', '06-54-32-10-98'),
+    ('youssef.elidrissi@emsi-edu.ma', '0701020304'),
+    ('salma_tazi@yahoo.fr', '+212612345678'),
+    ('o.chraibi@um5.ac.ma', '06 61 22 33 44'),
+]
+
+CV_FILLER = [
+    "Étudiant en génie industriel, à la recherche d'un stage de fin d'études.",
+    "Expérience : stage d'observation, maintenance des lignes de conditionnement.",
+    "Compétences : Python, Excel, SAP, gestion de production, lean manufacturing.",
+    "Langues : français, anglais, arabe.",
+    "Formation : licence en sciences et techniques, mention bien.",
+    "Projets : optimisation d'un stock de pièces de rechange, tableaux de bord.",
+]
+
+
+def make_synthetic_cv(prenom, nom, email, phone, pages=2, scanned=False, dpi=150, seed=None):
+    """
+    Build a CV-like PDF with the contact details on the first page
+
+    Args:
+        scanned: When True every page is replaced by a JPEG image of itself,
+                 so the PDF has no text layer and goes through OCR
+        dpi: Resolution of the scanned pages
+
+    Returns:
+        PDF bytes
+    """
+    rng = random.Random(seed)
+
+    document = fitz.open()
+    for page_number in range(pages):
+        page = document.new_page(width=595, height=842)
+        y = 80
+        if page_number == 0:
+            page.insert_text((60, y), f"{prenom} {nom.upper()}", fontsize=22)
+            y += 40
+            page.insert_text((60, y), f"Email : {email}", fontsize=12)
+            y += 20
+            page.insert_text((60, y), f"Tél : {phone}", fontsize=12)
+            y += 40
+        for line in rng.sample(CV_FILLER, len(CV_FILLER)):
+            page.insert_text((60, y), line, fontsize=11)
+            y += 24
+
+    if not scanned:
+        pdf_bytes = document.tobytes()
+        document.close()
+        return pdf_bytes
+
+    scanned_document = fitz.open()
+    zoom = dpi / 72
+    for page in document:
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY)
+        image = Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=75)
+        scanned_page = scanned_document.new_page(width=page.rect.width, height=page.rect.height)
+        scanned_page.insert_image(scanned_page.rect, stream=buffer.getvalue())
+    document.close()
+
+    pdf_bytes = scanned_document.tobytes()
+    scanned_document.close()
+    return pdf_bytes
+
+
+def synthetic_cv_corpus(count, seed=0):
+    """Return a list of (expected fields, pdf bytes) for `count` CVs, every other one scanned"""
+    corpus = []
+    for i in range(count):
+        prenom, nom = SYNTHETIC_IDENTITIES[i % len(SYNTHETIC_IDENTITIES)][:2]
+        email, phone = SYNTHETIC_CONTACTS[i % len(SYNTHETIC_CONTACTS)]
+        expected = {'email': email, 'phone': phone}
+        corpus.append((expected, make_synthetic_cv(prenom, nom, email, phone,
+                                                   scanned=bool(i % 2), seed=seed + i)))
+    return corpus
+
+
+def measure(func, *args, **kwargs):
+    """
+    Call func and measure it
+
+    Returns:
+        Tuple (result, wall seconds, CPU seconds of the whole process)
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+
+def normalize_field(key, value):
+    if value is None:
+        return ''
+    value = str(value).strip().lower()
+    if key == 'phone':
+        # +212 6.. and 06.. are the same number
+        return re.sub(r'\D', '', value)[-9:]
+    return value
+
+
+def field_accuracy(expected, found):
+    """Fraction of the expected fields that were extracted with the right value"""
+    if not expected:
+        return 1.0
+    found = found or {}
+    correct = sum(1 for key, value in expected.items()
+                  if normalize_field(key, found.get(key)) == normalize_field(key, value))
+    return correct / len(expected)
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(path, report):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def compare_to_baseline(report, baseline, tolerance=0.15):
+    """
+    List the regressions of a benchmark report against a stored one
+
+    A timing regresses when it is more than `tolerance` (relative) slower than
+    the baseline, accuracy and throughput when they are lower.
+
+    Returns:
+        List of human readable regression messages (empty when nothing regressed)
+    """
+    regressions = []
+    for kind, stats in report.items():
+        reference = baseline.get(kind)
+        if not reference:
+            continue
+
+        for stage, seconds in stats['stages'].items():
+            before = reference['stages'].get(stage)
+            # Ignore stages too short to be measured reliably
+            if before and max(seconds, before) > 0.001 and seconds > before * (1 + tolerance):
+                regressions.append(f"{kind} {stage}: {before * 1000:.1f} ms -> {seconds * 1000:.1f} ms per file")
+
+        if stats['throughput'] < reference['throughput'] * (1 - tolerance):
+            regressions.append(f"{kind} throughput: {reference['throughput']:.2f} -> {stats['throughput']:.2f} files/s")
+
+        if stats['accuracy'] < reference['accuracy'] - 1e-9:
+            regressions.append(f"{kind} accuracy: {reference['accuracy']:.0%} -> {stats['accuracy']:.0%}")
+
+    return regressions
@@ -0,0 +1,308 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from collections import Counter
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+# Storage of the uploaded and generated documents (CV, convention, CIN,
+# demande de stage...). A document is stored once under the SHA-256 of its
+# content, the database only keeps a reference to it in the Blob table with
+# its size, so Stage / Stagiaire rows stay small. Documents are stored on the
+# local filesystem by default; an S3 compatible bucket can be used instead
+# (boto3 must then be installed).
+# Identical documents (the same CV or CIN brought to successive stages) share
+# one blob; each Blob counts the documents referencing it, and the blobs no
+# longer referenced are deleted by `manage.py dedupe_documents --gc`.
+
+DEFAULT_BLOB_STORE = {
+    'BACKEND': 'local',      # 'local' or 's3'
+    'LOCATION': os.path.join(settings.BASE_DIR, 'blobs'),
+    'S3_BUCKET': '',
+    'S3_PREFIX': 'blobs/',
+    'S3_ENDPOINT_URL': None,  # e.g. a MinIO server
+    'S3_REGION': None,
+}
+
+# Bytes read at a time when a document is hashed or copied
+CHUNK_SIZE = 1024 * 1024
+
+
+class BlobNotFound(Exception):
+    """No document is stored under this key"""
+
+
+def get_store_config():
+    config = dict(DEFAULT_BLOB_STORE)
+    config.update(getattr(settings, 'BLOB_STORE', {}))
+    return config
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class LocalBlobStore:
+    """
+    Documents stored in a directory, as LOCATION/ab/cd/abcd...
+
+    Files are written to a temporary file and renamed, so a document is never
+    seen half written, and are never modified afterwards.
+    """
+
+    def __init__(self, config):
+        self.location = config['LOCATION']
+
+    def path(self, key):
+        return os.path.join(self.location, key[:2], key[2:4], key)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def put(self, key, data):
+        self.put_file(key, io.BytesIO(data))
+
+    def put_file(self, key, source):
+        """Store a document read by chunks from a binary file object"""
+        path = self.path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def open(self, key, start=0, end=None):
+        """Binary file object of a document positioned at start, the caller closes it"""
+        try:
+            f = open(self.path(key), 'rb')
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+        if start:
+            f.seek(start)
+        return f
+
+    def read(self, key):
+        with self.open(key) as f:
+            return f.read()
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3BlobStore:
+    """Documents stored in an S3 compatible bucket, as S3_PREFIX + key"""
+
+    def __init__(self, config):
+        try:
+            import boto3
+        except ImportError:
+            raise ImproperlyConfigured("BLOB_STORE BACKEND 's3' requires boto3 (pip install boto3)")
+        if not config['S3_BUCKET']:
+            raise ImproperlyConfigured("BLOB_STORE BACKEND 's3' requires S3_BUCKET")
+
+        self.bucket = config['S3_BUCKET']
+        self.prefix = config['S3_PREFIX']
+        # Credentials come from the usual AWS environment variables / files
+        self.client = boto3.client('s3', endpoint_url=config['S3_ENDPOINT_URL'], region_name=config['S3_REGION'])
+
+    def object_key(self, key):
+        return f"{self.prefix}{key}"
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def put(self, key, data):
+        if not self.exists(key):
+            self.client.put_object(Bucket=self.bucket, Key=self.object_key(key), Body=data)
+
+    def put_file(self, key, source):
+        """Store a document read by chunks from a binary file object (multipart upload when large)"""
+        if not self.exists(key):
+            self.client.upload_fileobj(source, self.bucket, self.object_key(key))
+
+    def open(self, key, start=0, end=None):
+        """Body of a document, only bytes start to end (inclusive) are fetched when given"""
+        from botocore.exceptions import ClientError
+
+        extra = {}
+        if start or end is not None:
+            extra['Range'] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.object_key(key), **extra)['Body']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                raise BlobNotFound(key)
+            raise
+
+    def read(self, key):
+        body = self.open(key)
+        try:
+            return body.read()
+        finally:
+            body.close()
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+
+BACKENDS = {
+    'local': LocalBlobStore,
+    's3': S3BlobStore,
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store():
+    """Blob store configured by settings.BLOB_STORE, created once per process"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = get_store_config()
+                backend_class = BACKENDS.get(config['BACKEND'])
+                if backend_class is None:
+                    raise ImproperlyConfigured(f"Unknown BLOB_STORE BACKEND: {config['BACKEND']}")
+                _store = backend_class(config)
+    return _store
+
+
+def store_blob(data):
+    """
+    Store a document and return its Blob row
+
+    Storing the same content again returns the existing Blob.
+    """
+    data = bytes(data)
+    key = content_hash(data)
+    return save_blob(key, len(data), lambda store: store.put(key, data))
+
+
+def save_blob(key, size, write):
+    """
+    Write a document to the store and return its Blob row, marked as stored now
+
+    The row is locked while the file is written. The unreferenced blobs are
+    deleted under the same lock and only when they were not stored recently,
+    so the file of a blob reused meanwhile is never deleted, and a file
+    deleted just before is written again.
+
+    Args:
+        write: Function writing the document to the store given as argument,
+            it must not overwrite a file already stored
+    """
+    from .models import Blob
+
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(sha256=key).first()
+        write(get_blob_store())
+        if blob is None:
+            blob, _ = Blob.objects.get_or_create(sha256=key, defaults={'taille': size})
+        else:
+            blob.last_stored_at = timezone.now()
+            blob.save(update_fields=['last_stored_at'])
+    return blob
+
+
+def add_blob_references(added, removed=()):
+    """
+    Update the reference counts of blobs
+
+    Args:
+        added: Keys of the blobs referenced once more (None values are ignored)
+        removed: Keys of the blobs referenced once less
+    """
+    from .models import Blob
+
+    deltas = Counter(key for key in added if key)
+    deltas.subtract(key for key in removed if key)
+    for key, delta in deltas.items():
+        if delta:
+            Blob.objects.filter(sha256=key).update(references=F('references') + delta)
+
+
+def store_blob_file(source, key=None, size=None):
+    """
+    Store a document read by chunks from a binary file object (e.g. an
+    uploaded file) and return its Blob row, the document is never held
+    whole in memory
+
+    Args:
+        source: Seekable binary file object, read from the start
+        key, size: SHA-256 and size of the content when already computed,
+            the file is then read only once
+    """
+    if key is None or size is None:
+        digest = hashlib.sha256()
+        size = 0
+        source.seek(0)
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+        key = digest.hexdigest()
+
+    def write(store):
+        source.seek(0)
+        store.put_file(key, source)
+
+    return save_blob(key, size, write)
+
+
+def read_blob(key):
+    """Content of a stored document"""
+    return get_blob_store().read(key)
+
+
+def open_blob(key):
+    """Binary file object of a stored document, to read it by chunks"""
+    return get_blob_store().open(key)
+
+
+def iter_blob(key, start=0, end=None, chunk_size=CHUNK_SIZE):
+    """
+    Yield a stored document chunk by chunk
+
+    Args:
+        key: SHA-256 of the document
+        start: First byte yielded
+        end: Last byte yielded (inclusive), the end of the document by default
+    """
+    f = get_blob_store().open(key, start, end)
+    try:
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
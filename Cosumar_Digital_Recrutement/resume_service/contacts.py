@@ -0,0 +1,133 @@
+import re
+from collections import namedtuple
+
+# Single-pass scanner for the contact details of a CV.
+# The text is walked once from left to right, jumping from one anchor
+# character to the next: every email contains an "@" and every phone number
+# starts with "+" or "0". Each anchor is then checked with small precompiled
+# patterns matched in place, so most of the text is never looked at by a
+# regex. Phones are normalised to E.164 (+212XXXXXXXXX) whatever the way they
+# were written.
+
+ANCHOR_PATTERN = re.compile(r'[@+0]')
+
+# Local part of an email, ending right before the "@"
+EMAIL_LOCAL_PATTERN = re.compile(r'[a-zA-Z0-9_.+-]+\Z')
+EMAIL_DOMAIN_PATTERN = re.compile(r'[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+')
+MAX_EMAIL_LOCAL_LENGTH = 64
+
+# +212 / 00212 / 0, then a 5-8 prefix and 8 digits, with optional separators
+PHONE_PATTERN = re.compile(r"""
+    # A date followed by digits (05.11.1999 12...) is not a phone number,
+    # whether it would start at its day or at its month
+    (?!\d\d(?P<date_separator>[./-])\d\d(?P=date_separator)\d{4})
+    (?!(?<=\d\d[./-])\d\d[./-]\d{4})
+    (?:
+        (?:\+|00)[-\s.]{0,2}212[-\s.]{0,2}(?:\(0\)[-\s.]{0,2})?
+      | 0
+    )
+    (?P<first>[5-8])
+    (?P<rest>(?:[-\s.]{0,2}\d){8})
+    (?!\d)
+    # Digits that are the local part of an email are not a phone number
+    (?![a-zA-Z0-9_.+-]*@)
+""", re.VERBOSE)
+
+NON_DIGITS = re.compile(r'\D')
+
+Contact = namedtuple('Contact', ['kind', 'value', 'raw', 'start', 'end'])
+
+
+def _e164(match):
+    return '+212' + match.group('first') + NON_DIGITS.sub('', match.group('rest'))
+
+
+def scan_contacts(text):
+    """
+    Yield the emails and phone numbers of a text, in reading order
+
+    Yields:
+        Contact(kind, value, raw, start, end) where kind is 'email' or 'phone',
+        value the email or the E.164 phone number, raw the matched text and
+        start / end its position in the text
+    """
+    search_anchor = ANCHOR_PATTERN.search
+    position = 0
+    # End of the last contact found, a local part cannot start before it
+    last_end = 0
+
+    while True:
+        anchor = search_anchor(text, position)
+        if anchor is None:
+            return
+
+        index = anchor.start()
+        char = text[index]
+
+        if char == '@':
+            local = EMAIL_LOCAL_PATTERN.search(text, max(last_end, index - MAX_EMAIL_LOCAL_LENGTH), index)
+            domain = EMAIL_DOMAIN_PATTERN.match(text, index + 1)
+            if local and domain:
+                email = text[local.start():domain.end()]
+                yield Contact('email', email, email, local.start(), domain.end())
+                position = last_end = domain.end()
+                continue
+
+        # A phone number does not start in the middle of another number
+        elif index == 0 or not (text[index - 1].isdigit() or text[index - 1] == '+'):
+            phone = PHONE_PATTERN.match(text, index)
+            if phone:
+                yield Contact('phone', _e164(phone), phone.group(), index, phone.end())
+                position = last_end = phone.end()
+                continue
+
+        position = index + 1
+
+
+def to_e164(phone):
+    """
+    Normalise a Moroccan phone number to E.164
+
+    Returns:
+        '+212XXXXXXXXX', or None when the text is not a Moroccan number
+    """
+    match = PHONE_PATTERN.fullmatch(str(phone).strip())
+    if match is None:
+        return None
+    return _e164(match)
+
+
+def extract_contacts(text):
+    """
+    Emails and phone numbers of a text, without duplicates, in reading order
+
+    Returns:
+        Dict with 'emails' and 'phones' (E.164) lists
+    """
+    contacts = {'email': [], 'phone': []}
+    for contact in scan_contacts(text):
+        if contact.value not in contacts[contact.kind]:
+            contacts[contact.kind].append(contact.value)
+    return {'emails': contacts['email'], 'phones': contacts['phone']}
+
+
+def first_contacts(text, email=None, phone=None):
+    """
+    Fill the missing email / phone with the first ones of the text
+
+    The scan stops as soon as both are known.
+
+    Returns:
+        Tuple (email, phone)
+    """
+    if email and phone:
+        return email, phone
+
+    for contact in scan_contacts(text):
+        if contact.kind == 'email' and email is None:
+            email = contact.value
+        elif contact.kind == 'phone' and phone is None:
+            phone = contact.value
+        if email and phone:
+            break
+    return email, phone
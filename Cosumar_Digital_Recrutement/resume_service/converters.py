@@ -0,0 +1,426 @@
+import atexit
+import os
+import queue
+import shlex
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import xmlrpc.client
+from collections import deque
+
+# DOCX -> PDF conversion.
+# On Linux the documents are converted by a pool of persistent headless
+# LibreOffice processes, each one wrapped by an unoserver XML-RPC server and
+# using its own user profile. The processes are started once per worker
+# process and reused, so a conversion does not pay for the LibreOffice
+# start-up. Jobs wait in a bounded queue for a free process, have a timeout,
+# and a process that crashed or timed out is restarted in the background.
+# On Windows, docx2pdf drives Microsoft Word through COM.
+
+
+class ConverterError(Exception):
+    """The document could not be converted"""
+
+
+class ConverterBusy(ConverterError):
+    """Every process is busy and the waiting queue is full"""
+
+
+class ConversionTimeout(ConverterError):
+    """The conversion took longer than the job timeout"""
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class _TimeoutTransport(xmlrpc.client.Transport):
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        return connection
+
+
+class LibreOfficeProcess:
+    """
+    One headless LibreOffice process behind an unoserver XML-RPC server
+
+    Args:
+        index: Position in the pool, shown in logs
+        command: Command starting unoserver, e.g. ['python3', '-m', 'unoserver.server']
+        startup_timeout: Seconds to wait for the server to accept connections
+    """
+
+    def __init__(self, index, command, startup_timeout=30):
+        self.index = index
+        self.command = command
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.port = None
+        # Kept across restarts: a profile is only created once
+        self.profile_dir = tempfile.mkdtemp(prefix=f'lo-profile-{index}-')
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        self.port = _free_port()
+        uno_port = _free_port()
+        command = self.command + [
+            '--interface', '127.0.0.1',
+            '--port', str(self.port),
+            '--uno-port', str(uno_port),
+            '--user-installation', 'file://' + self.profile_dir,
+        ]
+        print(f"⏳ Starting LibreOffice converter #{self.index} on port {self.port}...")
+        started = time.monotonic()
+        # Own process group, so that soffice is killed with unoserver
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                        start_new_session=True)
+
+        deadline = started + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise ConverterError(
+                    f"LibreOffice converter #{self.index} exited with code {self.process.returncode}"
+                )
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=1):
+                    print(f"✅ LibreOffice converter #{self.index} ready in {time.monotonic() - started:.1f}s")
+                    return
+            except OSError:
+                time.sleep(0.2)
+
+        self.stop()
+        raise ConverterError(f"LibreOffice converter #{self.index} did not start in {self.startup_timeout}s")
+
+    def stop(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+                self.process.wait()
+            except ProcessLookupError:
+                pass
+        self.process = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def convert(self, docx_bytes: bytes, timeout: float) -> bytes:
+        proxy = xmlrpc.client.ServerProxy(f'http://127.0.0.1:{self.port}', allow_none=True,
+                                          transport=_TimeoutTransport(timeout))
+        # convert(inpath, indata, outpath, convert_to)
+        result = proxy.convert(None, xmlrpc.client.Binary(docx_bytes), None, 'pdf')
+        if result is None:
+            raise ConverterError("LibreOffice returned no document")
+        return result.data
+
+    def close(self):
+        self.stop()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+
+class LibreOfficePool:
+    """
+    Pool of persistent LibreOffice processes converting DOCX to PDF
+
+    Args:
+        size: Number of LibreOffice processes
+        queue_size: Jobs allowed to wait for a free process, more are rejected with ConverterBusy
+        job_timeout: Seconds a conversion may take before its process is restarted
+        queue_timeout: Seconds a job may wait for a free process
+        command: Command starting one unoserver server
+        startup_timeout: Seconds a process may take to start
+    """
+
+    def __init__(self, size=2, queue_size=8, job_timeout=60, queue_timeout=30,
+                 command=None, startup_timeout=30):
+        self.size = size
+        self.job_timeout = job_timeout
+        self.queue_timeout = queue_timeout
+        command = command or ['python3', '-m', 'unoserver.server']
+        self.processes = [LibreOfficeProcess(index, command, startup_timeout) for index in range(size)]
+
+        # Free processes, and tickets for the running + waiting jobs
+        self._free = queue.Queue()
+        for process in self.processes:
+            self._free.put(process)
+        self._tickets = threading.BoundedSemaphore(size + queue_size)
+
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._counters = dict.fromkeys(
+            ['conversions', 'failures', 'timeouts', 'rejected', 'restarts', 'waiting', 'running'], 0
+        )
+        self._convert_seconds = 0.0
+        self._wait_seconds = 0.0
+        # Durations of the last conversions, for the percentiles
+        self._recent = deque(maxlen=200)
+
+    def _count(self, name, increment=1):
+        with self._lock:
+            self._counters[name] += increment
+
+    def warm_up(self):
+        """Start the free processes that are not running yet"""
+        # Taken from the free queue, so that no job uses a process while it starts
+        for _ in range(self.size):
+            try:
+                process = self._free.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if not process.is_alive():
+                    process.start()
+            except ConverterError as e:
+                print(f"⚠️ {e}")
+            finally:
+                self._free.put(process)
+
+    def _restart_and_release(self, process):
+        try:
+            process.restart()
+        except ConverterError as e:
+            # Started again on its next job
+            print(f"⚠️ {e}")
+        finally:
+            self._free.put(process)
+
+    def convert(self, docx_bytes: bytes) -> bytes:
+        """
+        Convert a DOCX document to PDF
+
+        Raises:
+            ConverterBusy: The queue is full, or no process was freed in time
+            ConversionTimeout: The conversion took longer than job_timeout
+            ConverterError: LibreOffice failed to convert the document
+        """
+        if not self._tickets.acquire(blocking=False):
+            self._count('rejected')
+            raise ConverterBusy("Every DOCX to PDF converter is busy and the queue is full")
+
+        try:
+            self._count('waiting')
+            waited = time.monotonic()
+            try:
+                process = self._free.get(timeout=self.queue_timeout)
+            except queue.Empty:
+                self._count('rejected')
+                raise ConverterBusy(f"No DOCX to PDF converter was free within {self.queue_timeout}s")
+            finally:
+                self._count('waiting', -1)
+            waited = time.monotonic() - waited
+
+            self._count('running')
+            started = time.monotonic()
+            restart = False
+            try:
+                if not process.is_alive():
+                    if process.process is not None:
+                        print(f"⚠️ LibreOffice converter #{process.index} crashed, restarting it")
+                        self._count('restarts')
+                    process.start()
+                    # Start-up is not part of the conversion latency
+                    started = time.monotonic()
+
+                pdf_bytes = process.convert(docx_bytes, self.job_timeout)
+
+            except socket.timeout:
+                restart = True
+                self._count('timeouts')
+                raise ConversionTimeout(f"DOCX to PDF conversion took more than {self.job_timeout}s")
+            except xmlrpc.client.Fault as e:
+                # The document was refused, the process itself is fine
+                self._count('failures')
+                raise ConverterError(f"LibreOffice could not convert the document: {e.faultString}")
+            except (OSError, xmlrpc.client.ProtocolError) as e:
+                restart = True
+                self._count('failures')
+                raise ConverterError(f"LibreOffice converter #{process.index} failed: {e}")
+            except ConverterError:
+                self._count('failures')
+                raise
+
+            else:
+                seconds = time.monotonic() - started
+                with self._lock:
+                    self._counters['conversions'] += 1
+                    self._convert_seconds += seconds
+                    self._wait_seconds += waited
+                    self._recent.append(seconds)
+                return pdf_bytes
+
+            finally:
+                self._count('running', -1)
+                if restart:
+                    self._count('restarts')
+                    threading.Thread(target=self._restart_and_release, args=(process,), daemon=True).start()
+                else:
+                    self._free.put(process)
+
+        finally:
+            self._tickets.release()
+
+    def metrics(self):
+        """Counters, mean / p50 / p95 durations and throughput since the pool was created"""
+        with self._lock:
+            counters = dict(self._counters)
+            recent = sorted(self._recent)
+            convert_seconds = self._convert_seconds
+            wait_seconds = self._wait_seconds
+
+        uptime = time.monotonic() - self._started_at
+        conversions = counters['conversions']
+
+        def percentile(fraction):
+            if not recent:
+                return None
+            return recent[min(len(recent) - 1, int(fraction * len(recent)))]
+
+        return {
+            'backend': 'libreoffice',
+            'size': self.size,
+            'alive': sum(1 for process in self.processes if process.is_alive()),
+            **counters,
+            'mean_seconds': convert_seconds / conversions if conversions else None,
+            'mean_wait_seconds': wait_seconds / conversions if conversions else None,
+            'p50_seconds': percentile(0.5),
+            'p95_seconds': percentile(0.95),
+            'uptime_seconds': uptime,
+            'conversions_per_minute': conversions * 60 / uptime if uptime else 0.0,
+        }
+
+    def shutdown(self):
+        for process in self.processes:
+            process.close()
+
+
+class Docx2PdfConverter:
+    """Microsoft Word through COM (Windows only)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(['conversions', 'failures'], 0)
+        self._convert_seconds = 0.0
+
+    def warm_up(self):
+        pass
+
+    def convert(self, docx_bytes: bytes) -> bytes:
+        import pythoncom
+        from docx2pdf import convert
+
+        started = time.monotonic()
+        # Initialize COM for the current thread (Windows requirement)
+        pythoncom.CoInitialize()
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                docx_path = os.path.join(temp_dir, 'document.docx')
+                pdf_path = os.path.join(temp_dir, 'document.pdf')
+                with open(docx_path, 'wb') as f:
+                    f.write(docx_bytes)
+                convert(docx_path, pdf_path)
+                with open(pdf_path, 'rb') as f:
+                    pdf_bytes = f.read()
+        except Exception as e:
+            with self._lock:
+                self._counters['failures'] += 1
+            raise ConverterError(f"Word could not convert the document: {e}")
+        finally:
+            # Always uninitialize COM
+            pythoncom.CoUninitialize()
+
+        with self._lock:
+            self._counters['conversions'] += 1
+            self._convert_seconds += time.monotonic() - started
+        return pdf_bytes
+
+    def metrics(self):
+        with self._lock:
+            conversions = self._counters['conversions']
+            return {
+                'backend': 'docx2pdf',
+                **self._counters,
+                'mean_seconds': self._convert_seconds / conversions if conversions else None,
+            }
+
+    def shutdown(self):
+        pass
+
+
+_converter = None
+_converter_lock = threading.Lock()
+
+
+def get_pdf_converter():
+    """
+    Return the DOCX to PDF converter of this process, creating it on first use
+
+    The backend is chosen by settings.DOCX_PDF_BACKEND ('libreoffice' or 'docx2pdf').
+    """
+    global _converter
+    if _converter is not None:
+        return _converter
+
+    with _converter_lock:
+        if _converter is None:
+            from django.conf import settings
+
+            backend = getattr(settings, 'DOCX_PDF_BACKEND', 'libreoffice')
+            if backend == 'docx2pdf':
+                _converter = Docx2PdfConverter()
+            elif backend == 'libreoffice':
+                options = getattr(settings, 'LIBREOFFICE_POOL', {})
+                command = options.get('COMMAND')
+                _converter = LibreOfficePool(
+                    size=options.get('SIZE', 2),
+                    queue_size=options.get('QUEUE_SIZE', 8),
+                    job_timeout=options.get('JOB_TIMEOUT', 60),
+                    queue_timeout=options.get('QUEUE_TIMEOUT', 30),
+                    command=shlex.split(command) if isinstance(command, str) else command,
+                    startup_timeout=options.get('STARTUP_TIMEOUT', 30),
+                )
+                atexit.register(_converter.shutdown)
+            else:
+                raise ConverterError(f"Unknown DOCX_PDF_BACKEND '{backend}'")
+    return _converter
+
+
+def convert_docx_to_pdf(docx_bytes: bytes) -> bytes:
+    """
+    Convert DOCX bytes to PDF bytes with the configured backend
+
+    Raises:
+        ConverterError (or its ConverterBusy / ConversionTimeout subclasses)
+    """
+    return get_pdf_converter().convert(docx_bytes)
+
+
+def warm_up_converter():
+    """Start the converter processes ahead of the first conversion"""
+    try:
+        get_pdf_converter().warm_up()
+    except Exception as e:
+        print(f"⚠️ DOCX to PDF converter warm-up failed: {e}")
+
+
+def shutdown_converter():
+    """Stop the converter processes of this process"""
+    if _converter is not None:
+        _converter.shutdown()
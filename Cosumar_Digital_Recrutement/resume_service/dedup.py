@@ -0,0 +1,145 @@
+from collections import Counter
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+from .blobstore import get_blob_store
+
+# Deduplication of the stage / stagiaire documents.
+# A document is stored once per content (see blobstore), the same CV or CIN
+# brought to successive stages is a single blob referenced by every stage.
+# Blob.references counts these references; it is kept up to date when a row is
+# saved or deleted and recounted from the document columns by
+# `manage.py dedupe_documents`, which also moves the documents still copied in
+# the binary columns to the blob store and deletes the blobs no longer used.
+
+
+def document_fields():
+    """(model, document name) of every document kept in the blob store"""
+    from .models import Stage, Stagiaire
+
+    return [(Stagiaire, name) for name in Stagiaire.BLOB_DOCUMENTS] + \
+        [(Stage, name) for name in Stage.BLOB_DOCUMENTS]
+
+
+def count_references():
+    """{blob key: documents referencing it}, counted from the document columns"""
+    counts = Counter()
+    for model, name in document_fields():
+        rows = model.objects.filter(**{f'{name}_blob__isnull': False}).values_list(f'{name}_blob').annotate(
+            documents=Count('pk')
+        )
+        counts.update(dict(rows))
+    return counts
+
+
+def recount_references(batch_size=500):
+    """
+    Set the reference count of every blob from the document columns
+
+    Returns:
+        Number of blobs whose count was wrong
+    """
+    from .models import Blob
+
+    counts = count_references()
+    corrected = []
+    for blob in Blob.objects.only('sha256', 'references').iterator(chunk_size=batch_size):
+        expected = counts.get(blob.sha256, 0)
+        if blob.references != expected:
+            blob.references = expected
+            corrected.append(blob)
+    Blob.objects.bulk_update(corrected, ['references'], batch_size=batch_size)
+    return len(corrected)
+
+
+def is_referenced(key):
+    """Whether a document column references a blob, whatever its count says"""
+    return any(model.objects.filter(**{f'{name}_blob': key}).exists() for model, name in document_fields())
+
+
+def unreferenced_blobs(grace):
+    """Blobs referenced by no document and not stored for more than grace seconds"""
+    from .models import Blob, Upload
+
+    return Blob.objects.filter(
+        references__lte=0,
+        last_stored_at__lt=timezone.now() - timedelta(seconds=grace),
+    ).exclude(
+        # Finished uploads not attached yet
+        sha256__in=Upload.objects.filter(blob__isnull=False).values('blob')
+    )
+
+
+def delete_unreferenced_blobs(grace, limit=None):
+    """
+    Delete the blobs referenced by no document from the table and the store
+
+    Args:
+        grace: Seconds a blob is kept after it was last stored, so a
+            document stored but not yet attached to its row is not deleted
+        limit: Stop after this many blobs
+
+    Returns:
+        Tuple (blobs deleted, bytes freed)
+    """
+    deleted = freed = 0
+    for key in list(unreferenced_blobs(grace).values_list('sha256', flat=True)[:limit]):
+        with transaction.atomic():
+            # Same lock as save_blob: a blob stored again is either seen here
+            # with its new last_stored_at, or written again once deleted
+            blob = unreferenced_blobs(grace).select_for_update().filter(sha256=key).first()
+            # Stored or referenced again meanwhile, or a count out of date
+            if blob is None or is_referenced(key):
+                continue
+            get_blob_store().delete(key)
+            blob.delete()
+        deleted += 1
+        freed += blob.taille
+    return deleted, freed
+
+
+def dedup_report():
+    """
+    Space used by the documents and saved by the deduplication
+
+    document_bytes is what the documents would take with one copy each,
+    stored_bytes what their blobs take; saved_bytes is the difference.
+    """
+    from .models import Blob
+
+    totals = Blob.objects.aggregate(
+        blobs=Count('sha256'),
+        shared_blobs=Count('sha256', filter=Q(references__gt=1)),
+        documents=Sum('references', filter=Q(references__gt=0)),
+        document_bytes=Sum(F('taille') * F('references'), filter=Q(references__gt=0)),
+        stored_bytes=Sum('taille', filter=Q(references__gt=0)),
+        unreferenced_blobs=Count('sha256', filter=Q(references__lte=0)),
+        unreferenced_bytes=Sum('taille', filter=Q(references__lte=0)),
+    )
+    report = {key: value or 0 for key, value in totals.items()}
+    report['saved_bytes'] = report['document_bytes'] - report['stored_bytes']
+    report['saved_ratio'] = round(report['saved_bytes'] / report['document_bytes'], 4) if report['document_bytes'] else 0
+
+    report['by_document'] = {}
+    report['legacy_documents'] = report['legacy_bytes'] = 0
+    for model, name in document_fields():
+        label = f"{model._meta.model_name}.{name}"
+        stored = model.objects.filter(**{f'{name}_blob__isnull': False}).aggregate(
+            documents=Count('pk'), bytes=Sum(f'{name}_blob__taille'), blobs=Count(f'{name}_blob', distinct=True)
+        )
+        # Still copied in the binary column, see migrate_blobs
+        legacy = model.objects.filter(**{f'{name}__isnull': False}).aggregate(
+            documents=Count('pk'), bytes=Sum(Length(name))
+        )
+        report['by_document'][label] = {
+            'documents': stored['documents'],
+            'blobs': stored['blobs'],
+            'bytes': stored['bytes'] or 0,
+            'legacy_documents': legacy['documents'],
+            'legacy_bytes': legacy['bytes'] or 0,
+        }
+        report['legacy_documents'] += legacy['documents']
+        report['legacy_bytes'] += legacy['bytes'] or 0
+    return report
@@ -0,0 +1,428 @@
+import io
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import fitz
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .template_registry import DEMANDE_DE_STAGE, get_template, get_template_registry
+from .render_cache import render_docx, render_pdf
+
+# Demande de stage documents.
+# The PDF is converted from the filled DOCX template once, when the stage is
+# created. The signature fields that are still empty are rendered with a
+# short anchor token instead of a blank: the tokens are located in the PDF,
+# their position is stored in demande_de_stage_data['pdf_fields'] and they
+# are erased. Signing then writes the name / date at those anchors with
+# PyMuPDF and appends the change to the PDF (incremental save), without
+# filling the template nor converting it to PDF again.
+# creer_stage does not wait for the conversion: the rendering runs in a
+# background thread once the stage is committed, demande_de_stage_statut
+# tells whether it is pending, ready or failed.
+# Rendering the same values again (a retried signature, a document rendered
+# again by get_stage_document) is served by render_cache. The template is the
+# active version for the nature of the stage (see template_registry).
+
+# (name, date, signature) placeholders filled by each signature
+SIGNATURE_PLACEHOLDERS = {
+    'encadrant': ('«NOM_ENCADRANT»', '«DATE_SIGNATURE_ENCADRANT»', '«SIGNATURE_ENCADRANT»'),
+    'responsable_de_service': ('«NOM_RESPONSABLE_SERVICE»', '«DATE_SIGNATURE_RESPONSABLE_SERVICE»',
+                               '«SIGNATURE_RESPONSABLE_SERVICE»'),
+    'responsable_rh': (None, '«DATE_SIGNATURE_RH»', '«SIGNATURE_RH»'),
+}
+
+# Anchor token of each signature placeholder: short, plain ASCII and unlikely in a document
+ANCHOR_TOKENS = {
+    placeholder: f'#SIG{index:02d}#'
+    for index, placeholder in enumerate(
+        placeholder for placeholders in SIGNATURE_PLACEHOLDERS.values() for placeholder in placeholders if placeholder
+    )
+}
+
+# Span flag of bold text in PyMuPDF
+BOLD_FLAG = 16
+
+
+def demande_template(stage):
+    """Compiled demande de stage template for the nature of the stage"""
+    return get_template(DEMANDE_DE_STAGE, stage.nature)
+
+
+def demande_template_available(stage):
+    """Whether a demande de stage template can be rendered for the stage"""
+    return get_template_registry().is_available(DEMANDE_DE_STAGE, stage.nature)
+
+
+def demande_replacements(stage):
+    """Values of the demande de stage placeholders, signature fields left empty"""
+    stage.update_document_data()
+    document_data = stage.demande_de_stage_data.get('document_data', {})
+    stagiaire = stage.stagiaire
+
+    replacements = {
+        '«NOM»': document_data.get('nom', ''),
+        '«PRENOM»': document_data.get('prenom', ''),
+        '«CIN»': document_data.get('cin', ''),
+        '«EMAIL»': stagiaire.email if stagiaire.email else '',
+        '«TELEPHONE»': document_data.get('telephone', ''),
+        '«DATE_NAISSANCE»': stagiaire.date_naissance.strftime('%d/%m/%Y') if stagiaire.date_naissance else '',
+        '«NATURE»': stage.nature.upper() if stage.nature else '',
+        '«DATE_DEBUT»': document_data.get('periode_du', ''),
+        '«DATE_FIN»': document_data.get('periode_au', ''),
+        '«PERIODE_DU»': document_data.get('periode_du', ''),
+        '«PERIODE_AU»': document_data.get('periode_au', ''),
+        '«PERIODE_ACCORDEE_DU»': document_data.get('periode_accordee_du', ''),
+        '«PERIODE_ACCORDEE_AU»': document_data.get('periode_accordee_au', ''),
+        '«SUJET»': document_data.get('sujet', ''),
+        '«DESCRIPTION_SUJET»': stage.sujet.description if stage.sujet and stage.sujet.description else '',
+        '«DATE_DEMANDE»': stage.created_at.strftime('%d/%m/%Y') if stage.created_at else '',
+        '«SPECIALITE»': document_data.get('specialite', ''),
+        '«ETABLISSEMENT»': document_data.get('etablissement', ''),
+        '«DIRECTION»': '',
+        '«ENCADRANT»': document_data.get('encadrant', ''),
+        '«SERVICE»': document_data.get('service', ''),
+    }
+    for placeholder in ANCHOR_TOKENS:
+        replacements[placeholder] = ''
+    return replacements
+
+
+def signature_values(stage):
+    """Values of the signature placeholders for the signatures recorded on the stage"""
+    signatures = (stage.demande_de_stage_data or {}).get('signatures', {})
+    values = {}
+
+    for role, placeholders in SIGNATURE_PLACEHOLDERS.items():
+        signature = signatures.get(role)
+        if not signature:
+            continue
+        name_placeholder, date_placeholder, signature_placeholder = placeholders
+        if name_placeholder:
+            values[name_placeholder] = signature['full_name']
+        values[date_placeholder] = signature['signed_at']
+        values[signature_placeholder] = signature['full_name']
+
+    # The chef de département signature shows the encadrant as responsable du service
+    encadrant = signatures.get('encadrant')
+    if signatures.get('chef_departement') and encadrant and not signatures.get('responsable_de_service'):
+        for placeholder, key in zip(SIGNATURE_PLACEHOLDERS['responsable_de_service'],
+                                    ('full_name', 'signed_at', 'full_name')):
+            values[placeholder] = encadrant[key]
+
+    return values
+
+
+def find_anchors(doc, tokens):
+    """
+    Locate anchor tokens in a PDF
+
+    Args:
+        doc: Open fitz document
+        tokens: Dictionary of {placeholder: token}
+
+    Returns:
+        Dictionary of {placeholder: [anchor, ...]} where an anchor is a dict
+        with the page, the text origin (x, baseline y), the font size, whether
+        the text is bold and the rectangle of the token
+    """
+    anchors = {}
+    for page in doc:
+        spans = [
+            span
+            for block in page.get_text('dict')['blocks'] if block.get('type') == 0
+            for line in block['lines']
+            for span in line['spans']
+        ]
+        for placeholder, token in tokens.items():
+            for rect in page.search_for(token):
+                center = fitz.Point((rect.x0 + rect.x1) / 2, (rect.y0 + rect.y1) / 2)
+                span = next((s for s in spans if token in s['text'] and center in fitz.Rect(s['bbox'])), None)
+                if span is None:
+                    continue
+                anchors.setdefault(placeholder, []).append({
+                    'page': page.number,
+                    'x': rect.x0,
+                    'y': span['origin'][1],
+                    'size': round(span['size'], 2),
+                    'bold': bool(span['flags'] & BOLD_FLAG),
+                    'rect': [rect.x0, rect.y0, rect.x1, rect.y1],
+                })
+    return anchors
+
+
+def prepare_base_pdf(pdf_bytes, tokens):
+    """
+    Locate the anchor tokens of a freshly converted PDF and erase them
+
+    Returns:
+        Tuple (pdf bytes without the tokens, anchors as returned by find_anchors)
+    """
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        anchors = find_anchors(doc, tokens)
+        pages = {}
+        for placeholder_anchors in anchors.values():
+            for anchor in placeholder_anchors:
+                pages.setdefault(anchor['page'], []).append(anchor)
+
+        for page_number, page_anchors in pages.items():
+            page = doc[page_number]
+            for anchor in page_anchors:
+                page.add_redact_annot(fitz.Rect(anchor['rect']), fill=(1, 1, 1))
+            page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE)
+
+        output_buffer = io.BytesIO()
+        doc.save(output_buffer, garbage=1, deflate=True)
+        return output_buffer.getvalue(), anchors
+    finally:
+        doc.close()
+
+
+def stamp_pdf(pdf_bytes, stamps):
+    """
+    Write texts at anchors of a PDF, appended as an incremental update
+
+    Args:
+        pdf_bytes: PDF content
+        stamps: List of (anchor, text)
+
+    Returns:
+        The PDF with the texts, its original bytes are kept unchanged at the start
+    """
+    # An incremental save can only append to the file the document was opened from
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pdf_path = os.path.join(temp_dir, 'document.pdf')
+        with open(pdf_path, 'wb') as f:
+            f.write(pdf_bytes)
+
+        doc = fitz.open(pdf_path)
+        try:
+            for anchor, text in stamps:
+                doc[anchor['page']].insert_text(
+                    (anchor['x'], anchor['y']),
+                    text,
+                    fontsize=anchor['size'],
+                    fontname='hebo' if anchor['bold'] else 'helv',
+                    color=(0, 0, 0)
+                )
+
+            if doc.can_save_incrementally():
+                doc.save(pdf_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+            else:
+                doc.save(pdf_path + '.full')
+                pdf_path += '.full'
+        finally:
+            doc.close()
+
+        with open(pdf_path, 'rb') as f:
+            return f.read()
+
+
+def render_demande_de_stage(stage):
+    """
+    Fill the demande de stage template and convert it to PDF
+
+    Signatures already recorded on the stage are written in the document, the
+    other signature fields get anchors for the signatures to come. Sets
+    the demande_de_stage and demande_de_stage_pdf documents and the anchors, the
+    caller saves the stage.
+
+    Raises:
+        ConverterError when the PDF could not be produced (the DOCX is set anyway)
+        TemplateNotFound when there is no template for the nature of the stage
+    """
+    template = demande_template(stage)
+    replacements = demande_replacements(stage)
+    values = signature_values(stage)
+    replacements.update(values)
+
+    stage.set_document('demande_de_stage', render_docx(template, replacements))
+    stage.set_document('demande_de_stage_pdf', None)
+    stage.demande_de_stage_data['pdf_fields'] = None
+
+    # Empty signature fields are rendered as anchor tokens for the conversion only
+    tokens = {placeholder: token for placeholder, token in ANCHOR_TOKENS.items() if not replacements[placeholder]}
+    pdf_bytes = render_pdf(template, {**replacements, **tokens})
+    pdf_bytes, anchors = prepare_base_pdf(pdf_bytes, tokens)
+
+    missing = set(tokens) - set(anchors)
+    if missing:
+        print(f"⚠️ Signature anchors not found in the demande de stage PDF: {', '.join(sorted(missing))}")
+
+    stage.set_document('demande_de_stage_pdf', pdf_bytes)
+    stage.demande_de_stage_data['pdf_fields'] = {
+        'anchors': anchors,
+        'filled': sorted(placeholder for placeholder, value in values.items() if value),
+    }
+
+
+def sign_demande_de_stage(stage, role, user, signature_date):
+    """
+    Record a signature and write it in the demande de stage
+
+    The signature fields are stamped on the existing PDF when its anchors are
+    known and the DOCX is filled again from the compiled template (no
+    conversion). Otherwise the whole document is rendered again in the
+    background once the transaction commits: the caller may hold the lock
+    of the stage, other signers must not wait for the conversion.
+
+    Returns:
+        'stamped', or 'scheduled' when the document is rendered in the background
+    """
+    stage.add_signature(role, user, signature_date)
+
+    pdf_fields = stage.demande_de_stage_data.get('pdf_fields')
+    values = signature_values(stage)
+
+    if stage.has_document('demande_de_stage_pdf') and pdf_fields:
+        anchors = pdf_fields['anchors']
+        new_values = {
+            placeholder: value for placeholder, value in values.items()
+            if value and placeholder not in pdf_fields['filled']
+        }
+
+        if all(placeholder in anchors for placeholder in new_values):
+            started = time.perf_counter()
+            stamps = [
+                (anchor, value)
+                for placeholder, value in new_values.items()
+                for anchor in anchors[placeholder]
+            ]
+            stage.set_document('demande_de_stage_pdf', stamp_pdf(stage.get_document('demande_de_stage_pdf'), stamps))
+            for placeholder in new_values:
+                del anchors[placeholder]
+            pdf_fields['filled'] = sorted(set(pdf_fields['filled']) | set(new_values))
+
+            replacements = demande_replacements(stage)
+            replacements.update(values)
+            stage.set_document('demande_de_stage', render_docx(demande_template(stage), replacements))
+            print(f"✅ {role} signature stamped in {(time.perf_counter() - started) * 1000:.0f} ms")
+            return 'stamped'
+
+    schedule_demande_render(stage)
+    return 'scheduled'
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_render_executor():
+    """Thread pool of this process rendering the demande de stage documents in the background"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'DOCUMENT_RENDER_WORKERS', 2),
+                    thread_name_prefix='demande-render',
+                )
+    return _executor
+
+
+def schedule_demande_render(stage):
+    """
+    Mark the demande de stage of a stage as pending and render it in the background
+
+    The rendering starts when the current transaction commits (right away
+    outside of a transaction), so the thread always finds the stage.
+    """
+    stage.demande_de_stage_statut = 'en_attente'
+    stage.demande_de_stage_erreur = None
+    stage.demande_de_stage_statut_at = timezone.now()
+    stage.save(update_fields=['demande_de_stage_statut', 'demande_de_stage_erreur', 'demande_de_stage_statut_at'])
+
+    stage_id = stage.id
+    transaction.on_commit(lambda: get_render_executor().submit(run_demande_render, stage_id))
+
+
+def is_render_stale(stage):
+    """Whether a pending rendering was lost, e.g. the worker running it was restarted"""
+    timeout = getattr(settings, 'DOCUMENT_RENDER_TIMEOUT', 300)
+    return (stage.demande_de_stage_statut == 'en_attente' and stage.demande_de_stage_statut_at is not None
+            and (timezone.now() - stage.demande_de_stage_statut_at).total_seconds() > timeout)
+
+
+# Columns written when a rendered document is stored
+DOCUMENT_COLUMNS = [
+    'demande_de_stage', 'demande_de_stage_blob', 'demande_de_stage_pdf', 'demande_de_stage_pdf_blob',
+    'demande_de_stage_data',
+    'demande_de_stage_statut', 'demande_de_stage_erreur', 'demande_de_stage_statut_at',
+]
+
+
+def rerender_demande(stage_id, only_pending=False, attempts=3):
+    """
+    Render the demande de stage of a stage again and store it
+
+    Only the document columns are written, the rest of the stage may change
+    while the document is rendered. When a signature is added meanwhile, the
+    document is rendered again.
+
+    Args:
+        stage_id: Stage to render
+        only_pending: Leave the stage alone unless its rendering is pending
+        attempts: Renderings tried when signatures keep changing
+
+    Returns:
+        Tuple (outcome, error) where outcome is 'pret', 'echoue' or 'ignore'
+    """
+    from .models import Stage
+
+    for _ in range(attempts):
+        stage = Stage.objects.select_related('stagiaire', 'sujet__created_by').get(id=stage_id)
+        error = None
+        try:
+            render_demande_de_stage(stage)
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+
+        with transaction.atomic():
+            current = Stage.objects.select_for_update().only(
+                'id', 'demande_de_stage_statut', 'demande_de_stage_data'
+            ).get(id=stage_id)
+            if only_pending and current.demande_de_stage_statut != 'en_attente':
+                # Rendered in the meantime (get_stage_document, a signature...)
+                return 'ignore', None
+
+            current_data = current.demande_de_stage_data or {}
+            if current_data.get('signatures') not in (None, stage.demande_de_stage_data.get('signatures')):
+                # Signed while rendering
+                continue
+
+            data = {**stage.demande_de_stage_data, **current_data}
+            data['document_data'] = stage.demande_de_stage_data.get('document_data')
+            data['pdf_fields'] = stage.demande_de_stage_data.get('pdf_fields')
+            current.demande_de_stage_data = data
+            for name in ('demande_de_stage', 'demande_de_stage_pdf'):
+                setattr(current, name, getattr(stage, name))
+                setattr(current, f'{name}_blob_id', getattr(stage, f'{name}_blob_id'))
+            current.demande_de_stage_statut = 'echoue' if error else 'pret'
+            current.demande_de_stage_erreur = error
+            current.demande_de_stage_statut_at = timezone.now()
+            current.save(update_fields=DOCUMENT_COLUMNS)
+            return current.demande_de_stage_statut, error
+
+    return 'ignore', "signatures changed while rendering"
+
+
+def run_demande_render(stage_id):
+    """Render the demande de stage of a stage and record the outcome in demande_de_stage_statut"""
+    started = time.perf_counter()
+    try:
+        outcome, error = rerender_demande(stage_id, only_pending=True)
+        if outcome == 'echoue':
+            print(f"❌ Demande de stage {stage_id} not rendered: {error}")
+        elif outcome == 'pret':
+            print(f"✅ Demande de stage {stage_id} rendered in {time.perf_counter() - started:.1f}s")
+
+    except Exception as e:
+        print(f"❌ Demande de stage {stage_id} not rendered: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        # The connection of this thread is not closed by the request cycle
+        connection.close()
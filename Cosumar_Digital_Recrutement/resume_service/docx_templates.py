@@ -0,0 +1,182 @@
+import hashlib
+import io
+import os
+import re
+import threading
+import zipfile
+from typing import Dict
+from .substitution import BOLD_PLACEHOLDERS, tokenize, render_segments
+
+# DOCX templates compiled once per process.
+# A template is read once: its ZIP members stay in memory, placeholders split
+# by Word across several runs are merged back, and the XML parts containing
+# placeholders are cut into literal segments around them. Rendering only
+# joins the segments with the replacement values and writes a new ZIP in
+# memory, there is no temporary file or directory.
+
+# Text nodes of a run, and paragraph ends (a placeholder never spans two paragraphs)
+TEXT_NODE_PATTERN = re.compile(r'(<w:t(?:\s[^>]*)?>)([^<]*)</w:t>|</w:p>')
+
+
+def is_templated_part(name):
+    """XML parts where placeholders are replaced: the body, the headers and the footers"""
+    if not name.startswith('word/') or not name.endswith('.xml') or '/' in name[len('word/'):]:
+        return False
+    base = name[len('word/'):]
+    return base == 'document.xml' or base.startswith('header') or base.startswith('footer')
+
+
+def consolidate_split_placeholders(xml_content):
+    """
+    Merge placeholders that Word split across several text nodes
+
+    When a text node opens a « that is closed in one of the following text
+    nodes of the same paragraph, the pieces are moved into the first node so
+    that the placeholder reads «NAME» in one place. The following runs keep
+    their formatting and only lose the moved characters.
+    """
+    # New text of the rewritten text nodes: {start: (end, text)}
+    edits = {}
+    # [start, end, text] of the nodes of a placeholder still open, the first one holds the «
+    pending = None
+
+    for match in TEXT_NODE_PATTERN.finditer(xml_content):
+        if match.group(1) is None:
+            # End of paragraph: an unclosed « is left as it is
+            pending = None
+            continue
+
+        start, end = match.span(2)
+        text = match.group(2)
+
+        if pending is not None:
+            close = text.find('»')
+            opening = text.find('«')
+            if close == -1 and opening == -1:
+                pending.append([start, end, text])
+                continue
+
+            if close != -1 and (opening == -1 or close < opening):
+                first_start, first_end, first_text = pending[0]
+                moved = ''.join(node[2] for node in pending[1:]) + text[:close + 1]
+                edits[first_start] = (first_end, first_text + moved)
+                for node_start, node_end, _ in pending[1:]:
+                    edits[node_start] = (node_end, '')
+                text = text[close + 1:]
+                edits[start] = (end, text)
+            pending = None
+
+        if text.rfind('«') > text.rfind('»'):
+            pending = [[start, end, text]]
+
+    if not edits:
+        return xml_content
+
+    pieces = []
+    last = 0
+    for start in sorted(edits):
+        end, text = edits[start]
+        pieces.append(xml_content[last:start])
+        pieces.append(text)
+        last = end
+    pieces.append(xml_content[last:])
+    return ''.join(pieces)
+
+
+class CompiledPart:
+    """An XML part cut into literal segments and placeholder slots"""
+
+    def __init__(self, xml_content, bold_placeholders=frozenset()):
+        self.segments, self.slots = tokenize(xml_content)
+        self.bold_placeholders = bold_placeholders
+
+    @property
+    def placeholders(self):
+        return {placeholder for _, placeholder in self.slots}
+
+    def render(self, replacements):
+        return render_segments(self.segments, self.slots, replacements, xml=True,
+                               bold_placeholders=self.bold_placeholders)
+
+
+class CompiledDocxTemplate:
+    """
+    A DOCX template held in memory, ready to be filled
+
+    Args:
+        docx_bytes: Content of the .docx template
+        name: Name shown in logs
+    """
+
+    def __init__(self, docx_bytes: bytes, name: str = ''):
+        self.name = name
+        # Content hash of the template, part of the rendered documents cache keys
+        self.version = hashlib.sha256(docx_bytes).hexdigest()
+        # (ZipInfo, raw bytes or CompiledPart) in the original order
+        self.members = []
+
+        with zipfile.ZipFile(io.BytesIO(docx_bytes)) as archive:
+            for info in archive.infolist():
+                data = archive.read(info)
+                if is_templated_part(info.filename):
+                    xml_content = consolidate_split_placeholders(data.decode('utf-8'))
+                    bold = BOLD_PLACEHOLDERS if info.filename == 'word/document.xml' else frozenset()
+                    data = CompiledPart(xml_content, bold)
+                self.members.append((info, data))
+
+    @classmethod
+    def from_path(cls, docx_path: str):
+        with open(docx_path, 'rb') as f:
+            return cls(f.read(), name=os.path.basename(docx_path))
+
+    @property
+    def placeholders(self):
+        """Placeholders found in the template"""
+        found = set()
+        for _, data in self.members:
+            if isinstance(data, CompiledPart):
+                found |= data.placeholders
+        return found
+
+    def render(self, replacements: Dict[str, str]) -> bytes:
+        """
+        Fill the template and return the DOCX as bytes
+
+        Placeholders missing from replacements are left as they are.
+        """
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for info, data in self.members:
+                if isinstance(data, CompiledPart):
+                    data = data.render(replacements).encode('utf-8')
+                member = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                member.compress_type = zipfile.ZIP_DEFLATED
+                member.external_attr = info.external_attr
+                archive.writestr(member, data)
+        return output.getvalue()
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_compiled_template(docx_path: str) -> CompiledDocxTemplate:
+    """
+    Return the compiled template for a .docx file, compiling it on first use
+
+    The template is compiled again when the file changes on disk.
+    """
+    stat = os.stat(docx_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _templates.get(docx_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    with _templates_lock:
+        cached = _templates.get(docx_path)
+        if cached is None or cached[0] != signature:
+            print(f"⏳ Compiling DOCX template {os.path.basename(docx_path)}...")
+            cached = (signature, CompiledDocxTemplate.from_path(docx_path))
+            _templates[docx_path] = cached
+    return cached[1]
@@ -0,0 +1,129 @@
+import hashlib
+import re
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from .blobstore import iter_blob
+
+# Responses of the document downloads (CV, convention, CIN, demande de
+# stage...). The strong ETag of a document is the SHA-256 of its content, the
+# key it is stored under in the blob store, so it is known without reading
+# the document: a viewer opening a document again sends If-None-Match and gets
+# a 304 without the document being read. A single byte range can be requested
+# (Range / If-Range), PDF viewers use it to load large documents page by page.
+# Blob store documents are streamed by chunks, never held whole in memory.
+#
+# No Last-Modified is sent: a blob is shared by every document with the same
+# content, its creation date is not the date the document was attached.
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested range starts after the end of the document"""
+
+
+def parse_range(header, size):
+    """
+    Byte range requested by a Range header
+
+    Only a single range is supported, a header with several ranges (or an
+    invalid one) is ignored and the whole document is sent.
+
+    Returns:
+        Tuple (start, end) with end inclusive, None to send the whole document
+
+    Raises:
+        RangeNotSatisfiable when the range is outside the document
+    """
+    match = RANGE_RE.match((header or '').replace(' ', ''))
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # Suffix range: the last bytes of the document
+        length = int(last)
+        if not length or not size:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+def range_applies(request, etag):
+    """Whether the Range header is used, If-Range must name the current version of the document"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    # Only strong ETags are compared, a date or weak ETag never matches
+    return if_range.strip() == etag
+
+
+def document_response(request, instance, name, content_type, filename):
+    """
+    Response sending a document of a Stage / Stagiaire
+
+    Args:
+        request: The download request, its If-None-Match / Range headers are used
+        instance: Stage or Stagiaire holding the document
+        name: Document in the BLOB_DOCUMENTS of the instance
+        content_type: Content-Type of the document
+        filename: File name shown by the browser
+
+    Returns:
+        A 200 (whole document), 206 (byte range), 304 (not modified)
+        or 416 (range not satisfiable) response
+    """
+    key = getattr(instance, f'{name}_blob_id')
+    if key:
+        data = None
+        size = getattr(instance, f'{name}_blob').taille
+    else:
+        # Not moved to the blob store yet, the column is read
+        data = instance.get_document(name) or b''
+        key = hashlib.sha256(data).hexdigest()
+        size = len(data)
+    etag = f'"{key}"'
+
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        # 304 for If-None-Match, 412 for a failed If-Match
+        response['ETag'] = etag
+        response['Accept-Ranges'] = 'bytes'
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    byte_range = None
+    if request.META.get('HTTP_RANGE') and range_applies(request, etag):
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+    start, end = byte_range or (0, size - 1)
+    if data is not None:
+        response = HttpResponse(data[start:end + 1], content_type=content_type)
+    else:
+        response = StreamingHttpResponse(iter_blob(key, start, end) if size else iter(()), content_type=content_type)
+
+    if byte_range:
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(end - start + 1 if size else 0)
+    response['Content-Disposition'] = f'inline; filename="{filename}"'
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    # Kept by the browser, but checked again with If-None-Match on every open
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,189 @@
+import io
+import json
+import re
+import zipfile
+import fitz
+from .blobstore import read_blob
+
+# Export of the "dossier de stage": every document of a stage merged in one
+# PDF, or the dossiers of many stages in a ZIP streamed to the client.
+# Documents are loaded one at a time (a single document per query, read from
+# the blob store) and released once written, so the memory used does not grow with
+# the number of exported stages: at most the documents of one stage are held.
+
+# Order of the documents in the dossier, and the Stage document holding each one
+STAGE_DOCUMENTS = [
+    ('demande_de_stage', 'demande_de_stage_pdf'),
+    ('convention', 'convention'),
+    ('assurance', 'assurance'),
+    ('cv', 'cv'),
+    ('lettre_motivation', 'lettre_motivation'),
+]
+
+EXPORT_CONTENUS = ('fusionne', 'documents')
+
+# Columns read to list the exported stages, none of them is a document
+EXPORT_STAGE_FIELDS = ['id', 'nature', 'statut', 'date_debut', 'date_fin', 'stagiaire__nom', 'stagiaire__prenom']
+
+
+def safe_name(value):
+    """Text usable in a file name inside the archive"""
+    return re.sub(r'[^\w-]+', '_', value or '').strip('_')
+
+
+def dossier_name(stage):
+    """Base name of the files of a stage, e.g. stage_12_ALAOUI_Ahmed"""
+    parts = [f"stage_{stage['id']}", safe_name(stage.get('stagiaire__nom')), safe_name(stage.get('stagiaire__prenom'))]
+    return '_'.join(part for part in parts if part)
+
+
+def document_extension(data):
+    if data[:4] == b'%PDF':
+        return 'pdf'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpg'
+    return 'bin'
+
+
+def load_stage_document(stage_id, name):
+    """Content of one document of a stage, the other document columns are not read"""
+    from .models import Stage
+
+    row = Stage.objects.filter(id=stage_id).values_list(f'{name}_blob', name).first()
+    if not row:
+        return None
+    key, data = row
+    if key:
+        return read_blob(key)
+    return bytes(data) if data else None
+
+
+def iter_stage_documents(stage_id):
+    """Yield (document_type, bytes or None) for the documents of a stage, one query at a time"""
+    for document_type, name in STAGE_DOCUMENTS:
+        yield document_type, load_stage_document(stage_id, name)
+
+
+def open_as_pdf(data):
+    """Open a stored document as a PDF document, images are converted to a one page PDF"""
+    extension = document_extension(data)
+    if extension == 'pdf':
+        return fitz.open(stream=data, filetype='pdf')
+    if extension in ('png', 'jpg'):
+        image = fitz.open(stream=data, filetype=extension)
+        try:
+            return fitz.open('pdf', image.convert_to_pdf())
+        finally:
+            image.close()
+    raise ValueError("format non supporté")
+
+
+def merge_stage_documents(stage_id):
+    """
+    Merge the documents of a stage in one PDF
+
+    Returns:
+        Tuple (pdf bytes or None when the stage has no document, summary)
+        where summary lists the documents included, missing and unreadable
+    """
+    summary = {'documents': [], 'manquants': [], 'erreurs': {}}
+    merged = fitz.open()
+    try:
+        for document_type, data in iter_stage_documents(stage_id):
+            if not data:
+                summary['manquants'].append(document_type)
+                continue
+            try:
+                source = open_as_pdf(data)
+            except Exception as e:
+                summary['erreurs'][document_type] = str(e)
+                continue
+            try:
+                merged.insert_pdf(source)
+            finally:
+                source.close()
+            summary['documents'].append(document_type)
+
+        if not merged.page_count:
+            return None, summary
+
+        output_buffer = io.BytesIO()
+        merged.save(output_buffer, garbage=1, deflate=True)
+        return output_buffer.getvalue(), summary
+    finally:
+        merged.close()
+
+
+class _StreamBuffer:
+    """Write-only file for zipfile: what is written is taken back by the response generator"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_dossiers_zip(stages, contenu='fusionne'):
+    """
+    Generate a ZIP archive of the dossiers of stages, chunk by chunk
+
+    Args:
+        stages: Iterable of dicts with the EXPORT_STAGE_FIELDS of each stage
+        contenu: 'fusionne' for one merged PDF per stage, 'documents' for
+            a folder per stage with each document as uploaded
+
+    Yields:
+        Bytes of the archive; a manifest.json listing what was exported
+        for each stage is written last
+    """
+    buffer = _StreamBuffer()
+    manifest = []
+
+    # PDFs are already compressed, they are stored as they are
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for stage in stages:
+            name = dossier_name(stage)
+            entry = {
+                'stage_id': stage['id'],
+                'stagiaire': f"{stage.get('stagiaire__prenom') or ''} {stage.get('stagiaire__nom') or ''}".strip(),
+                'nature': stage.get('nature'),
+                'statut': stage.get('statut'),
+            }
+
+            if contenu == 'fusionne':
+                try:
+                    pdf_bytes, summary = merge_stage_documents(stage['id'])
+                except Exception as e:
+                    pdf_bytes, summary = None, {'documents': [], 'manquants': [], 'erreurs': {'dossier': str(e)}}
+                if pdf_bytes:
+                    archive.writestr(f"{name}.pdf", pdf_bytes)
+                entry.update(summary)
+                del pdf_bytes
+                yield buffer.take()
+            else:
+                entry.update({'documents': [], 'manquants': [], 'erreurs': {}})
+                for document_type, data in iter_stage_documents(stage['id']):
+                    if not data:
+                        entry['manquants'].append(document_type)
+                        continue
+                    archive.writestr(f"{name}/{document_type}.{document_extension(data)}", data)
+                    entry['documents'].append(document_type)
+                    del data
+                    yield buffer.take()
+
+            manifest.append(entry)
+
+        archive.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+    yield buffer.take()
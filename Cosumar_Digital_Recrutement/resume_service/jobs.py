@@ -0,0 +1,249 @@
+import json
+import os
+import zipfile
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from resume_service.models import OcrJob
+from .ocr_cache import cached_extraction, lookup_cached_result
+
+# Asynchronous CIN / CV extraction.
+# The API only stores the uploaded file in an OcrJob row and answers with its id;
+# the `ocr_worker` management command (a separate pool of processes) claims the
+# pending jobs, runs the OCR and writes the result back.
+
+
+def get_extractor(kind):
+    """Return (extractor function, extractor version) for a job kind"""
+    if kind == 'cin':
+        from .CIN import extract_cin_data, CIN_EXTRACTOR_VERSION
+        return extract_cin_data, CIN_EXTRACTOR_VERSION
+    if kind == 'cv':
+        from .PDF import extract_cv_data, CV_EXTRACTOR_VERSION
+        return extract_cv_data, CV_EXTRACTOR_VERSION
+    raise ValueError(f"Unknown OCR job kind: {kind}")
+
+
+def get_extractor_version(kind):
+    return get_extractor(kind)[1]
+
+
+def submit_ocr_job(kind, data, filename='', user=None):
+    """
+    Queue an extraction and return its OcrJob
+
+    When the same file was already processed, the job is created as finished
+    with the cached result and never reaches the workers.
+    """
+    cached_result = lookup_cached_result(kind, get_extractor_version(kind), data)
+    if cached_result is not None:
+        now = timezone.now()
+        return OcrJob.objects.create(
+            kind=kind,
+            nom_fichier=filename,
+            statut='termine',
+            progression=100,
+            resultat=cached_result,
+            cached=True,
+            created_by=user,
+            started_at=now,
+            finished_at=now,
+        )
+
+    return OcrJob.objects.create(
+        kind=kind,
+        nom_fichier=filename,
+        fichier=data,
+        created_by=user,
+    )
+
+
+def claim_next_job():
+    """Mark the oldest pending job as running and return it, or None when the queue is empty"""
+    with transaction.atomic():
+        job = (OcrJob.objects
+               .select_for_update(skip_locked=True)
+               .filter(statut='en_attente')
+               .order_by('created_at')
+               .first())
+        if job is None:
+            return None
+
+        job.statut = 'en_cours'
+        job.progression = 10
+        job.started_at = timezone.now()
+        job.save(update_fields=['statut', 'progression', 'started_at'])
+        return job
+
+
+def run_job(job):
+    """Run the extraction of a claimed job and store its result"""
+    try:
+        extractor, version = get_extractor(job.kind)
+        data = bytes(job.fichier) if job.fichier is not None else b''
+
+        job.progression = 30
+        job.save(update_fields=['progression'])
+
+        result, cached = cached_extraction(job.kind, version, data, extractor)
+
+        job.resultat = result
+        job.cached = cached
+        job.statut = 'termine'
+    except Exception as e:
+        job.erreur = str(e)
+        job.statut = 'echoue'
+        print(f"❌ OCR job {job.id} failed: {e}")
+
+    job.progression = 100
+    job.finished_at = timezone.now()
+    # The uploaded file is not needed anymore once the job is over
+    job.fichier = None
+    job.save(update_fields=['resultat', 'cached', 'statut', 'erreur', 'progression', 'finished_at', 'fichier'])
+    return job
+
+
+def requeue_stale_jobs():
+    """Put back in the queue the jobs whose worker died while running them"""
+    timeout = getattr(settings, 'OCR_JOB_TIMEOUT', 600)
+    return OcrJob.objects.filter(
+        statut='en_cours',
+        started_at__lt=timezone.now() - timedelta(seconds=timeout)
+    ).update(statut='en_attente', progression=0, started_at=None)
+
+
+def purge_old_jobs():
+    """Delete finished jobs older than OCR_JOB_RETENTION seconds"""
+    retention = getattr(settings, 'OCR_JOB_RETENTION', 24 * 3600)
+    deleted, _ = OcrJob.objects.filter(
+        statut__in=['termine', 'echoue'],
+        finished_at__lt=timezone.now() - timedelta(seconds=retention)
+    ).delete()
+    return deleted
+
+
+def serialize_job(job):
+    return {
+        "job_id": str(job.id),
+        "kind": job.kind,
+        "status": job.statut,
+        "progress": job.progression,
+        "filename": job.nom_fichier,
+        "cached": job.cached,
+        "data": job.resultat if job.statut == 'termine' else None,
+        "error": job.erreur if job.statut == 'echoue' else None,
+        "created_at": job.created_at.strftime('%Y-%m-%d %H:%M:%S') if job.created_at else None,
+        "finished_at": job.finished_at.strftime('%Y-%m-%d %H:%M:%S') if job.finished_at else None,
+    }
+
+
+# Batch OCR: every file of a ZIP / multi-file upload becomes an OcrJob, so the
+# batch is spread over the ocr_worker processes like any other job. The
+# number of worker processes (OCR_WORKERS) is the global concurrency cap,
+# shared by every batch and every web worker.
+
+BATCH_KINDS = {
+    'jpg': 'cin',
+    'jpeg': 'cin',
+    'png': 'cin',
+    'pdf': 'cv',
+}
+
+
+def get_batch_kind(filename):
+    ext = os.path.splitext(filename)[1].lower().lstrip('.')
+    return BATCH_KINDS.get(ext)
+
+
+def iter_batch_files(uploaded_files):
+    """
+    Yield (filename, content bytes or None, error or None) for each file of a batch upload
+
+    ZIP archives are expanded one member at a time, so only one file is held
+    in memory. Files with an unsupported extension or above
+    OCR_BATCH_MAX_FILE_SIZE are yielded with an error instead of their content.
+    """
+    max_size = getattr(settings, 'OCR_BATCH_MAX_FILE_SIZE', 20 * 1024 * 1024)
+
+    for uploaded_file in uploaded_files:
+        if os.path.splitext(uploaded_file.name)[1].lower() != '.zip':
+            if get_batch_kind(uploaded_file.name) is None:
+                yield uploaded_file.name, None, "Type de fichier non autorisé."
+            elif uploaded_file.size > max_size:
+                yield uploaded_file.name, None, "Fichier trop volumineux."
+            else:
+                yield uploaded_file.name, uploaded_file.read(), None
+            continue
+
+        try:
+            archive = zipfile.ZipFile(uploaded_file)
+        except zipfile.BadZipFile:
+            yield uploaded_file.name, None, "Archive ZIP invalide."
+            continue
+
+        with archive:
+            for member in archive.infolist():
+                name = member.filename
+                basename = os.path.basename(name)
+                # Folders and macOS / hidden metadata files
+                if member.is_dir() or not basename or basename.startswith('.') or name.startswith('__MACOSX/'):
+                    continue
+
+                if get_batch_kind(name) is None:
+                    yield name, None, "Type de fichier non autorisé."
+                    continue
+
+                if member.file_size > max_size:
+                    yield name, None, "Fichier trop volumineux."
+                    continue
+
+                with archive.open(member) as f:
+                    # The declared size can lie, never read more than the limit
+                    content = f.read(max_size + 1)
+                if len(content) > max_size:
+                    yield name, None, "Fichier trop volumineux."
+                    continue
+
+                yield name, content, None
+
+
+def _batch_line(index, filename, kind, job=None, error=None):
+    line = {"index": index, "filename": filename, "kind": kind}
+    if job is not None:
+        line.update(serialize_job(job))
+    else:
+        line.update({"status": "echoue", "data": None, "error": error})
+    return json.dumps(line, ensure_ascii=False) + "\n"
+
+
+def stream_batch_results(uploaded_files, user=None):
+    """
+    Queue every file of a batch and yield one NDJSON line per file as it is queued
+
+    The response never waits for the OCR: files already in the OCR cache come
+    with their result, the others with the job_id the client follows with
+    ocr_jobs/<job_id>/. Each line carries the index of the file in the
+    batch; a last line with "summary" gives the totals.
+    """
+    max_files = getattr(settings, 'OCR_BATCH_MAX_FILES', 500)
+    counts = {'termine': 0, 'echoue': 0, 'en_attente': 0}
+
+    for index, (filename, content, error) in enumerate(iter_batch_files(uploaded_files)):
+        kind = get_batch_kind(filename)
+
+        if index >= max_files:
+            error = f"Lot limité à {max_files} fichiers."
+
+        if error:
+            counts['echoue'] += 1
+            yield _batch_line(index, filename, kind, error=error)
+            continue
+
+        job = submit_ocr_job(kind, content, filename=filename, user=user)
+        del content
+        # 'termine' when already in the OCR cache
+        counts['termine' if job.statut == 'termine' else 'en_attente'] += 1
+        yield _batch_line(index, filename, kind, job=job)
+
+    yield json.dumps({"summary": dict(counts, total=sum(counts.values()))}, ensure_ascii=False) + "\n"
@@ -0,0 +1,99 @@
+import os
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from resume_service.benchmark import synthetic_cin_corpus, measure, field_accuracy
+
+# Zones reading a blank corner of the card: nothing is found in them, every
+# resolution is read both ways up before the whole photo is read
+NO_MATCH_ZONES = {
+    'identite': (0.00, 0.00, 0.02, 0.02),
+    'numero': (0.00, 0.00, 0.02, 0.02),
+}
+
+
+class Command(BaseCommand):
+    help = ("Compare the latency and CPU time of whole-image and zone (ROI) CIN OCR, and of the zone OCR "
+            "worst case (no zone found, then the whole image)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', help="Directory of CIN photos (jpg/png) instead of synthetic cards")
+        parser.add_argument('--synthetic', type=int, default=5, help="Number of synthetic cards to generate")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per image and mode")
+
+    def load_corpus(self, options):
+        if not options['images']:
+            return synthetic_cin_corpus(options['synthetic'])
+
+        corpus = []
+        for name in sorted(os.listdir(options['images'])):
+            if os.path.splitext(name)[1].lower() in ('.jpg', '.jpeg', '.png'):
+                with open(os.path.join(options['images'], name), 'rb') as f:
+                    corpus.append((None, f.read()))
+        return corpus
+
+    def run_mode(self, corpus, repeat, mode, timings):
+        """Mean wall and CPU time of one extraction, and mean field accuracy"""
+        from resume_service.CIN import extract_cin_data
+
+        wall_total = cpu_total = accuracy_total = 0.0
+        runs = 0
+        for expected, image_bytes in corpus:
+            for _ in range(repeat):
+                found, wall, cpu = measure(extract_cin_data, image_bytes, mode=mode, timings=timings)
+                wall_total += wall
+                cpu_total += cpu
+                runs += 1
+            if expected is not None:
+                accuracy_total += field_accuracy(expected, found)
+
+        return {
+            'wall': wall_total / runs,
+            'cpu': cpu_total / runs,
+            'accuracy': accuracy_total / len(corpus) if corpus[0][0] is not None else None,
+            'runs': runs,
+        }
+
+    def handle(self, *args, **options):
+        from resume_service.ocr import warm_up_readers
+
+        corpus = self.load_corpus(options)
+        if not corpus:
+            self.stderr.write("No image to benchmark")
+            return
+
+        # Model loading is not what we measure
+        warm_up_readers()
+
+        totals = {}
+        timings = []
+        for mode in ('full', 'roi'):
+            totals[mode] = self.run_mode(corpus, options['repeat'], mode,
+                                         timings if mode == 'roi' else None)
+
+        worst_timings = []
+        with override_settings(CIN_ZONES=NO_MATCH_ZONES):
+            totals['worst'] = self.run_mode(corpus, options['repeat'], 'roi', worst_timings)
+
+        self.stdout.write(f"{len(corpus)} image(s), {options['repeat']} run(s) each\n")
+        self.stdout.write(f"{'mode':<6} {'wall (s)':>10} {'cpu (s)':>10} {'accuracy':>10}")
+        for mode, stats in totals.items():
+            accuracy = f"{stats['accuracy']:.0%}" if stats['accuracy'] is not None else '-'
+            self.stdout.write(f"{mode:<6} {stats['wall']:>10.3f} {stats['cpu']:>10.3f} {accuracy:>10}")
+        self.stdout.write(f"(worst: roi when no zone is found, {len(worst_timings) / totals['worst']['runs']:.0f} "
+                          f"resolution(s) read both ways up then the whole image, "
+                          f"x{totals['worst']['wall'] / totals['full']['wall']:.2f} the full latency)")
+
+        full, roi = totals['full'], totals['roi']
+        if roi['wall'] > 0 and roi['cpu'] > 0:
+            self.stdout.write(self.style.SUCCESS(
+                f"\nROI speed-up: x{full['wall'] / roi['wall']:.2f} latency, x{full['cpu'] / roi['cpu']:.2f} CPU"
+            ))
+
+        if timings:
+            self.stdout.write("\nZone OCR attempts per DPI (CIN_OCR_DPI_LADDER)")
+            self.stdout.write(f"{'dpi':>6} {'attempts':>10} {'mean (s)':>10} {'found':>10}")
+            for dpi in sorted({t['dpi'] for t in timings}):
+                attempts = [t for t in timings if t['dpi'] == dpi]
+                mean = sum(t['seconds'] for t in attempts) / len(attempts)
+                found_rate = sum(1 for t in attempts if t['found']) / len(attempts)
+                self.stdout.write(f"{dpi:>6} {len(attempts):>10} {mean:>10.3f} {found_rate:>10.0%}")
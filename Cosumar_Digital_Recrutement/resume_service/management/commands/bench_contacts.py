@@ -0,0 +1,106 @@
+import re
+import time
+from django.core.management.base import BaseCommand
+from resume_service.benchmark import CV_FILLER, SYNTHETIC_CONTACTS
+from resume_service.contacts import extract_contacts
+
+# extract_emails / extract_phones as they were before the single-pass
+# scanner, kept to time them against it.
+
+def legacy_extract_emails(text):
+    email_pattern = r'[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+'
+    return re.findall(email_pattern, text)
+
+def legacy_extract_phones(text):
+    phone_patterns = [
+        r'(\+212|0)[-\s]*([67])[-\s]*(\d{2})[-\s]*(\d{2})[-\s]*(\d{2})[-\s]*(\d{2})',
+        r'(\+212|0)([67]\d{8})',
+        r'(\d{2})[-\s]*(\d{2})[-\s]*(\d{2})[-\s]*(\d{2})[-\s]*(\d{2})',
+        r'\+212[-\s]*\d[-\s]*\d{2}[-\s]*\d{3}[-\s]*\d{3}',
+        r'0[67][-\s]*\d{2}[-\s]*\d{2}[-\s]*\d{2}[-\s]*\d{2}'
+    ]
+    
+    phones = []
+    for pattern in phone_patterns:
+        matches = re.findall(pattern, text)
+        for match in matches:
+            if isinstance(match, tuple) and len(match) > 1:
+                if len(match) == 6:
+                    phone = f"{match[0]}{match[1]}{match[2]}{match[3]}{match[4]}{match[5]}"
+                elif len(match) == 2:
+                    phone = f"{match[0]}{match[1]}"
+                elif len(match) == 5:
+                    phone = '0' + ''.join(match)
+                else:
+                    phone = ''.join(match)
+            else:
+                phone = str(match).replace('-', '').replace(' ', '')
+                
+            if phone and len(phone) >= 9:
+                phones.append(phone)
+    
+    direct_patterns = [
+        r'\+212[-\s]*[67][-\s]*\d{2}[-\s]*\d{3}[-\s]*\d{3}',
+        r'\+212[-\s]*[67][-\s]*\d{2}[-\s]*\d{2}[-\s]*\d{2}[-\s]*\d{2}',
+        r'0[67][-\s]*\d{2}[-\s]*\d{2}[-\s]*\d{2}[-\s]*\d{2}'
+    ]
+    
+    for pattern in direct_patterns:
+        matches = re.findall(pattern, text)
+        for match in matches:
+            clean_phone = match.replace('-', '').replace(' ', '')
+            if clean_phone and len(clean_phone) >= 9:
+                phones.append(clean_phone)
+    
+    return list(set(phones))
+
+
+def legacy_contacts(text):
+    return legacy_extract_emails(text), legacy_extract_phones(text)
+
+
+def scanner_contacts(text):
+    contacts = extract_contacts(text)
+    return contacts['emails'], contacts['phones']
+
+
+class Command(BaseCommand):
+    help = ("Compare the speed of the contact scanner and of the legacy email / phone extraction "
+            "(the scanner finds the same contacts, see ContactExtractionTests)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=200, help="Pages of the generated CV text")
+        parser.add_argument('--repeat', type=int, default=5, help="Runs of each extractor")
+
+    def make_text(self, pages):
+        page_texts = []
+        for page in range(pages):
+            lines = list(CV_FILLER) * 8
+            if page % 10 == 0:
+                email, phone = SYNTHETIC_CONTACTS[(page // 10) % len(SYNTHETIC_CONTACTS)]
+                lines.insert(page % len(lines), f"Email : {email} Tél : {phone}")
+            page_texts.append("\n".join(lines))
+        return page_texts
+
+    def time_extractor(self, extractor, page_texts, repeat):
+        """Mean seconds to run the extractor on every page and then on the whole text, like extract_cv_data did"""
+        all_text = " ".join(page_texts)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for page_text in page_texts:
+                extractor(page_text)
+            extractor(all_text)
+        return (time.perf_counter() - started) / repeat
+
+    def handle(self, *args, **options):
+        page_texts = self.make_text(options['pages'])
+        size = sum(len(text) for text in page_texts)
+        self.stdout.write(f"{options['pages']} pages, {size / 1024:.0f} KiB of text, {options['repeat']} run(s)")
+
+        legacy = self.time_extractor(legacy_contacts, page_texts, options['repeat'])
+        scanner = self.time_extractor(scanner_contacts, page_texts, options['repeat'])
+
+        self.stdout.write(f"{'legacy (9 regexes)':<22} {legacy * 1000:>10.1f} ms")
+        self.stdout.write(f"{'single-pass scanner':<22} {scanner * 1000:>10.1f} ms")
+        if scanner > 0:
+            self.stdout.write(self.style.SUCCESS(f"\nSpeed-up: x{legacy / scanner:.2f}"))
@@ -0,0 +1,318 @@
+import contextlib
+import io
+import os
+import re
+import tempfile
+import time
+import zipfile
+from typing import Dict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from resume_service.docx_templates import CompiledDocxTemplate, is_templated_part
+from resume_service.substitution import substitute
+
+DEFAULT_TEMPLATE = os.path.join(settings.BASE_DIR, 'resume_service', 'media', 'DEMANDE DE STAGE.docx')
+
+# Values like the ones creer_stage and the signing views fill in, without XML
+# special characters so that both renderers must give the same XML
+SAMPLE_REPLACEMENTS = {
+    '«NOM»': 'ALAOUI',
+    '«PRENOM»': 'Ahmed',
+    '«CIN»': 'AB123456',
+    '«EMAIL»': 'ahmed.alaoui@gmail.com',
+    '«TELEPHONE»': '+212612345678',
+    '«DATE_NAISSANCE»': '12/03/2001',
+    '«NATURE»': 'PFE',
+    '«PERIODE_DU»': '01/07/2025',
+    '«PERIODE_AU»': '31/08/2025',
+    '«PERIODE_ACCORDEE_DU»': '01/07/2025',
+    '«PERIODE_ACCORDEE_AU»': '31/08/2025',
+    '«SUJET»': 'Optimisation du stock de pièces de rechange',
+    '«SPECIALITE»': 'Génie industriel',
+    '«ETABLISSEMENT»': 'ENSAM Meknès',
+    '«DIRECTION»': 'Direction industrielle',
+    '«ENCADRANT»': 'Mme Bennani',
+    '«SERVICE»': 'Maintenance',
+    '«NOM_ENCADRANT»': 'Fatima Bennani',
+    '«DATE_SIGNATURE_ENCADRANT»': '15/06/2025',
+    '«SIGNATURE_ENCADRANT»': 'Signé électroniquement par Fatima Bennani',
+    '«NOM_RESPONSABLE_SERVICE»': 'Omar Chraibi',
+    '«DATE_SIGNATURE_RESPONSABLE_SERVICE»': '16/06/2025',
+    '«DATE_SIGNATURE_RH»': '',
+}
+
+# create_docx_from_template_xml before the compiled templates, kept to check
+# that the compiled renderer gives the same documents and to compare speed.
+
+def legacy_create_docx_from_template_xml(docx_path: str, replacements: Dict[str, str]) -> bytes:
+    """
+    Create a filled DOCX from DOCX template by working at XML level to preserve ALL document elements
+    
+    Args:
+        docx_path: Path to the DOCX template file
+        replacements: Dictionary of {placeholder: replacement_value}
+    
+    Returns:
+        DOCX content as bytes
+    """
+    try:
+        # Copy the original file to a temporary location
+        with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as temp_file:
+            temp_docx_path = temp_file.name
+            
+        # Copy original file
+        import shutil
+        shutil.copy2(docx_path, temp_docx_path)
+        
+        # Open as ZIP (DOCX is a ZIP file)
+        with zipfile.ZipFile(temp_docx_path, 'r') as zip_read:
+            # Extract all files
+            with tempfile.TemporaryDirectory() as temp_dir:
+                zip_read.extractall(temp_dir)
+                
+                # Process the main document XML
+                document_xml_path = os.path.join(temp_dir, 'word', 'document.xml')
+                if os.path.exists(document_xml_path):
+                    with open(document_xml_path, 'r', encoding='utf-8') as f:
+                        xml_content = f.read()
+                    
+                    # Debug: Find all placeholders in the template
+                    import re
+                    found_placeholders = re.findall(r'«[^»]+»', xml_content)
+                    print(f"🔍 Debug: Found placeholders in template: {found_placeholders}")
+                    
+                    # Also check for potential encoding variations
+                    alt_placeholders = re.findall(r'<<[^>]+>>', xml_content)  # Alternative format
+                    if alt_placeholders:
+                        print(f"🔍 Debug: Found alternative placeholders: {alt_placeholders}")
+                    
+                    # Check for SIGNATURE_ENCADRANT specifically in different formats
+                    signature_variations = [
+                        '«SIGNATURE_ENCADRANT»',
+                        '<<SIGNATURE_ENCADRANT>>',
+                        'SIGNATURE_ENCADRANT',
+                        'signature_encadrant',
+                        'Signature_Encadrant'
+                    ]
+                    
+                    print(f"🔍 Debug: Checking for SIGNATURE_ENCADRANT variations:")
+                    for variation in signature_variations:
+                        count = xml_content.count(variation)
+                        if count > 0:
+                            print(f"   ✅ Found '{variation}': {count} times")
+                        else:
+                            print(f"   ❌ Not found: '{variation}'")
+                    
+                    # Show a sample of the XML content to see the structure
+                    xml_lines = xml_content.split('\n')
+                    print(f"🔍 Debug: XML content sample (first 10 lines):")
+                    for i, line in enumerate(xml_lines[:10]):
+                        print(f"   {i+1}: {line[:100]}...")
+                        
+                    # Look for any text that contains "SIGNATURE" or "ENCADRANT"
+                    signature_matches = re.findall(r'[^>]*(?:SIGNATURE|ENCADRANT)[^<]*', xml_content, re.IGNORECASE)
+                    if signature_matches:
+                        print(f"🔍 Debug: Found text containing SIGNATURE/ENCADRANT:")
+                        for match in signature_matches[:5]:  # Show first 5 matches
+                            print(f"   '{match}'")
+                    
+                    # Replace placeholders in XML content with special formatting
+                    replaced_count = 0
+                    
+                    # First, try to consolidate split placeholders in the XML
+                    # This handles cases where placeholders are split across multiple <w:t> elements
+                    print(f"🔄 Debug: Attempting to consolidate split placeholders...")
+                    
+                    # Look for patterns where placeholders might be split
+                    # Pattern: text ending with part of placeholder + closing tag + opening tag + rest of placeholder
+                    split_patterns = [
+                        (r'(«[^»]*)</w:t>([^<]*<w:t[^>]*>)([^<]*»)', r'\1\3'),  # «PART</w:t>...<w:t>REST»
+                        (r'(«[A-Z_]*)</w:t>([^<]*<w:t[^>]*>)([A-Z_]*»)', r'\1\3'),  # More specific pattern
+                    ]
+                    
+                    for pattern, replacement in split_patterns:
+                        matches = re.findall(pattern, xml_content)
+                        if matches:
+                            print(f"🔍 Debug: Found {len(matches)} split placeholder patterns")
+                            xml_content = re.sub(pattern, replacement, xml_content)
+                    
+                    # Check again after consolidation
+                    found_placeholders_after = re.findall(r'«[^»]+»', xml_content)
+                    print(f"🔍 Debug: Placeholders after consolidation: {found_placeholders_after}")
+                    
+                    for placeholder, replacement in replacements.items():
+                        original_count = xml_content.count(placeholder)
+                        if original_count > 0:
+                            # Special handling for SIGNATURE_ENCADRANT to make it bold
+                            if placeholder == '«SIGNATURE_ENCADRANT»':
+                                # Use regex to find and replace within w:t tags with bold formatting
+                                pattern = r'(<w:t[^>]*>)([^<]*' + re.escape(placeholder) + r'[^<]*)(<\/w:t>)'
+                                
+                                def make_bold_replacement(match):
+                                    opening_tag = match.group(1)  # <w:t> or <w:t xml:space="preserve">
+                                    text_content = match.group(2)  # Text containing placeholder
+                                    closing_tag = match.group(3)  # </w:t>
+                                    
+                                    # Split the text around the placeholder
+                                    before_placeholder = text_content.split(placeholder)[0]
+                                    after_placeholder = ''.join(text_content.split(placeholder)[1:])
+                                    
+                                    # Create the replacement with bold formatting
+                                    # Structure: existing_text</w:t></w:r><w:r><w:rPr><w:b/></w:rPr><w:t>BOLD_TEXT</w:t></w:r><w:r><w:t>remaining_text
+                                    return f'{opening_tag}{before_placeholder}</w:t></w:r><w:r><w:rPr><w:b/></w:rPr><w:t>{replacement}</w:t></w:r><w:r><w:t>{after_placeholder}</w:t>'
+                                
+                                xml_content = re.sub(pattern, make_bold_replacement, xml_content)
+                                print(f"✅ Replaced {original_count} instances of {placeholder} with BOLD '{replacement}' in document XML")
+                            else:
+                                xml_content = xml_content.replace(placeholder, replacement)
+                                print(f"✅ Replaced {original_count} instances of {placeholder} with '{replacement}' in document XML")
+                            replaced_count += original_count
+                        else:
+                            print(f"⚠️ Placeholder {placeholder} not found in document XML")
+                    
+                    print(f"📊 Debug: Total replacements made: {replaced_count}")
+                    
+                    # Final check: see what placeholders remain
+                    remaining_placeholders = re.findall(r'«[^»]+»', xml_content)
+                    if remaining_placeholders:
+                        print(f"⚠️ Remaining unreplaced placeholders: {remaining_placeholders}")
+                    
+                    # Write back the modified XML
+                    with open(document_xml_path, 'w', encoding='utf-8') as f:
+                        f.write(xml_content)
+                
+                # Process headers if they exist
+                headers_dir = os.path.join(temp_dir, 'word')
+                for file_name in os.listdir(headers_dir):
+                    if file_name.startswith('header') and file_name.endswith('.xml'):
+                        header_path = os.path.join(headers_dir, file_name)
+                        with open(header_path, 'r', encoding='utf-8') as f:
+                            xml_content = f.read()
+                        
+                        for placeholder, replacement in replacements.items():
+                            if placeholder in xml_content:
+                                xml_content = xml_content.replace(placeholder, replacement)
+                                print(f"✅ Replaced {placeholder} with {replacement} in {file_name}")
+                        
+                        with open(header_path, 'w', encoding='utf-8') as f:
+                            f.write(xml_content)
+                
+                # Process footers if they exist
+                for file_name in os.listdir(headers_dir):
+                    if file_name.startswith('footer') and file_name.endswith('.xml'):
+                        footer_path = os.path.join(headers_dir, file_name)
+                        with open(footer_path, 'r', encoding='utf-8') as f:
+                            xml_content = f.read()
+                        
+                        for placeholder, replacement in replacements.items():
+                            if placeholder in xml_content:
+                                xml_content = xml_content.replace(placeholder, replacement)
+                                print(f"✅ Replaced {placeholder} with {replacement} in {file_name}")
+                        
+                        with open(footer_path, 'w', encoding='utf-8') as f:
+                            f.write(xml_content)
+                
+                # Create new DOCX file with modified content
+                filled_docx_path = temp_docx_path + '_filled.docx'
+                with zipfile.ZipFile(filled_docx_path, 'w', zipfile.ZIP_DEFLATED) as zip_write:
+                    for root, dirs, files in os.walk(temp_dir):
+                        for file in files:
+                            file_path = os.path.join(root, file)
+                            arc_name = os.path.relpath(file_path, temp_dir)
+                            zip_write.write(file_path, arc_name)
+        
+        # Read the filled DOCX content
+        with open(filled_docx_path, 'rb') as f:
+            docx_bytes = f.read()
+        
+        # Clean up temporary files
+        os.unlink(temp_docx_path)
+        os.unlink(filled_docx_path)
+        
+        print(f"🎉 Successfully created DOCX from template using XML method")
+        return docx_bytes
+        
+    except Exception as e:
+        print(f"❌ Error creating DOCX from template using XML method: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return b''
+
+
+def xml_parts(docx_bytes):
+    """Templated XML parts of a DOCX; the previous renderer wrote them back with \\n line endings"""
+    with zipfile.ZipFile(io.BytesIO(docx_bytes)) as archive:
+        return {
+            name: archive.read(name).replace(b'\r\n', b'\n')
+            for name in archive.namelist() if is_templated_part(name)
+        }
+
+
+class Command(BaseCommand):
+    help = "Compare the compiled in-memory DOCX renderer with the previous temp-directory renderer"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template', default=DEFAULT_TEMPLATE, help="DOCX template to render")
+        parser.add_argument('--repeat', type=int, default=20, help="Renders per renderer")
+
+    def handle(self, *args, **options):
+        template_path = options['template']
+        if not os.path.exists(template_path):
+            raise CommandError(f"Template not found: {template_path}")
+
+        # The previous renderer prints a lot of debug output
+        with contextlib.redirect_stdout(io.StringIO()):
+            legacy_bytes = legacy_create_docx_from_template_xml(template_path, SAMPLE_REPLACEMENTS)
+
+        started = time.perf_counter()
+        template = CompiledDocxTemplate.from_path(template_path)
+        compile_time = time.perf_counter() - started
+        compiled_bytes = template.render(SAMPLE_REPLACEMENTS)
+
+        legacy_parts, compiled_parts = xml_parts(legacy_bytes), xml_parts(compiled_bytes)
+        different = sorted(name for name in legacy_parts if legacy_parts[name] != compiled_parts.get(name))
+        if different:
+            raise CommandError(f"The renderers disagree on {', '.join(different)}")
+        self.stdout.write(self.style.SUCCESS(f"✅ Same XML for {', '.join(sorted(legacy_parts))}"))
+
+        repeat = options['repeat']
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(repeat):
+                legacy_create_docx_from_template_xml(template_path, SAMPLE_REPLACEMENTS)
+        legacy_time = (time.perf_counter() - started) / repeat
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            template.render(SAMPLE_REPLACEMENTS)
+        compiled_time = (time.perf_counter() - started) / repeat
+
+        self.stdout.write(f"\n{os.path.basename(template_path)}, {repeat} render(s) each")
+        self.stdout.write(f"{'temp directory (previous)':<28} {legacy_time * 1000:>9.1f} ms")
+        self.stdout.write(f"{'compiled, in memory':<28} {compiled_time * 1000:>9.1f} ms  (compiled once in {compile_time * 1000:.1f} ms)")
+        if compiled_time > 0:
+            self.stdout.write(self.style.SUCCESS(f"\nSpeed-up: x{legacy_time / compiled_time:.2f}"))
+
+        self.compare_substitution(template_path, repeat)
+
+    def compare_substitution(self, template_path, repeat):
+        """Time the placeholder replacement alone on document.xml: one pass per key vs one single pass"""
+        with zipfile.ZipFile(template_path) as archive:
+            xml_content = archive.read('word/document.xml').decode('utf-8')
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            replaced = xml_content
+            for placeholder, replacement in SAMPLE_REPLACEMENTS.items():
+                if placeholder in replaced:
+                    replaced = replaced.replace(placeholder, replacement)
+        per_key = (time.perf_counter() - started) / repeat
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            substitute(xml_content, SAMPLE_REPLACEMENTS, xml=True)
+        single_pass = (time.perf_counter() - started) / repeat
+
+        self.stdout.write(f"\nSubstitution on document.xml ({len(xml_content) // 1024} KiB, {len(SAMPLE_REPLACEMENTS)} keys)")
+        self.stdout.write(f"{'one pass per key':<28} {per_key * 1000:>9.2f} ms")
+        self.stdout.write(f"{'single pass':<28} {single_pass * 1000:>9.2f} ms")
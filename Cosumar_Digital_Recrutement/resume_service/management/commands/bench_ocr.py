@@ -0,0 +1,108 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from resume_service.benchmark import (
+    synthetic_cin_corpus, synthetic_cv_corpus, measure, field_accuracy,
+    load_baseline, save_baseline, compare_to_baseline,
+)
+
+STAGES = ['decode', 'rasterise', 'detect', 'recognise', 'parse']
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'resume_service', 'benchmarks', 'ocr_baseline.json')
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the CIN and CV extraction on a synthetic offline corpus: "
+            "per-stage timings, throughput and field accuracy, compared with a stored baseline")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cins', type=int, default=10, help="Number of synthetic CIN photos")
+        parser.add_argument('--cvs', type=int, default=10, help="Number of synthetic CVs (every other one scanned)")
+        parser.add_argument('--repeat', type=int, default=1, help="Runs per document")
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline JSON file")
+        parser.add_argument('--save-baseline', action='store_true',
+                            help="Store this run as the new baseline instead of comparing")
+        parser.add_argument('--tolerance', type=float, default=0.15,
+                            help="Relative slow-down allowed before a timing is flagged")
+
+    def run_corpus(self, corpus, extractor, repeat):
+        from resume_service.ocr import collect_stage_timings
+
+        stages = dict.fromkeys(STAGES, 0.0)
+        wall_total = cpu_total = accuracy_total = 0.0
+        runs = 0
+
+        for expected, data in corpus:
+            for _ in range(repeat):
+                with collect_stage_timings() as timings:
+                    found, wall, cpu = measure(extractor, data)
+                for stage, seconds in timings.items():
+                    stages[stage] = stages.get(stage, 0.0) + seconds
+                wall_total += wall
+                cpu_total += cpu
+                runs += 1
+            accuracy_total += field_accuracy(expected, found)
+
+        return {
+            'files': len(corpus),
+            'runs': runs,
+            'wall': wall_total / runs,
+            'cpu': cpu_total / runs,
+            'throughput': runs / wall_total if wall_total else 0.0,
+            'accuracy': accuracy_total / len(corpus),
+            'stages': {stage: seconds / runs for stage, seconds in stages.items()},
+        }
+
+    def print_report(self, report):
+        header = f"{'':<5}" + "".join(f"{stage:>11}" for stage in STAGES) + f"{'total':>11}{'cpu':>11}{'files/s':>9}{'accuracy':>10}"
+        self.stdout.write("Mean milliseconds per file")
+        self.stdout.write(header)
+        for kind, stats in report.items():
+            row = f"{kind:<5}" + "".join(f"{stats['stages'].get(stage, 0.0) * 1000:>11.1f}" for stage in STAGES)
+            row += f"{stats['wall'] * 1000:>11.1f}{stats['cpu'] * 1000:>11.1f}{stats['throughput']:>9.2f}{stats['accuracy']:>10.0%}"
+            self.stdout.write(row)
+
+    def handle(self, *args, **options):
+        from resume_service.CIN import extract_cin_data
+        from resume_service.PDF import extract_cv_data
+        from resume_service.ocr import warm_up_readers
+
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1")
+
+        # Model loading is not what we measure
+        warm_up_readers()
+
+        report = {}
+        if options['cins'] > 0:
+            self.stdout.write(f"Benchmarking {options['cins']} CIN photo(s)...")
+            report['cin'] = self.run_corpus(synthetic_cin_corpus(options['cins']), extract_cin_data, options['repeat'])
+        if options['cvs'] > 0:
+            self.stdout.write(f"Benchmarking {options['cvs']} CV(s)...")
+            report['cv'] = self.run_corpus(synthetic_cv_corpus(options['cvs']), extract_cv_data, options['repeat'])
+
+        if not report:
+            raise CommandError("Nothing to benchmark, use --cins and/or --cvs")
+
+        self.stdout.write("")
+        self.print_report(report)
+
+        if options['save_baseline']:
+            save_baseline(options['baseline'], report)
+            self.stdout.write(self.style.SUCCESS(f"\nBaseline saved to {options['baseline']}"))
+            return
+
+        baseline = load_baseline(options['baseline'])
+        if baseline is None:
+            self.stdout.write(self.style.WARNING(
+                f"\nNo baseline at {options['baseline']}, run again with --save-baseline to create one"
+            ))
+            return
+
+        regressions = compare_to_baseline(report, baseline, options['tolerance'])
+        if regressions:
+            for regression in regressions:
+                self.stderr.write(f"❌ {regression}")
+            raise CommandError(f"{len(regressions)} regression(s) against {options['baseline']}")
+
+        self.stdout.write(self.style.SUCCESS("\nNo regression against the baseline"))
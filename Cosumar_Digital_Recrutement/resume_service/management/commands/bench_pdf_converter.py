@@ -0,0 +1,67 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from resume_service.docx_templates import get_compiled_template
+from resume_service.converters import get_pdf_converter, ConverterError
+from .bench_docx_render import DEFAULT_TEMPLATE, SAMPLE_REPLACEMENTS
+
+
+class Command(BaseCommand):
+    help = ("Convert the demande de stage template to PDF with the configured converter: "
+            "start-up time, latency percentiles, throughput and pool counters")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template', default=DEFAULT_TEMPLATE, help="DOCX template to fill and convert")
+        parser.add_argument('--documents', type=int, default=20, help="Number of conversions")
+        parser.add_argument('--concurrency', type=int, default=4, help="Conversions submitted at the same time")
+
+    def handle(self, *args, **options):
+        if options['documents'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--documents and --concurrency must be at least 1")
+
+        docx_bytes = get_compiled_template(options['template']).render(SAMPLE_REPLACEMENTS)
+        converter = get_pdf_converter()
+
+        started = time.perf_counter()
+        converter.warm_up()
+        self.stdout.write(f"Converter started in {time.perf_counter() - started:.1f}s")
+
+        def convert_one(_):
+            job_started = time.perf_counter()
+            try:
+                pdf_bytes = converter.convert(docx_bytes)
+            except ConverterError as e:
+                return time.perf_counter() - job_started, str(e)
+            if not pdf_bytes.startswith(b'%PDF'):
+                return time.perf_counter() - job_started, "not a PDF"
+            return time.perf_counter() - job_started, None
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(convert_one, range(options['documents'])))
+        wall = time.perf_counter() - started
+
+        errors = [error for _, error in results if error]
+        latencies = sorted(seconds for seconds, error in results if not error)
+
+        self.stdout.write(f"{len(latencies)}/{len(results)} document(s) converted in {wall:.1f}s "
+                          f"({len(latencies) / wall:.2f} documents/s)")
+        if latencies:
+            def percentile(fraction):
+                return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000
+
+            self.stdout.write(f"Latency including queue wait: p50 {percentile(0.5):.0f} ms, "
+                              f"p95 {percentile(0.95):.0f} ms, max {latencies[-1] * 1000:.0f} ms")
+
+        self.stdout.write("")
+        for name, value in converter.metrics().items():
+            if isinstance(value, float):
+                value = f"{value:.3f}"
+            self.stdout.write(f"{name:<24}{value}")
+
+        converter.shutdown()
+
+        if errors:
+            for error in sorted(set(errors)):
+                self.stderr.write(f"❌ {error}")
+            raise CommandError(f"{len(errors)} conversion(s) failed")
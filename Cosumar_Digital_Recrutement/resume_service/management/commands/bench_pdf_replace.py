@@ -0,0 +1,109 @@
+import io
+import time
+from typing import Dict
+import fitz
+from django.core.management.base import BaseCommand, CommandError
+from resume_service.PDF import replace_multiple_words_in_pdf, replacement_font_size
+
+
+def make_placeholder_pdf(pages, words_per_page):
+    """A PDF whose pages hold words_per_page «FIELD_n» placeholders each, and the replacements"""
+    document = fitz.open()
+    for page_number in range(pages):
+        page = document.new_page()
+        page.insert_text((50, 40), f"Page {page_number + 1}", fontsize=12)
+        for index in range(words_per_page):
+            y = 70 + (index % 40) * 18
+            x = 50 if index < 40 else 320
+            page.insert_text((x, y), f"Champ {index} : «FIELD_{index}»", fontsize=10)
+    pdf_bytes = document.tobytes()
+    document.close()
+
+    replacements = {f"«FIELD_{index}»": f"Valeur-{index}-" for index in range(words_per_page)}
+    return pdf_bytes, replacements
+
+
+# replace_multiple_words_in_pdf before the batched version, kept to compare speed:
+# the PDF is opened, redacted and saved again for every word, on its first page only.
+
+def legacy_replace_word_in_pdf(pdf_bytes: bytes, old_word: str, new_word: str) -> bytes:
+    try:
+        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+        page = pdf_document[0]
+        areas = page.search_for(old_word)
+
+        for area in areas:
+            expanded_area = fitz.Rect(area.x0 - 2, area.y0 - 2, area.x1 + len(new_word) * 2, area.y1 + 2)
+            page.add_redact_annot(expanded_area, fill=(1, 1, 1))
+            page.apply_redactions()
+            page.insert_text(area.bl, new_word, fontsize=replacement_font_size(new_word, area), color=(0, 0, 0))
+
+        output_buffer = io.BytesIO()
+        pdf_document.save(output_buffer)
+        pdf_document.close()
+        return output_buffer.getvalue()
+
+    except Exception as e:
+        print(f"Error replacing word in PDF: {str(e)}")
+        return pdf_bytes
+
+
+def legacy_replace_multiple_words_in_pdf(pdf_bytes: bytes, replacements: Dict[str, str]) -> bytes:
+    modified_pdf = pdf_bytes
+    for old_word, new_word in replacements.items():
+        modified_pdf = legacy_replace_word_in_pdf(modified_pdf, old_word, new_word)
+    return modified_pdf
+
+
+def count_words(pdf_bytes, words):
+    """Occurrences of the words left on each page"""
+    document = fitz.open(stream=pdf_bytes, filetype="pdf")
+    counts = [sum(page.get_text().count(word) for word in words) for page in document]
+    document.close()
+    return counts
+
+
+class Command(BaseCommand):
+    help = ("Compare the batched replace_multiple_words_in_pdf with the former one-save-per-word "
+            "version on a multi-page PDF")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=5, help="Pages of the generated PDF")
+        parser.add_argument('--words', type=int, default=30, help="Placeholders per page (at most 80)")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs of each version")
+
+    def time_runs(self, func, pdf_bytes, replacements, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func(pdf_bytes, replacements)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def handle(self, *args, **options):
+        if options['pages'] < 1 or not 1 <= options['words'] <= 80 or options['repeat'] < 1:
+            raise CommandError("--pages and --repeat must be at least 1, --words between 1 and 80")
+
+        pdf_bytes, replacements = make_placeholder_pdf(options['pages'], options['words'])
+        self.stdout.write(f"{options['pages']} page(s) x {options['words']} placeholder(s), "
+                          f"{len(pdf_bytes) / 1024:.0f} KB, best of {options['repeat']} run(s)")
+
+        legacy_time, legacy_pdf = self.time_runs(legacy_replace_multiple_words_in_pdf, pdf_bytes, replacements,
+                                                 options['repeat'])
+        batched_time, batched_pdf = self.time_runs(replace_multiple_words_in_pdf, pdf_bytes, replacements,
+                                                   options['repeat'])
+
+        legacy_left = count_words(legacy_pdf, replacements)
+        batched_left = count_words(batched_pdf, replacements)
+        batched_written = count_words(batched_pdf, replacements.values())
+
+        self.stdout.write(f"{'':<10}{'ms':>10}{'placeholders left per page':>32}")
+        self.stdout.write(f"{'legacy':<10}{legacy_time * 1000:>10.1f}{str(legacy_left):>32}")
+        self.stdout.write(f"{'batched':<10}{batched_time * 1000:>10.1f}{str(batched_left):>32}")
+        self.stdout.write(f"Speed-up: {legacy_time / batched_time:.1f}x (the legacy version only handles page 1)")
+
+        expected = [len(replacements)] * options['pages']
+        if any(batched_left) or batched_written != expected:
+            raise CommandError(f"Batched replacement incomplete: {batched_left} left, {batched_written} written")
+        self.stdout.write(self.style.SUCCESS("Every placeholder of every page was replaced"))
@@ -0,0 +1,100 @@
+import re
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Diagnostic: call the stage / stagiaire list and detail endpoints on the data of a deployment and "
+            "check that their queries do not select any binary document column (covered by the "
+            "resume_service tests, see DocumentColumnsQueryTests). Changes made by update endpoints are rolled back")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Email of the admin user calling the endpoints (first admin by default)")
+        parser.add_argument('--stage', type=int, help="Stage used by the detail endpoints (latest one by default)")
+        parser.add_argument('--show-sql', action='store_true', help="Print the queries of each endpoint")
+
+    def document_columns_pattern(self):
+        from resume_service.models import Stage, Stagiaire
+
+        columns = []
+        for model in (Stage, Stagiaire):
+            table = model._meta.db_table
+            columns += [rf'"{table}"\."{name}"' for name in model.BLOB_DOCUMENTS]
+        return re.compile('|'.join(columns))
+
+    def endpoints(self, stage):
+        return [
+            ('GET', reverse('chercher_stages'), None),
+            ('GET', reverse('chercher_stagiaires'), None),
+            ('GET', reverse('get_all_stagiaires'), None),
+            ('GET', reverse('stats_counts'), None),
+            ('GET', reverse('recuperer_stage', args=[stage.id]), None),
+            ('GET', reverse('get_candidate_documents', args=[stage.stagiaire_id]), None),
+            ('PUT', reverse('update_stage', args=[stage.id]), {'statut': stage.statut}),
+        ]
+
+    def call(self, factory, user, method, path, data):
+        request = getattr(factory, method.lower())(path, data, format='json') if data else \
+            getattr(factory, method.lower())(path)
+        force_authenticate(request, user=user)
+        match = resolve(path)
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def handle(self, *args, **options):
+        from auth_service.models import Utilisateur
+        from resume_service.models import Stage
+
+        users = Utilisateur.objects.filter(email=options['user']) if options['user'] else \
+            Utilisateur.objects.filter(role='admin').order_by('id')
+        user = users.first()
+        if user is None:
+            raise CommandError("No admin user found, use --user")
+
+        stages = Stage.objects.filter(deleted=False, stagiaire__isnull=False)
+        stage = stages.filter(id=options['stage']).first() if options['stage'] else stages.order_by('-id').first()
+        if stage is None:
+            raise CommandError("No stage found, use --stage")
+
+        pattern = self.document_columns_pattern()
+        factory = APIRequestFactory()
+        offenders = []
+
+        self.stdout.write(f"{'endpoint':<52}{'status':>7}{'queries':>9}{'document columns':>18}")
+        for method, path, data in self.endpoints(stage):
+            try:
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as queries:
+                        response = self.call(factory, user, method, path, data)
+                    raise Rollback()
+            except Rollback:
+                pass
+
+            selected = []
+            for query in queries.captured_queries:
+                sql = query['sql']
+                # Only the selected columns, a document may appear in a WHERE ... IS NULL
+                select_list = sql.split(' FROM ', 1)[0] if sql.startswith('SELECT') else ''
+                selected += pattern.findall(select_list)
+
+            mark = '✅' if not selected else '❌'
+            self.stdout.write(f"{mark} {method + ' ' + path:<50}{response.status_code:>7}"
+                              f"{len(queries.captured_queries):>9}{len(selected):>18}")
+            if selected:
+                offenders.append(f"{method} {path}: {', '.join(sorted(set(selected)))}")
+            if options['show_sql']:
+                for query in queries.captured_queries:
+                    self.stdout.write(f"    {query['sql']}")
+
+        if offenders:
+            raise CommandError("Document columns selected by:\n" + '\n'.join(offenders))
+        self.stdout.write(self.style.SUCCESS("No endpoint transferred document bytes"))
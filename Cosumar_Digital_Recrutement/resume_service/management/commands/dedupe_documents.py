@@ -0,0 +1,66 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from resume_service.dedup import dedup_report, recount_references, delete_unreferenced_blobs, unreferenced_blobs
+from .migrate_blobs import format_size
+
+
+class Command(BaseCommand):
+    help = ("Deduplicate the stage / stagiaire documents: move the copies still kept in the binary columns to "
+            "the blob store (identical documents then share one blob), recount the references of every blob "
+            "and, with --gc, delete the blobs no longer referenced. Meant to be run periodically (cron), "
+            "it can be stopped and run again")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help="Rows read per query")
+        parser.add_argument('--limit', type=int, help="Move at most this many documents")
+        parser.add_argument('--skip-move', action='store_true', help="Do not move the binary columns")
+        parser.add_argument('--gc', action='store_true', help="Delete the blobs referenced by no document")
+        parser.add_argument('--grace', type=float, default=24,
+                            help="Hours a new blob is kept before it can be deleted (default 24)")
+        parser.add_argument('--dry-run', action='store_true', help="Only report, nothing is changed")
+
+    def write_report(self, title):
+        report = dedup_report()
+        self.stdout.write(f"{title}: {report['documents']} document(s) in {report['blobs']} blob(s), "
+                          f"{report['shared_blobs']} shared")
+        self.stdout.write(f"  {format_size(report['document_bytes'])} of documents stored in "
+                          f"{format_size(report['stored_bytes'])}, {format_size(report['saved_bytes'])} saved "
+                          f"({report['saved_ratio']:.1%})")
+        for label, counts in report['by_document'].items():
+            if counts['documents'] or counts['legacy_documents']:
+                self.stdout.write(f"  {label}: {counts['documents']} document(s) in {counts['blobs']} blob(s), "
+                                  f"{counts['legacy_documents']} still in the table "
+                                  f"({format_size(counts['legacy_bytes'])})")
+        if report['unreferenced_blobs']:
+            self.stdout.write(f"  {report['unreferenced_blobs']} blob(s) referenced by no document "
+                              f"({format_size(report['unreferenced_bytes'])})")
+        return report
+
+    def handle(self, *args, **options):
+        if options['grace'] < 0:
+            raise CommandError("--grace must be positive")
+
+        before = self.write_report("Before")
+
+        if not options['skip_move']:
+            call_command('migrate_blobs', batch_size=options['batch_size'], limit=options['limit'],
+                         dry_run=options['dry_run'], stdout=self.stdout, stderr=self.stderr)
+
+        if options['dry_run']:
+            if options['gc']:
+                self.stdout.write(f"{unreferenced_blobs(options['grace'] * 3600).count()} blob(s) would be "
+                                  f"deleted (counts as recorded, not recounted)")
+            return
+
+        corrected = recount_references(options['batch_size'])
+        self.stdout.write(f"Reference counts corrected on {corrected} blob(s)")
+
+        if options['gc']:
+            deleted, freed = delete_unreferenced_blobs(options['grace'] * 3600)
+            self.stdout.write(f"🗑️ {deleted} unreferenced blob(s) deleted, {format_size(freed)} freed")
+
+        after = self.write_report("After")
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {format_size(after['saved_bytes'])} saved by deduplication "
+            f"({format_size(after['saved_bytes'] - before['saved_bytes'])} more than before)"
+        ))
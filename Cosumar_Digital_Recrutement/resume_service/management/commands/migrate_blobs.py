@@ -0,0 +1,116 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Length
+from resume_service.blobstore import store_blob, get_store_config, add_blob_references
+
+
+def format_size(size):
+    for unit in ['B', 'KB', 'MB']:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+class Command(BaseCommand):
+    help = ("Move the documents still stored in the binary columns of Stage / Stagiaire to the blob store, "
+            "in batches. Rows already moved are skipped, the command can be stopped and run again")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=['stage', 'stagiaire'], help="Only this model")
+        parser.add_argument('--document', help="Only this document, e.g. cv or cin")
+        parser.add_argument('--batch-size', type=int, default=50, help="Rows read per query")
+        parser.add_argument('--limit', type=int, help="Stop after this many documents")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the documents to move")
+
+    def selected_documents(self, options):
+        from resume_service.models import Stage, Stagiaire
+
+        documents = [(Stagiaire, name) for name in Stagiaire.BLOB_DOCUMENTS]
+        documents += [(Stage, name) for name in Stage.BLOB_DOCUMENTS]
+        if options['model']:
+            documents = [(model, name) for model, name in documents if model._meta.model_name == options['model']]
+        if options['document']:
+            documents = [(model, name) for model, name in documents if name == options['document']]
+        if not documents:
+            raise CommandError("No document matches --model / --document")
+        return documents
+
+    def move_document(self, model, name, pk):
+        """Move one document of one row, returns its size (None when another process moved it first)"""
+        with transaction.atomic():
+            row = model.objects.select_for_update().filter(pk=pk).values_list(name, f'{name}_blob').first()
+            if row is None or row[0] is None:
+                return None
+            data, previous = row
+            blob = store_blob(data) if len(data) else None
+            model.objects.filter(pk=pk).update(**{name: None, f'{name}_blob': blob})
+            # A document already stored by another row is only referenced once more
+            add_blob_references([blob.sha256 if blob else None], [previous])
+            return len(data)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        documents = self.selected_documents(options)
+        config = get_store_config()
+        self.stdout.write(f"Blob store: {config['BACKEND']} "
+                          f"({config['LOCATION'] if config['BACKEND'] == 'local' else config['S3_BUCKET']})")
+
+        moved = moved_bytes = 0
+        failed = {}
+        started = time.monotonic()
+
+        for model, name in documents:
+            label = f"{model._meta.model_name}.{name}"
+            pending = model.objects.filter(**{f'{name}__isnull': False})
+            totals = pending.aggregate(count=Count('pk'), size=Sum(Length(name)))
+            self.stdout.write(f"{label}: {totals['count']} document(s), {format_size(totals['size'] or 0)} to move")
+            if options['dry_run'] or not totals['count']:
+                continue
+
+            skipped = []
+            document_moved = document_bytes = 0
+            while options['limit'] is None or moved < options['limit']:
+                # Only the keys, the documents are read one by one
+                pks = list(pending.exclude(pk__in=skipped).order_by('pk').values_list('pk', flat=True)[
+                    :options['batch_size']
+                ])
+                if not pks:
+                    break
+
+                for pk in pks:
+                    if options['limit'] is not None and moved >= options['limit']:
+                        break
+                    try:
+                        size = self.move_document(model, name, pk)
+                    except Exception as e:
+                        failed[f"{label} {pk}"] = str(e)
+                        skipped.append(pk)
+                        self.stderr.write(f"❌ {label} {pk}: {e}")
+                        continue
+                    if size is not None:
+                        moved += 1
+                        moved_bytes += size
+                        document_moved += 1
+                        document_bytes += size
+
+                elapsed = time.monotonic() - started
+                self.stdout.write(f"  {label}: {document_moved}/{totals['count']} moved, {format_size(document_bytes)} "
+                                  f"| total {format_size(moved_bytes)} ({format_size(moved_bytes / elapsed if elapsed else 0)}/s)")
+
+        if options['dry_run']:
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {moved} document(s) moved to the blob store ({format_size(moved_bytes)}) "
+            f"in {time.monotonic() - started:.1f}s"
+        ))
+        if moved:
+            self.stdout.write("The space freed in the tables is reclaimed by VACUUM FULL (or pg_repack) on "
+                              "resume_service_stage and resume_service_stagiaire")
+        if failed:
+            raise CommandError(f"{len(failed)} document(s) could not be moved, run the command again to retry them")
@@ -0,0 +1,94 @@
+import multiprocessing
+import signal
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+def worker_loop(worker_number, poll_interval, warmup):
+    """Claim and run OCR jobs until the process is stopped"""
+    from resume_service.jobs import claim_next_job, run_job
+
+    # Let the parent handle Ctrl+C, it terminates the pool cleanly
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if warmup:
+        from resume_service.ocr import warm_up_readers
+        warm_up_readers()
+
+    print(f"👷 OCR worker {worker_number} ready")
+    while True:
+        try:
+            job = claim_next_job()
+        except Exception as e:
+            print(f"⚠️ OCR worker {worker_number} could not claim a job: {e}")
+            connections.close_all()
+            time.sleep(poll_interval)
+            continue
+
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        started = time.perf_counter()
+        job = run_job(job)
+        print(f"✅ OCR worker {worker_number}: {job.kind} job {job.id} {job.statut} in {time.perf_counter() - started:.2f}s")
+
+
+class Command(BaseCommand):
+    help = "Run a pool of processes executing the asynchronous CIN / CV OCR jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'OCR_WORKERS', 2),
+                            help="Number of OCR processes")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to wait when the queue is empty")
+        parser.add_argument('--no-warmup', action='store_true',
+                            help="Load the OCR models on the first job instead of at startup")
+
+    def handle(self, *args, **options):
+        from resume_service.jobs import requeue_stale_jobs, purge_old_jobs
+
+        requeued = requeue_stale_jobs()
+        purged = purge_old_jobs()
+        self.stdout.write(f"Requeued {requeued} stale job(s), purged {purged} old job(s)")
+
+        # Each child opens its own database connection
+        connections.close_all()
+
+        processes = []
+        for worker_number in range(options['workers']):
+            process = multiprocessing.Process(
+                target=worker_loop,
+                args=(worker_number, options['poll_interval'], not options['no_warmup']),
+                daemon=True,
+            )
+            process.start()
+            processes.append(process)
+
+        self.stdout.write(self.style.SUCCESS(f"Started {len(processes)} OCR worker(s)"))
+
+        try:
+            while True:
+                # Restart workers that crashed (e.g. killed by the OOM killer)
+                for index, process in enumerate(processes):
+                    if not process.is_alive():
+                        self.stderr.write(f"OCR worker {index} exited with code {process.exitcode}, restarting")
+                        requeue_stale_jobs()
+                        connections.close_all()
+                        process = multiprocessing.Process(
+                            target=worker_loop,
+                            args=(index, options['poll_interval'], not options['no_warmup']),
+                            daemon=True,
+                        )
+                        process.start()
+                        processes[index] = process
+                time.sleep(5)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping OCR workers...")
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join(timeout=10)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from resume_service.uploads import get_upload_config, purge_expired_uploads
+
+
+class Command(BaseCommand):
+    help = ("Delete the chunked uploads not updated for CHUNKED_UPLOADS EXPIRY seconds and their temporary files. "
+            "Documents of finished uploads stay in the blob store. Meant to be run periodically (cron)")
+
+    def handle(self, *args, **options):
+        config = get_upload_config()
+        deleted = purge_expired_uploads()
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {deleted} expired upload(s) deleted from {config['TEMP_DIR']}"
+        ))
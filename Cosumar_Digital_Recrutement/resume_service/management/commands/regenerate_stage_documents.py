@@ -0,0 +1,181 @@
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import signal
+import sys
+import time
+from datetime import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+DEFAULT_CHECKPOINT = os.path.join(settings.BASE_DIR, '.regenerate_stage_documents.json')
+
+
+def init_worker():
+    from resume_service.converters import shutdown_converter
+
+    # Let the parent handle Ctrl+C, it saves the checkpoint and terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Exit through the finalizers on terminate(), so LibreOffice is stopped too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    multiprocessing.util.Finalize(None, shutdown_converter, exitpriority=10)
+
+    # One LibreOffice process per worker, the pool provides the parallelism
+    settings.LIBREOFFICE_POOL = {**getattr(settings, 'LIBREOFFICE_POOL', {}), 'SIZE': 1, 'QUEUE_SIZE': 0}
+
+
+def render_stage(stage_id):
+    """Render the documents of one stage, returns (stage_id, outcome, error, seconds)"""
+    from resume_service.documents import rerender_demande
+
+    started = time.perf_counter()
+    try:
+        outcome, error = rerender_demande(stage_id)
+    except Exception as e:
+        outcome, error = 'echoue', str(e) or e.__class__.__name__
+    return stage_id, outcome, error, time.perf_counter() - started
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class Command(BaseCommand):
+    help = ("Regenerate demande_de_stage / demande_de_stage_pdf for existing stages with a pool of processes. "
+            "Progress is saved in a checkpoint file, running the same command again resumes it")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ids', type=int, nargs='+', help="Only these stages")
+        parser.add_argument('--statut', nargs='+', help="Only stages with one of these statuts")
+        parser.add_argument('--nature', nargs='+', help="Only stages of these natures")
+        parser.add_argument('--created-after', help="Only stages created on or after this date (YYYY-MM-DD)")
+        parser.add_argument('--created-before', help="Only stages created before this date (YYYY-MM-DD)")
+        parser.add_argument('--missing-pdf', action='store_true', help="Only stages without a cached PDF")
+        parser.add_argument('--failed', action='store_true',
+                            help="Only stages whose background rendering failed")
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'LIBREOFFICE_POOL', {}).get('SIZE', 2),
+                            help="Number of processes, each one with its own LibreOffice process")
+        parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help="Checkpoint JSON file")
+        parser.add_argument('--restart', action='store_true',
+                            help="Ignore the checkpoint and regenerate every selected stage")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the selected stages")
+
+    def selected_stage_ids(self, options):
+        from resume_service.models import Stage
+
+        stages = Stage.objects.filter(deleted=False, stagiaire__isnull=False)
+        if options['ids']:
+            stages = stages.filter(id__in=options['ids'])
+        if options['statut']:
+            stages = stages.filter(statut__in=options['statut'])
+        if options['nature']:
+            stages = stages.filter(nature__in=options['nature'])
+        try:
+            if options['created_after']:
+                stages = stages.filter(created_at__date__gte=datetime.strptime(options['created_after'], '%Y-%m-%d').date())
+            if options['created_before']:
+                stages = stages.filter(created_at__date__lt=datetime.strptime(options['created_before'], '%Y-%m-%d').date())
+        except ValueError:
+            raise CommandError("Dates must be given as YYYY-MM-DD")
+        if options['missing_pdf']:
+            stages = stages.filter(demande_de_stage_pdf__isnull=True, demande_de_stage_pdf_blob__isnull=True)
+        if options['failed']:
+            stages = stages.filter(demande_de_stage_statut='echoue')
+
+        # Only the ids: the documents are loaded by the workers, one stage at a time
+        return list(stages.order_by('id').values_list('id', flat=True))
+
+    def load_checkpoint(self, path, selection, restart):
+        if restart or not os.path.exists(path):
+            return set()
+        with open(path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('selection') != selection:
+            raise CommandError(
+                f"{path} was written for other filters ({checkpoint.get('selection')}), "
+                f"use --restart or another --checkpoint"
+            )
+        return set(checkpoint.get('done', []))
+
+    def save_checkpoint(self, path, selection, done, failed):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'selection': selection, 'done': sorted(done), 'failed': failed}, f)
+        os.replace(temp_path, path)
+
+    def handle(self, *args, **options):
+        from resume_service.template_registry import DEMANDE_DE_STAGE, TemplateNotFound, get_template
+
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+        try:
+            get_template(DEMANDE_DE_STAGE)
+        except TemplateNotFound as e:
+            raise CommandError(str(e))
+
+        selection = {
+            key: options[key]
+            for key in ['ids', 'statut', 'nature', 'created_after', 'created_before', 'missing_pdf', 'failed']
+            if options[key]
+        }
+        stage_ids = self.selected_stage_ids(options)
+        done = self.load_checkpoint(options['checkpoint'], selection, options['restart'])
+        todo = [stage_id for stage_id in stage_ids if stage_id not in done]
+
+        self.stdout.write(f"{len(stage_ids)} stage(s) selected, {len(stage_ids) - len(todo)} already done, "
+                          f"{len(todo)} to regenerate with {options['workers']} process(es)")
+        if options['dry_run'] or not todo:
+            return
+
+        failed = {}
+        processed = 0
+        started = last_saved = time.monotonic()
+
+        # Each child opens its own database connection
+        connections.close_all()
+        pool = multiprocessing.Pool(options['workers'], initializer=init_worker)
+        try:
+            for stage_id, outcome, error, seconds in pool.imap_unordered(render_stage, todo):
+                processed += 1
+                if outcome == 'pret':
+                    done.add(stage_id)
+                    failed.pop(str(stage_id), None)
+                    mark = '✅'
+                else:
+                    failed[str(stage_id)] = error
+                    mark = '❌'
+
+                elapsed = time.monotonic() - started
+                rate = processed / elapsed if elapsed else 0.0
+                eta = (len(todo) - processed) / rate if rate else 0.0
+                line = (f"[{processed}/{len(todo)}] {mark} stage {stage_id} in {seconds:.1f}s | "
+                        f"{rate:.2f} stage(s)/s | ETA {format_duration(eta)}")
+                if error:
+                    line += f" | {error}"
+                self.stdout.write(line)
+
+                # Written every few seconds, not after each stage
+                if time.monotonic() - last_saved > 5:
+                    self.save_checkpoint(options['checkpoint'], selection, done, failed)
+                    last_saved = time.monotonic()
+
+            pool.close()
+        except KeyboardInterrupt:
+            self.stdout.write("Interrupted, run the same command again to resume")
+            pool.terminate()
+        finally:
+            pool.join()
+            self.save_checkpoint(options['checkpoint'], selection, done, failed)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"{processed - len(failed)} stage(s) regenerated, {len(failed)} failed "
+                          f"in {format_duration(elapsed)}, checkpoint saved to {options['checkpoint']}")
+        if failed:
+            raise CommandError(f"{len(failed)} stage(s) could not be regenerated, run again to retry them")
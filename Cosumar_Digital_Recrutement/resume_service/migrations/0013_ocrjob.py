@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:17
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resume_service', '0012_ocrresult'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OcrJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('cin', 'CIN'), ('cv', 'CV')], max_length=10)),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('termine', 'Terminé'), ('echoue', 'Échoué')], db_index=True, default='en_attente', max_length=20)),
+                ('progression', models.IntegerField(default=0)),
+                ('nom_fichier', models.CharField(blank=True, default='', max_length=255)),
+                ('fichier', models.BinaryField(blank=True, null=True)),
+                ('resultat', models.JSONField(blank=True, null=True)),
+                ('cached', models.BooleanField(default=False)),
+                ('erreur', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ocr_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
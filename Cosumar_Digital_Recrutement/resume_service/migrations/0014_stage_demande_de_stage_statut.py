@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resume_service', '0013_ocrjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stage',
+            name='demande_de_stage_erreur',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='demande_de_stage_statut',
+            field=models.CharField(blank=True, choices=[('en_attente', 'En attente'), ('pret', 'Prêt'), ('echoue', 'Échoué')], default=None, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='demande_de_stage_statut_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resume_service', '0014_stage_demande_de_stage_statut'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_document', models.CharField(choices=[('demande_de_stage', 'Demande de stage')], default='demande_de_stage', max_length=50)),
+                ('nature', models.CharField(blank=True, default='', max_length=50)),
+                ('version', models.IntegerField()),
+                ('nom_fichier', models.CharField(blank=True, default='', max_length=255)),
+                ('fichier', models.BinaryField()),
+                ('sha256', models.CharField(max_length=64)),
+                ('placeholders', models.JSONField(default=list)),
+                ('actif', models.BooleanField(db_index=True, default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='document_templates', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('type_document', 'nature', 'version')},
+            },
+        ),
+    ]
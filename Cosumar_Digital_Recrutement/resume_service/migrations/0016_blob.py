@@ -0,0 +1,57 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resume_service', '0015_documenttemplate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('taille', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='assurance_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='resume_service.blob'),
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='convention_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='resume_service.blob'),
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='cv_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='resume_service.blob'),
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='demande_de_stage_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='resume_service.blob'),
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='demande_de_stage_pdf_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='resume_service.blob'),
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='lettre_motivation_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='resume_service.blob'),
+        ),
+        migrations.AddField(
+            model_name='stagiaire',
+            name='cin_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='resume_service.blob'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:40
+
+from collections import Counter
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_references(apps, schema_editor):
+    """Reference counts of the blobs already stored"""
+    Blob = apps.get_model('resume_service', 'Blob')
+    counts = Counter()
+    for model_name in ('Stage', 'Stagiaire'):
+        model = apps.get_model('resume_service', model_name)
+        for field in model._meta.get_fields():
+            if field.many_to_one and field.related_model is Blob:
+                rows = model.objects.filter(**{f'{field.name}__isnull': False}).values_list(field.name).annotate(
+                    documents=Count('pk')
+                )
+                counts.update(dict(rows))
+    for key, references in counts.items():
+        Blob.objects.filter(sha256=key).update(references=references)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resume_service', '0017_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='references',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-19 09:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resume_service', '0018_blob_references'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='last_stored_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,10 +1,170 @@
-from django.db import models
+from django.db import models, transaction
+import uuid
 from datetime import timedelta
 from datetime import datetime
+from django.utils import timezone
 
 from numpy import extract
+from .blobstore import store_blob, read_blob, add_blob_references
+
+class Blob(models.Model):
+    """Document kept in the blob store (see blobstore), addressed by the SHA-256 of its content"""
+    sha256 = models.CharField(primary_key=True, max_length=64)
+    taille = models.BigIntegerField()
+    # Stage / stagiaire documents referencing this blob, recounted by dedupe_documents
+    references = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Last time the content was stored (again), an unreferenced blob is kept for a while after it
+    last_stored_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.sha256
+
+class BlobDocumentsMixin:
+    """
+    Documents of a model stored in the blob store
+
+    Each document <name> of BLOB_DOCUMENTS is referenced by the <name>_blob
+    foreign key. The <name> binary column is the former storage, still read
+    for rows that migrate_blobs has not moved yet, and emptied when the
+    document is written.
+
+    Saving or deleting a row updates the reference count of the blobs it
+    stops or starts referencing.
+    """
+    BLOB_DOCUMENTS = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Blobs referenced in the database, to count the references changed by save()
+        instance._stored_blobs = {
+            name: instance.__dict__[f'{name}_blob_id']
+            for name in cls.BLOB_DOCUMENTS if f'{name}_blob_id' in instance.__dict__
+        }
+        return instance
+
+    def blob_reference_changes(self, update_fields=None):
+        """{document name: (blob referenced in the database, blob referenced now)} of the documents changed"""
+        stored = getattr(self, '_stored_blobs', {})
+        names = [
+            name for name in self.BLOB_DOCUMENTS
+            if f'{name}_blob_id' in self.__dict__
+            and (update_fields is None or f'{name}_blob' in update_fields or f'{name}_blob_id' in update_fields)
+        ]
+        unknown = [name for name in names if name not in stored and not self._state.adding]
+        if unknown:
+            # Column deferred when the row was loaded
+            row = type(self)._base_manager.filter(pk=self.pk).values(*(f'{name}_blob' for name in unknown)).first() or {}
+            stored = {**stored, **{name: row.get(f'{name}_blob') for name in unknown}}
+        return {
+            name: (stored.get(name), self.__dict__[f'{name}_blob_id'])
+            for name in names if stored.get(name) != self.__dict__[f'{name}_blob_id']
+        }
+
+    def save(self, *args, **kwargs):
+        changes = self.blob_reference_changes(kwargs.get('update_fields'))
+        if not changes:
+            return super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            add_blob_references([new for _, new in changes.values()], [old for old, _ in changes.values()])
+        self._stored_blobs = {**getattr(self, '_stored_blobs', {}),
+                              **{name: new for name, (_, new) in changes.items()}}
+
+    def delete(self, *args, **kwargs):
+        referenced = [getattr(self, f'{name}_blob_id') for name in self.BLOB_DOCUMENTS]
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            add_blob_references([], referenced)
+        return result
+
+    def has_document(self, name):
+        """Whether the document exists, without loading a deferred binary column"""
+        if getattr(self, f'{name}_blob_id'):
+            return True
+        if name in self.get_deferred_fields():
+            stored = type(self)._base_manager.filter(pk=self.pk, **{f'{name}__isnull': False}).exists()
+            if not stored:
+                # Known to be empty, later checks do not query again
+                self.__dict__[name] = None
+            return stored
+        return bool(getattr(self, name))
+
+    def get_document(self, name):
+        """Content of a document, None when there is none"""
+        key = getattr(self, f'{name}_blob_id')
+        if key:
+            return read_blob(key)
+        data = getattr(self, name)
+        return bytes(data) if data else None
+
+    def set_document(self, name, data):
+        """
+        Store a document (None or empty removes it), the caller saves the row
+
+        Returns:
+            The columns to pass to save(update_fields=...)
+        """
+        return self.set_document_blob(name, store_blob(data) if data else None)
+
+    def set_document_blob(self, name, blob):
+        """Reference a document already in the blob store (None removes it), the caller saves the row"""
+        setattr(self, f'{name}_blob', blob)
+        setattr(self, name, None)
+        return [name, f'{name}_blob']
+
+class DocumentsQuerySet(models.QuerySet):
+    """
+    Queryset leaving the binary document columns out of the SELECT
+
+    The columns of BLOB_DOCUMENTS are deferred, also on the models joined by
+    select_related. They are loaded on access (one query per column and
+    row) or up front with with_documents().
+    """
+
+    def related_documents(self, lookups):
+        deferred = []
+        for lookup in lookups:
+            model = self.model
+            for part in lookup.split('__'):
+                model = model._meta.get_field(part).related_model
+            deferred += [f'{lookup}__{name}' for name in getattr(model, 'BLOB_DOCUMENTS', ())]
+        return deferred
+
+    def select_related(self, *fields):
+        queryset = super().select_related(*fields)
+        deferred = self.related_documents(fields)
+        return queryset.defer(*deferred) if deferred else queryset
+
+    def with_documents(self, *names):
+        """
+        Load the binary columns of these documents with the rows
+
+        Args:
+            names: Documents of the model or of a model joined by
+                select_related (e.g. 'stagiaire__cin'), every document of
+                the model when no name is given
+        """
+        names = set(names or self.model.BLOB_DOCUMENTS)
+        existing, defer = self.query.deferred_loading
+        if not defer:
+            # only(): add the columns to the loaded ones
+            return self.only(*existing, *names)
+        return self.defer(None).defer(*(existing - names))
+
+
+class DocumentsManager(models.Manager.from_queryset(DocumentsQuerySet)):
+    """Default manager of the models with BLOB_DOCUMENTS: the binary columns are deferred"""
+
+    def get_queryset(self):
+        return super().get_queryset().defer(*self.model.BLOB_DOCUMENTS)
+
+
+class Stagiaire(BlobDocumentsMixin, models.Model):
+    BLOB_DOCUMENTS = ('cin',)
 
-class Stagiaire(models.Model):
     matricule = models.CharField(primary_key=True, max_length=8, default='')
     prenom = models.CharField(max_length=100, null=True, blank=True)
     nom = models.CharField(max_length=100, null=True, blank=True)
@@ -12,11 +172,14 @@ class Stagiaire(models.Model):
     num_tel = models.CharField(max_length=15, unique=True, blank=True, null=True)
     date_naissance = models.DateField(null=True, blank=True)
     cin = models.BinaryField(null=True, blank=True)
+    cin_blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
     date_creation = models.DateTimeField(auto_now_add=True)
     deleted = models.BooleanField(default=False)
     deleted_at = models.DateTimeField(null=True, blank=True)
     deleted_by = models.ForeignKey('auth_service.Utilisateur', on_delete=models.SET_NULL, null=True, blank=True, related_name="stagiaires_deleted")
 
+    objects = DocumentsManager()
+
 class Sujet(models.Model):
     id = models.AutoField(primary_key=True)
     created_by = models.ForeignKey(
@@ -43,7 +206,9 @@ class Sujet(models.Model):
     def __str__(self):
         return self.titre
 
-class Stage(models.Model):
+class Stage(BlobDocumentsMixin, models.Model):
+    BLOB_DOCUMENTS = ('cv', 'convention', 'assurance', 'lettre_motivation', 'demande_de_stage', 'demande_de_stage_pdf')
+
     id = models.AutoField(primary_key=True)
     stagiaire = models.ForeignKey(
         Stagiaire, 
@@ -84,12 +249,29 @@ class Stage(models.Model):
     lettre_motivation = models.BinaryField(null=True, blank=True)
     cv = models.BinaryField(null=True, blank=True)
     demande_de_stage = models.BinaryField(null=True, blank=True)
+    demande_de_stage_pdf = models.BinaryField(null=True, blank=True)
+    convention_blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    assurance_blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    lettre_motivation_blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    cv_blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    demande_de_stage_blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    demande_de_stage_pdf_blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    # Background rendering of demande_de_stage / demande_de_stage_pdf (null for stages rendered inline)
+    demande_de_stage_statut = models.CharField(max_length=20, choices=[
+        ('en_attente', 'En attente'),
+        ('pret', 'Prêt'),
+        ('echoue', 'Échoué'),
+    ], null=True, blank=True, default=None)
+    demande_de_stage_erreur = models.TextField(null=True, blank=True)
+    demande_de_stage_statut_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     deleted = models.BooleanField(default=False)
     deleted_at = models.DateTimeField(null=True, blank=True)
     deleted_by = models.ForeignKey('auth_service.Utilisateur', on_delete=models.SET_NULL, null=True, blank=True)
 
+    objects = DocumentsManager()
+
     def initialize_demande_data(self):
         """Initialize the demande_de_stage_data JSON structure"""
         if not self.demande_de_stage_data:
@@ -193,7 +375,8 @@ class Stage(models.Model):
 
     def check_documents_and_expire(self):
         if self.statut == 'accepte':
-            if not self.cv or not self.stagiaire.cin or not self.convention or not self.assurance:
+            if not all([self.has_document('cv'), self.stagiaire.has_document('cin'),
+                        self.has_document('convention'), self.has_document('assurance')]):
                 self.statut = 'expire'
                 self.save()
 
@@ -211,5 +394,95 @@ class Logs(models.Model):
     def __str__(self):
         return self.nom
 
+class OcrResult(models.Model):
+    """Cached result of a CIN / CV extraction, keyed by content hash and extractor version"""
+    key = models.CharField(primary_key=True, max_length=128)
+    kind = models.CharField(max_length=10, choices=[
+        ('cin', 'CIN'),
+        ('cv', 'CV'),
+    ])
+    result = models.JSONField(default=dict)
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(db_index=True)
+    last_used_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return self.key
+
+class OcrJob(models.Model):
+    """CIN / CV extraction queued by the asynchronous scan endpoints and run by the ocr_worker command"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=10, choices=[
+        ('cin', 'CIN'),
+        ('cv', 'CV'),
+    ])
+    statut = models.CharField(max_length=20, choices=[
+        ('en_attente', 'En attente'),
+        ('en_cours', 'En cours'),
+        ('termine', 'Terminé'),
+        ('echoue', 'Échoué'),
+    ], default='en_attente', db_index=True)
+    progression = models.IntegerField(default=0)
+    nom_fichier = models.CharField(max_length=255, blank=True, default='')
+    fichier = models.BinaryField(null=True, blank=True)
+    resultat = models.JSONField(null=True, blank=True)
+    cached = models.BooleanField(default=False)
+    erreur = models.TextField(null=True, blank=True)
+    created_by = models.ForeignKey('auth_service.Utilisateur', on_delete=models.SET_NULL, null=True, blank=True, related_name="ocr_jobs")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"OCR {self.kind} {self.id} ({self.statut})"
+
+class DocumentTemplate(models.Model):
+    """Version of a DOCX template of a generated document, the active one of a type and nature is used to render"""
+    type_document = models.CharField(max_length=50, choices=[
+        ('demande_de_stage', 'Demande de stage'),
+    ], default='demande_de_stage')
+    # Stage nature using this template, empty for every nature without its own template
+    nature = models.CharField(max_length=50, blank=True, default='')
+    version = models.IntegerField()
+    nom_fichier = models.CharField(max_length=255, blank=True, default='')
+    fichier = models.BinaryField()
+    sha256 = models.CharField(max_length=64)
+    placeholders = models.JSONField(default=list)
+    actif = models.BooleanField(default=False, db_index=True)
+    created_by = models.ForeignKey('auth_service.Utilisateur', on_delete=models.SET_NULL, null=True, blank=True, related_name="document_templates")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('type_document', 'nature', 'version')
+
+    def __str__(self):
+        return f"{self.type_document} {self.nature or '*'} v{self.version}"
+
+class Upload(models.Model):
+    """Document sent in chunks through the upload API (see uploads), attached to a stage / stagiaire once finished"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    nom_fichier = models.CharField(max_length=255, blank=True, default='')
+    # Size announced when the upload starts, and bytes received so far (offset of the next chunk)
+    taille = models.BigIntegerField()
+    recu = models.BigIntegerField(default=0)
+    # SHA-256 announced by the client, checked when the upload is finished
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    # pdf, jpg or png, detected from the first chunk
+    type_fichier = models.CharField(max_length=10, blank=True, default='')
+    statut = models.CharField(max_length=20, choices=[
+        ('en_cours', 'En cours'),
+        ('termine', 'Terminé'),
+        ('echoue', 'Échoué'),
+    ], default='en_cours', db_index=True)
+    erreur = models.TextField(null=True, blank=True)
+    blob = models.ForeignKey(Blob, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_by = models.ForeignKey('auth_service.Utilisateur', on_delete=models.SET_NULL, null=True, blank=True, related_name="uploads")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.statut}, {self.recu}/{self.taille})"
+
 class Meta:
-    demande_de_stage = models.BinaryField(null=True, blank=True)
\ No newline at end of file
+    demande_de_stage = models.BinaryField(null=True, blank=True)
@@ -0,0 +1,165 @@
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import torch
+import easyocr
+
+# Process-wide EasyOCR readers, keyed by (languages, device).
+# Building an easyocr.Reader loads the detection and recognition weights from
+# disk, so each gunicorn worker only pays that cost once per key.
+_readers = {}
+_readers_lock = threading.Lock()
+
+# Languages of the readers when settings.OCR_LANGUAGES is not set
+DEFAULT_OCR_LANGUAGES = ['fr']
+
+# Seconds spent per OCR stage, only collected inside collect_stage_timings()
+_stage_timings = contextvars.ContextVar('ocr_stage_timings', default=None)
+
+
+def get_device():
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def _reader_key(languages, device):
+    if isinstance(languages, str):
+        languages = [languages]
+    return tuple(languages), device or get_device()
+
+
+def get_reader(languages=('fr',), device=None):
+    """
+    Return the shared EasyOCR reader for the given languages and device, creating it on first use
+
+    Args:
+        languages: Language code or list of language codes, e.g. ['fr']
+        device: 'cuda' or 'cpu' (defaults to the GPU when one is available)
+
+    Returns:
+        easyocr.Reader instance shared by the whole process
+    """
+    key = _reader_key(languages, device)
+    reader = _readers.get(key)
+    if reader is None:
+        with _readers_lock:
+            # Another thread may have loaded it while we were waiting for the lock
+            reader = _readers.get(key)
+            if reader is None:
+                languages, device = key
+                print(f"⏳ Loading EasyOCR reader {list(languages)} on {device}...")
+                reader = easyocr.Reader(list(languages), gpu=(device == 'cuda'))
+                _readers[key] = reader
+                print(f"✅ EasyOCR reader {list(languages)} ready on {device}")
+
+    # Also for a reader already loaded (warmed up), so the benchmarks time its stages
+    if _stage_timings.get() is not None:
+        return StageTimedReader(reader)
+    return reader
+
+
+def get_ocr_languages():
+    """Languages of the shared readers, settings.OCR_LANGUAGES"""
+    from django.conf import settings
+
+    return getattr(settings, 'OCR_LANGUAGES', DEFAULT_OCR_LANGUAGES)
+
+
+def warm_up_readers(language_sets=None, device=None):
+    """Load the readers for the given language sets ahead of the first request"""
+    if language_sets is None:
+        language_sets = [get_ocr_languages()]
+
+    for languages in language_sets:
+        try:
+            get_reader(languages, device)
+        except Exception as e:
+            print(f"⚠️ OCR warm-up failed for {languages}: {e}")
+
+
+def loaded_readers():
+    """List the (languages, device) keys currently loaded in this process"""
+    return list(_readers.keys())
+
+
+def record_ocr_attempt(timings, kind, target, dpi, seconds, found):
+    """
+    Log one OCR attempt of the adaptive DPI ladder
+
+    Args:
+        timings: List the attempt is appended to (ignored when None), used by the benchmarks
+        kind: 'cin' or 'cv'
+        target: What was read, e.g. 'page 1' or 'card'
+        dpi: Resolution of the attempt
+        seconds: Rendering + recognition time
+        found: Whether the parsers found what they were looking for
+    """
+    print(f"⏱️ {kind.upper()} {target} at {dpi} dpi: {seconds:.2f}s ({'found' if found else 'nothing found'})")
+    if timings is not None:
+        timings.append({
+            'kind': kind,
+            'target': target,
+            'dpi': dpi,
+            'seconds': seconds,
+            'found': found,
+        })
+
+
+@contextmanager
+def collect_stage_timings():
+    """
+    Measure the time spent in each OCR stage by the code run inside the block
+
+    Used by the benchmarks; outside of this block ocr_stage() costs nothing.
+
+    Yields:
+        Dict {stage name: seconds}, filled as the stages run
+    """
+    timings = defaultdict(float)
+    token = _stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _stage_timings.reset(token)
+
+
+@contextmanager
+def ocr_stage(name):
+    """Count the time of the block in the 'decode', 'rasterise', 'detect', 'recognise' or 'parse' stage"""
+    timings = _stage_timings.get()
+    if timings is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] += time.perf_counter() - started
+
+
+class StageTimedReader:
+    """
+    EasyOCR reader wrapper returned by get_reader() while stage timings are collected
+
+    readtext() is split in its detection and recognition calls, the same way
+    easyocr.Reader.readtext does, so both can be timed separately.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def readtext(self, image, detail=1, paragraph=False, allowlist=None, **kwargs):
+        from easyocr.utils import reformat_input
+
+        img, img_cv_grey = reformat_input(image)
+        with ocr_stage('detect'):
+            horizontal_list, free_list = self.reader.detect(img, reformat=False, **kwargs)
+        with ocr_stage('recognise'):
+            return self.reader.recognize(img_cv_grey, horizontal_list[0], free_list[0],
+                                         allowlist=allowlist, detail=detail, paragraph=paragraph,
+                                         reformat=False)
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
@@ -0,0 +1,145 @@
+import hashlib
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+
+# Results of extract_cin_data / extract_cv_data, keyed by the SHA-256 of the
+# uploaded file and the version of the extractor that produced them, so that
+# re-uploading the same CIN or CV does not run the OCR again.
+
+DEFAULT_OCR_CACHE = {
+    'BACKEND': 'db',          # 'db', 'cache' (Django cache) or 'none'
+    'CACHE_ALIAS': 'ocr',     # Django cache alias used by the 'cache' backend
+    'TTL': 7 * 24 * 3600,     # Seconds before an entry expires
+    'MAX_ENTRIES': 1000,      # Entries kept by the 'db' backend (least recently used are evicted)
+}
+
+
+def get_cache_config():
+    config = dict(DEFAULT_OCR_CACHE)
+    config.update(getattr(settings, 'OCR_CACHE', {}))
+    return config
+
+
+def make_cache_key(kind, version, data):
+    digest = hashlib.sha256(data).hexdigest()
+    return f"ocr:{kind}:{version}:{digest}"
+
+
+class DjangoCacheBackend:
+    """Store results in a Django cache; expiry and size limits come from the cache itself"""
+
+    def __init__(self, config):
+        self.cache = caches[config['CACHE_ALIAS']]
+        self.ttl = config['TTL']
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, kind, result):
+        self.cache.set(key, result, timeout=self.ttl)
+
+
+class DatabaseBackend:
+    """Store results in the OcrResult table, shared by every worker"""
+
+    def __init__(self, config):
+        self.ttl = config['TTL']
+        self.max_entries = config['MAX_ENTRIES']
+
+    def get(self, key):
+        from resume_service.models import OcrResult
+
+        entry = OcrResult.objects.filter(
+            key=key,
+            created_at__gte=timezone.now() - timedelta(seconds=self.ttl)
+        ).first()
+        if entry is None:
+            return None
+
+        OcrResult.objects.filter(key=key).update(hits=F('hits') + 1, last_used_at=timezone.now())
+        return entry.result
+
+    def set(self, key, kind, result):
+        from resume_service.models import OcrResult
+
+        OcrResult.objects.update_or_create(
+            key=key,
+            defaults={'kind': kind, 'result': result, 'created_at': timezone.now(), 'hits': 0}
+        )
+        self.evict()
+
+    def evict(self):
+        from resume_service.models import OcrResult
+
+        OcrResult.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=self.ttl)).delete()
+
+        stale_keys = OcrResult.objects.order_by('-last_used_at').values_list('key', flat=True)[self.max_entries:]
+        stale_keys = list(stale_keys)
+        if stale_keys:
+            OcrResult.objects.filter(key__in=stale_keys).delete()
+
+
+BACKENDS = {
+    'db': DatabaseBackend,
+    'cache': DjangoCacheBackend,
+}
+
+
+def get_backend():
+    config = get_cache_config()
+    backend_class = BACKENDS.get(config['BACKEND'])
+    return backend_class(config) if backend_class else None
+
+
+def _lookup(backend, key):
+    try:
+        return backend.get(key)
+    except Exception as e:
+        print(f"⚠️ OCR cache lookup failed: {e}")
+        return None
+
+
+def lookup_cached_result(kind, version, data):
+    """Return the cached result for these bytes, or None without running any extractor"""
+    backend = get_backend()
+    if backend is None:
+        return None
+    return _lookup(backend, make_cache_key(kind, version, data))
+
+
+def cached_extraction(kind, version, data, extractor):
+    """
+    Run an extractor on uploaded bytes, reusing a previous result for the same content
+
+    Args:
+        kind: 'cin' or 'cv'
+        version: Version string of the extractor, part of the cache key
+        data: Uploaded file content as bytes
+        extractor: Function called with the bytes on a cache miss
+
+    Returns:
+        Tuple (result, cached) where cached tells whether the result came from the cache
+    """
+    backend = get_backend()
+    if backend is None:
+        return extractor(data), False
+
+    key = make_cache_key(kind, version, data)
+
+    result = _lookup(backend, key)
+    if result is not None:
+        return result, True
+
+    result = extractor(data)
+
+    # Only keep results that found something, a failed scan is worth retrying
+    if result and any(result.values()):
+        try:
+            backend.set(key, kind, result)
+        except Exception as e:
+            print(f"⚠️ OCR cache store failed: {e}")
+
+    return result, False
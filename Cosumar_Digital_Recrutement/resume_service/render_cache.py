@@ -0,0 +1,238 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+# Rendered documents (filled DOCX and their PDF conversion), keyed by the
+# SHA-256 of the template version, the normalised replacements and the output
+# format. Rendering the same values again, e.g. a signature retried after a
+# failure or get_stage_document converting a document that was just
+# refreshed, is served from the cache without running the converter.
+# Conversions of DOCX bytes that were not rendered from a compiled template
+# are keyed by the SHA-256 of the DOCX.
+
+DEFAULT_RENDER_CACHE = {
+    'BACKEND': 'memory',            # 'memory' (per process), 'cache' (Django cache) or 'none'
+    'CACHE_ALIAS': 'documents',     # Django cache alias used by the 'cache' backend
+    'TTL': 24 * 3600,               # Seconds before an entry expires ('cache' backend)
+    'MAX_BYTES': 64 * 1024 * 1024,  # Size of the 'memory' backend (least recently used are evicted)
+    'MAX_ENTRY_BYTES': 8 * 1024 * 1024,  # Larger documents are not cached
+}
+
+
+def get_cache_config():
+    config = dict(DEFAULT_RENDER_CACHE)
+    config.update(getattr(settings, 'RENDER_CACHE', {}))
+    return config
+
+
+def normalise_replacements(replacements):
+    """Replacements as sorted (placeholder, text) pairs, None counting as an empty text"""
+    return sorted((str(key), '' if value is None else str(value)) for key, value in replacements.items())
+
+
+def make_render_key(template_version, replacements, output_format):
+    payload = json.dumps([template_version, normalise_replacements(replacements), output_format],
+                         ensure_ascii=False, separators=(',', ':'))
+    digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    return f"render:{output_format}:{digest}"
+
+
+def make_conversion_key(docx_bytes, output_format='pdf'):
+    digest = hashlib.sha256(docx_bytes).hexdigest()
+    return f"convert:{output_format}:{digest}"
+
+
+class MemoryBackend:
+    """Store documents in this process, bounded by their total size"""
+
+    def __init__(self, config):
+        self.max_bytes = config['MAX_BYTES']
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+            return data
+
+    def set(self, key, data):
+        """Store a document, returns the number of entries evicted to make room"""
+        evicted = 0
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[key] = data
+            self.size += len(data)
+
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, oldest = self.entries.popitem(last=False)
+                self.size -= len(oldest)
+                evicted += 1
+        return evicted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def usage(self):
+        return {'entries': len(self.entries), 'bytes': self.size, 'max_bytes': self.max_bytes}
+
+
+class DjangoCacheBackend:
+    """Store documents in a Django cache; expiry and size limits come from the cache itself"""
+
+    def __init__(self, config):
+        self.cache = caches[config['CACHE_ALIAS']]
+        self.ttl = config['TTL']
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, data):
+        self.cache.set(key, data, timeout=self.ttl)
+        return 0
+
+    def clear(self):
+        self.cache.clear()
+
+    def usage(self):
+        return {}
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'cache': DjangoCacheBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+# Counters of this process
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'skipped': 0, 'errors': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name, value=1):
+    with _stats_lock:
+        _stats[name] += value
+
+
+def get_backend():
+    """Cache backend of this process, None when the cache is disabled"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = get_cache_config()
+                backend_class = BACKENDS.get(config['BACKEND'])
+                _backend = backend_class(config) if backend_class else False
+    return _backend or None
+
+
+def cached_document(key, producer):
+    """
+    Return the document stored under a key, producing and storing it on a miss
+
+    Args:
+        key: Cache key, from make_render_key or make_conversion_key
+        producer: Function without arguments returning the document bytes,
+            its exceptions are raised to the caller and nothing is stored
+
+    Returns:
+        The document bytes
+    """
+    backend = get_backend()
+    if backend is None:
+        return producer()
+
+    try:
+        data = backend.get(key)
+    except Exception as e:
+        print(f"⚠️ Render cache lookup failed: {e}")
+        _count('errors')
+        data = None
+    if data is not None:
+        _count('hits')
+        return data
+
+    _count('misses')
+    data = producer()
+
+    # Empty results are failed renderings, worth retrying
+    if not data:
+        return data
+    if len(data) > get_cache_config()['MAX_ENTRY_BYTES']:
+        _count('skipped')
+        return data
+
+    try:
+        evicted = backend.set(key, bytes(data))
+        _count('stores')
+        _count('evictions', evicted)
+    except Exception as e:
+        print(f"⚠️ Render cache store failed: {e}")
+        _count('errors')
+    return data
+
+
+def render_docx(template, replacements):
+    """Fill a compiled template, reusing the DOCX of an identical rendering"""
+    key = make_render_key(template.version, replacements, 'docx')
+    return cached_document(key, lambda: template.render(replacements))
+
+
+def render_pdf(template, replacements):
+    """
+    Fill a compiled template and convert it to PDF, reusing the PDF of an identical rendering
+
+    Raises:
+        ConverterError when the PDF could not be produced
+    """
+    from .converters import convert_docx_to_pdf
+
+    key = make_render_key(template.version, replacements, 'pdf')
+    return cached_document(key, lambda: convert_docx_to_pdf(render_docx(template, replacements)))
+
+
+def convert_docx_cached(docx_bytes):
+    """
+    Convert DOCX bytes to PDF, reusing the PDF of the same DOCX content
+
+    Raises:
+        ConverterError when the PDF could not be produced
+    """
+    from .converters import convert_docx_to_pdf
+
+    return cached_document(make_conversion_key(docx_bytes), lambda: convert_docx_to_pdf(docx_bytes))
+
+
+def render_cache_stats():
+    """Counters of this process and the size of the cache"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+    stats['backend'] = get_cache_config()['BACKEND']
+
+    backend = get_backend()
+    if backend is not None:
+        stats.update(backend.usage())
+    return stats
+
+
+def clear_render_cache():
+    """Drop every cached document and reset the counters"""
+    backend = get_backend()
+    if backend is not None:
+        backend.clear()
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
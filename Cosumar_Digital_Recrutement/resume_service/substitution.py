@@ -0,0 +1,108 @@
+import re
+from functools import lru_cache
+from typing import Dict
+
+# Placeholder substitution shared by the DOCX fill functions.
+# Placeholders are found in one pass over the text, either with the generic
+# «NAME» pattern or with a compiled alternation of the replacement keys,
+# instead of one str.replace / re.sub pass per key. In XML, values are
+# escaped and the placeholders of BOLD_PLACEHOLDERS get their own bold run.
+
+PLACEHOLDER_PATTERN = re.compile(r'«[^«»<>]{1,100}»')
+
+# Placeholders rendered in their own bold run (they sit inside a <w:t> text node)
+BOLD_PLACEHOLDERS = frozenset({'«SIGNATURE_ENCADRANT»'})
+BOLD_RUN_START = '</w:t></w:r><w:r><w:rPr><w:b/></w:rPr><w:t>'
+BOLD_RUN_END = '</w:t></w:r><w:r><w:t>'
+
+
+def escape_xml(value):
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+@lru_cache(maxsize=64)
+def _keys_pattern(keys):
+    if not keys:
+        # Matches nothing
+        return re.compile(r'(?!)')
+    # Longest keys first, so that a key which is the prefix of another one does not win
+    return re.compile('|'.join(re.escape(key) for key in sorted(keys, key=len, reverse=True)))
+
+
+def placeholders_pattern(replacements=None):
+    """
+    Pattern matching the placeholders to substitute
+
+    Returns:
+        The generic «NAME» pattern when replacements is None, otherwise a
+        compiled alternation of its keys (cached per set of keys)
+    """
+    if replacements is None:
+        return PLACEHOLDER_PATTERN
+    return _keys_pattern(tuple(sorted(key for key in replacements if key)))
+
+
+def format_value(placeholder, value, xml=False, bold_placeholders=BOLD_PLACEHOLDERS):
+    """Text written in place of a placeholder"""
+    value = '' if value is None else str(value)
+    if not xml:
+        return value
+    value = escape_xml(value)
+    if placeholder in bold_placeholders:
+        return f"{BOLD_RUN_START}{value}{BOLD_RUN_END}"
+    return value
+
+
+def tokenize(text, pattern=PLACEHOLDER_PATTERN):
+    """
+    Cut a text around its placeholders
+
+    Returns:
+        Tuple (segments, slots): segments alternates literal text and
+        placeholders, slots lists (index in segments, placeholder)
+    """
+    segments = []
+    slots = []
+    last = 0
+    for match in pattern.finditer(text):
+        segments.append(text[last:match.start()])
+        slots.append((len(segments), match.group()))
+        segments.append(match.group())
+        last = match.end()
+    segments.append(text[last:])
+    return segments, slots
+
+
+def render_segments(segments, slots, replacements: Dict[str, str], xml=False, bold_placeholders=BOLD_PLACEHOLDERS):
+    """
+    Join tokenized segments, putting the values in place of the placeholders
+
+    Placeholders missing from replacements are left as they are.
+    """
+    if not slots:
+        return ''.join(segments)
+
+    segments = list(segments)
+    for index, placeholder in slots:
+        if placeholder in replacements:
+            segments[index] = format_value(placeholder, replacements[placeholder], xml, bold_placeholders)
+    return ''.join(segments)
+
+
+def substitute(text, replacements: Dict[str, str], xml=False, bold_placeholders=BOLD_PLACEHOLDERS):
+    """
+    Replace every key of replacements found in text, in a single pass
+
+    Args:
+        text: Plain text, or XML content when xml is True
+        replacements: Dictionary of {placeholder: replacement_value}
+        xml: Escape the values, and put bold_placeholders in their own bold run
+
+    Returns:
+        Tuple (new text, number of replacements made)
+    """
+    if not replacements:
+        return text, 0
+
+    segments, slots = tokenize(text, placeholders_pattern(replacements))
+    return render_segments(segments, slots, replacements, xml, bold_placeholders), len(slots)
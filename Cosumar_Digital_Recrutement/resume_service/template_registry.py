@@ -0,0 +1,223 @@
+import hashlib
+import os
+import threading
+import time
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from .docx_templates import CompiledDocxTemplate
+
+# Templates of the generated documents.
+# Versions of a template are stored in the DocumentTemplate table, the active
+# one of a document type is chosen per stage nature (a template without
+# nature is used for every other nature). Each process compiles a version
+# once and keeps it in memory: rendering never reads a file. The list of
+# active versions (ids only, not the DOCX) is read again from the database
+# every TEMPLATE_REGISTRY_CHECK_INTERVAL seconds, so a version uploaded on
+# one worker is picked up by the others without restarting them.
+# Until a template is uploaded, the DOCX shipped in resume_service/media is
+# used; it is read from disk once per process.
+
+DEMANDE_DE_STAGE = 'demande_de_stage'
+
+BUNDLED_TEMPLATES = {
+    DEMANDE_DE_STAGE: os.path.join(settings.BASE_DIR, 'resume_service', 'media', 'DEMANDE DE STAGE.docx'),
+}
+
+
+# Attempts to number a new version when uploads of the same type and nature race
+VERSION_ATTEMPTS = 3
+
+
+class TemplateNotFound(Exception):
+    """No template is available for this document type"""
+
+
+def serialize_template(template):
+    return {
+        "id": template.id,
+        "type_document": template.type_document,
+        "nature": template.nature or None,
+        "version": template.version,
+        "nom_fichier": template.nom_fichier,
+        "sha256": template.sha256,
+        "placeholders": template.placeholders,
+        "actif": template.actif,
+        "created_by": template.created_by_id,
+        "created_at": template.created_at.strftime('%Y-%m-%d %H:%M:%S') if template.created_at else None,
+    }
+
+
+class TemplateRegistry:
+    """
+    Compiled templates of this process
+
+    Args:
+        check_interval: Seconds between two reads of the active versions
+    """
+
+    def __init__(self, check_interval=10):
+        self.check_interval = check_interval
+        # {(type_document, nature): template id} of the active versions
+        self.active = {}
+        self.checked_at = None
+        # {template id or bundled path: CompiledDocxTemplate}
+        self.compiled = {}
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        """Read the active versions again on the next lookup"""
+        self.checked_at = None
+
+    def refresh(self, force=False):
+        from .models import DocumentTemplate
+
+        now = time.monotonic()
+        if not force and self.checked_at is not None and now - self.checked_at < self.check_interval:
+            return
+
+        active = {
+            (type_document, nature): template_id
+            for type_document, nature, template_id in DocumentTemplate.objects.filter(actif=True).values_list(
+                'type_document', 'nature', 'id'
+            )
+        }
+        with self.lock:
+            self.active = active
+            self.checked_at = now
+            # Versions no longer active are dropped, the bundled templates are kept
+            for key in [key for key in self.compiled if isinstance(key, int) and key not in active.values()]:
+                del self.compiled[key]
+
+    def resolve(self, type_document, nature=''):
+        """Id of the active version for this nature, None when the bundled template is used"""
+        self.refresh()
+        template_id = self.active.get((type_document, nature or ''))
+        if template_id is None:
+            template_id = self.active.get((type_document, ''))
+        return template_id
+
+    def get(self, type_document, nature=''):
+        """
+        Compiled template of a document type for a stage nature
+
+        Raises:
+            TemplateNotFound when no version is active and nothing is bundled
+        """
+        template_id = self.resolve(type_document, nature)
+        key = template_id if template_id is not None else BUNDLED_TEMPLATES.get(type_document)
+        if key is None:
+            raise TemplateNotFound(f"No template for {type_document}")
+
+        compiled = self.compiled.get(key)
+        if compiled is not None:
+            return compiled
+
+        with self.lock:
+            compiled = self.compiled.get(key)
+            if compiled is None:
+                compiled = self.compile(key)
+                self.compiled[key] = compiled
+        return compiled
+
+    def compile(self, key):
+        from .models import DocumentTemplate
+
+        if isinstance(key, int):
+            template = DocumentTemplate.objects.only('id', 'type_document', 'nature', 'version', 'fichier').get(id=key)
+            print(f"⏳ Compiling template {template}...")
+            return CompiledDocxTemplate(bytes(template.fichier), name=str(template))
+
+        if not os.path.exists(key):
+            raise TemplateNotFound(f"Template not found: {key}")
+        print(f"⏳ Compiling DOCX template {os.path.basename(key)}...")
+        return CompiledDocxTemplate.from_path(key)
+
+    def is_available(self, type_document, nature=''):
+        """Whether a template can be rendered for this nature"""
+        try:
+            self.get(type_document, nature)
+            return True
+        except TemplateNotFound:
+            return False
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_template_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = TemplateRegistry(getattr(settings, 'TEMPLATE_REGISTRY_CHECK_INTERVAL', 10))
+    return _registry
+
+
+def get_template(type_document, nature=''):
+    """Compiled active template of a document type for a stage nature"""
+    return get_template_registry().get(type_document, nature)
+
+
+def create_template_version(type_document, docx_bytes, nature='', nom_fichier='', user=None, activate=True):
+    """
+    Store a new version of a template
+
+    The DOCX is compiled first, an invalid file raises an exception and
+    nothing is stored. The version becomes the active one of its type and
+    nature unless activate is False.
+
+    Returns:
+        The DocumentTemplate created
+    """
+    from .models import DocumentTemplate
+
+    compiled = CompiledDocxTemplate(docx_bytes, name=nom_fichier)
+
+    for attempt in range(VERSION_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                versions = DocumentTemplate.objects.filter(type_document=type_document, nature=nature)
+                # Lock the existing versions (an aggregate query takes no lock) to serialize the uploads
+                # of the same type and nature
+                list(versions.select_for_update().values_list('id', flat=True))
+                latest = versions.aggregate(latest=Max('version'))['latest'] or 0
+                template = DocumentTemplate.objects.create(
+                    type_document=type_document,
+                    nature=nature,
+                    version=latest + 1,
+                    nom_fichier=nom_fichier,
+                    fichier=docx_bytes,
+                    sha256=hashlib.sha256(docx_bytes).hexdigest(),
+                    placeholders=sorted(compiled.placeholders),
+                    created_by=user,
+                )
+                if activate:
+                    activate_template(template)
+            break
+        except IntegrityError:
+            # The first version of a nature has no row to lock: another upload took this number
+            if attempt == VERSION_ATTEMPTS - 1:
+                raise
+
+    # Compiled already, the next render in this process does not compile it again
+    registry = get_template_registry()
+    with registry.lock:
+        registry.compiled[template.id] = compiled
+    return template
+
+
+def activate_template(template):
+    """Make a version the active one of its type and nature (also used to roll back)"""
+    from .models import DocumentTemplate
+
+    with transaction.atomic():
+        DocumentTemplate.objects.filter(
+            type_document=template.type_document, nature=template.nature, actif=True
+        ).exclude(id=template.id).update(actif=False)
+        if not template.actif:
+            template.actif = True
+            template.save(update_fields=['actif'])
+
+    transaction.on_commit(get_template_registry().invalidate)
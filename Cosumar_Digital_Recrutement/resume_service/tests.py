@@ -1,3 +1,1108 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import zipfile
+from unittest import mock
+from docx import Document
+import fitz
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from auth_service.models import Utilisateur
+from .blobstore import LocalBlobStore, get_blob_store, read_blob
+from .converters import ConversionTimeout, ConverterBusy, ConverterError, LibreOfficePool
+from .dedup import dedup_report, delete_unreferenced_blobs, recount_references
+from .documents import ANCHOR_TOKENS, render_demande_de_stage, sign_demande_de_stage
+from .docx_templates import CompiledDocxTemplate
+from .jobs import claim_next_job, run_job
+from .models import Blob, DocumentTemplate, OcrJob, Stage, Stagiaire, Sujet, Upload
+from .ocr import collect_stage_timings, get_reader, _reader_key
+from .ocr_cache import cached_extraction, lookup_cached_result
+from .PDF import extract_cv_data, extract_emails, extract_phones, render_pdf_page
+from .render_cache import render_cache_stats
+from .template_registry import DEMANDE_DE_STAGE, TemplateRegistry, get_template, get_template_registry
 
-# Create your tests here.
+
+def values_pdf(template, replacements):
+    """PDF converter of the tests: one line per signature field, with its value or anchor token"""
+    doc = fitz.open()
+    page = doc.new_page()
+    try:
+        for line, placeholder in enumerate(ANCHOR_TOKENS):
+            page.insert_text((72, 72 + 20 * line), f"{placeholder}: {replacements.get(placeholder) or ''}")
+        return doc.tobytes()
+    finally:
+        doc.close()
+
+
+def text_pdf(*page_texts):
+    """PDF with one page per text, a None text giving a page without text layer (scanned)"""
+    doc = fitz.open()
+    for text in page_texts:
+        page = doc.new_page()
+        if text:
+            page.insert_text((72, 72), text)
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes
+
+
+def template_docx(*paragraphs):
+    """DOCX with one paragraph per list of runs and «NOM» in its header"""
+    document = Document()
+    document.sections[0].header.paragraphs[0].text = "Dossier de «NOM»"
+    for runs in paragraphs:
+        paragraph = document.add_paragraph()
+        for text in runs:
+            paragraph.add_run(text)
+    output = io.BytesIO()
+    document.save(output)
+    return output.getvalue()
+
+
+class StageTestCase(TestCase):
+    """A stagiaire and a stage with documents and a rendered demande de stage, documents in a temporary store"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Utilisateur.objects.create(email='admin@cosumar.ma', nom='Admin', prenom='Test', role='admin')
+        cls.admin_rh = Utilisateur.objects.create(email='rh@cosumar.ma', nom='Rh', prenom='Test', role='admin_rh')
+        cls.responsable = Utilisateur.objects.create(email='rs@cosumar.ma', nom='Service', prenom='Test',
+                                                     role='responsable_de_service')
+        cls.encadrant = Utilisateur.objects.create(email='enc@cosumar.ma', nom='Encadrant', prenom='Test',
+                                                   role='utilisateur')
+        cls.sujet = Sujet.objects.create(titre='Sujet', description='Description', created_by=cls.encadrant)
+
+    def setUp(self):
+        self.blob_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.blob_dir, ignore_errors=True)
+        for patcher in (
+            mock.patch('resume_service.blobstore._store', LocalBlobStore({'LOCATION': self.blob_dir})),
+            # No converter in the tests
+            mock.patch('resume_service.documents.render_pdf', values_pdf),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # Documents both in the binary columns (rows not migrated) and in the blob store
+        self.stagiaire = Stagiaire.objects.create(
+            matricule='AB123456', nom='Alaoui', prenom='Ahmed', email='ahmed@example.ma',
+            num_tel='+212612345678', cin=b'\xff\xd8\xff' + b'0' * 1000,
+        )
+        self.stage = Stage.objects.create(
+            stagiaire=self.stagiaire, nature='pfe', sujet=self.sujet, statut='en_attente_des_signatures',
+            date_debut=datetime.date(2025, 7, 1), date_fin=datetime.date(2025, 8, 31),
+            convention=b'%PDF-convention', assurance=b'%PDF-assurance',
+        )
+        for name in ('cv', 'lettre_motivation'):
+            self.stage.set_document(name, f'%PDF-{name}'.encode())
+        render_demande_de_stage(self.stage)
+        self.stage.demande_de_stage_statut = 'pret'
+        self.stage.save()
+
+        self.client = APIClient()
+
+
+class DocumentColumnsQueryTests(StageTestCase):
+    """The stage endpoints never select a binary document column"""
+
+    def setUp(self):
+        super().setUp()
+        columns = [
+            rf'"{model._meta.db_table}"\."{name}"'
+            for model in (Stage, Stagiaire) for name in model.BLOB_DOCUMENTS
+        ]
+        self.document_columns = re.compile('|'.join(columns))
+
+    def call(self, user, method, url, data=None):
+        self.client.force_authenticate(user=user)
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+
+        selected = []
+        for query in queries.captured_queries:
+            sql = query['sql']
+            # Only the selected columns, a document may appear in a WHERE ... IS NULL
+            if sql.startswith('SELECT'):
+                selected += self.document_columns.findall(sql.split(' FROM ', 1)[0])
+        self.assertEqual(selected, [], f"{method.upper()} {url} selected document columns")
+        return response
+
+    def test_chercher_stages(self):
+        response = self.call(self.admin, 'get', reverse('chercher_stages'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_recuperer_stage(self):
+        response = self.call(self.admin, 'get', reverse('recuperer_stage', args=[self.stage.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_stage(self):
+        response = self.call(self.admin, 'put', reverse('update_stage', args=[self.stage.id]), {'statut': 'stage_en_cours'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_get_candidate_documents(self):
+        response = self.call(self.admin, 'get', reverse('get_candidate_documents', args=[self.stagiaire.matricule]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['documents']['has_cv'])
+        self.assertTrue(response.data['documents']['has_cin'])
+
+    def test_sign_views(self):
+        signatures = [
+            (self.encadrant, 'sign_demande_stage'),
+            (self.responsable, 'sign_demande_stage'),
+            (self.admin_rh, 'sign_demande_stage_rh'),
+            (self.admin, 'sign_demande_stage_chef_dept'),
+        ]
+        for user, view in signatures:
+            with self.subTest(role=user.role):
+                response = self.call(user, 'put', reverse(view, args=[self.stage.id]))
+                self.assertEqual(response.status_code, 200, response.data)
+
+        stage = Stage.objects.get(id=self.stage.id)
+        for role in ('encadrant', 'responsable_de_service', 'responsable_rh', 'chef_departement'):
+            self.assertTrue(stage.is_signed_by_role(role), role)
+
+
+class SignDemandeStageTests(StageTestCase):
+    """Signature views: all or nothing, no conversion while the stage is locked"""
+
+    def sign_rh(self):
+        self.client.force_authenticate(user=self.admin_rh)
+        return self.client.put(reverse('sign_demande_stage_rh', args=[self.stage.id]))
+
+    def test_failed_signature_rolled_back(self):
+        save = Stage.save
+
+        def save_then_fail(stage, *args, **kwargs):
+            save(stage, *args, **kwargs)
+            raise RuntimeError("panne")
+
+        with mock.patch.object(Stage, 'save', autospec=True, side_effect=save_then_fail):
+            response = self.sign_rh()
+
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(Stage.objects.get(id=self.stage.id).is_signed_by_role('responsable_rh'))
+
+    def test_document_without_anchors_rendered_after_commit(self):
+        self.stage.demande_de_stage_data['pdf_fields'] = None
+        self.stage.save()
+
+        with mock.patch('resume_service.documents.render_pdf') as render_pdf, \
+                self.captureOnCommitCallbacks() as callbacks:
+            response = self.sign_rh()
+
+        self.assertEqual(response.status_code, 200, response.data)
+        render_pdf.assert_not_called()
+        self.assertEqual(response.data['demande_de_stage_statut'], 'en_attente')
+        self.assertEqual(len(callbacks), 1)
+        self.assertTrue(Stage.objects.get(id=self.stage.id).is_signed_by_role('responsable_rh'))
+
+
+class RenderCacheTests(StageTestCase):
+    """Filled documents reused for the same values, rendered again once a signature changes them"""
+
+    def setUp(self):
+        super().setUp()
+        for patcher in (
+            # Empty cache and counters of this test
+            mock.patch('resume_service.render_cache._backend', None),
+            mock.patch.dict('resume_service.render_cache._stats', {'hits': 0, 'misses': 0}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def docx_text(self):
+        # Tables included, the signatures are in one
+        document = Document(io.BytesIO(self.stage.get_document('demande_de_stage')))
+        return ''.join(document.element.body.itertext())
+
+    def test_same_values_served_from_cache(self):
+        render_demande_de_stage(self.stage)
+        first = self.stage.get_document('demande_de_stage')
+        render_demande_de_stage(self.stage)
+
+        self.assertEqual(self.stage.get_document('demande_de_stage'), first)
+        stats = render_cache_stats()
+        self.assertEqual((stats['misses'], stats['hits']), (1, 1))
+
+    def test_signature_not_served_from_cache(self):
+        render_demande_de_stage(self.stage)
+        self.assertNotIn('Test Rh', self.docx_text())
+
+        self.assertEqual(sign_demande_de_stage(self.stage, 'responsable_rh', self.admin_rh, '01/07/2025'), 'stamped')
+
+        self.assertIn('Test Rh', self.docx_text())
+        stats = render_cache_stats()
+        self.assertEqual((stats['misses'], stats['hits']), (2, 0))
+
+
+class InlinePool:
+    """Process pool running the tasks in the test process, which sees the test transaction"""
+
+    def __init__(self, processes, initializer=None):
+        pass
+
+    def imap_unordered(self, fn, items):
+        return map(fn, items)
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class RegenerateStageDocumentsTests(StageTestCase):
+    """regenerate_stage_documents renders the selected stages and resumes from its checkpoint"""
+
+    def setUp(self):
+        super().setUp()
+        self.checkpoint = os.path.join(self.blob_dir, 'checkpoint.json')
+        for patcher in (
+            mock.patch('multiprocessing.Pool', InlinePool),
+            mock.patch('resume_service.management.commands.regenerate_stage_documents.connections'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def regenerate(self, *args):
+        out = io.StringIO()
+        call_command('regenerate_stage_documents', *args, '--checkpoint', self.checkpoint, stdout=out)
+        return out.getvalue()
+
+    def read_checkpoint(self):
+        with open(self.checkpoint, encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_checkpoint_resumed(self):
+        self.stage.set_document('demande_de_stage_pdf', None)
+        self.stage.save()
+
+        self.assertIn("1 stage(s) regenerated, 0 failed", self.regenerate('--ids', str(self.stage.id)))
+        self.stage.refresh_from_db()
+        self.assertTrue(self.stage.has_document('demande_de_stage_pdf'))
+        self.assertEqual(self.read_checkpoint()['done'], [self.stage.id])
+
+        with mock.patch('resume_service.documents.render_demande_de_stage') as render:
+            output = self.regenerate('--ids', str(self.stage.id))
+        self.assertIn("1 stage(s) selected, 1 already done, 0 to regenerate", output)
+        render.assert_not_called()
+
+    def test_failed_stage_retried(self):
+        with mock.patch('resume_service.documents.render_pdf', side_effect=ConverterError("LibreOffice indisponible")):
+            with self.assertRaises(CommandError):
+                self.regenerate()
+        self.assertEqual(self.read_checkpoint()['failed'], {str(self.stage.id): "LibreOffice indisponible"})
+        self.assertEqual(Stage.objects.get(id=self.stage.id).demande_de_stage_statut, 'echoue')
+
+        self.assertIn("1 stage(s) regenerated, 0 failed", self.regenerate())
+        self.assertEqual(self.read_checkpoint(), {'selection': {}, 'done': [self.stage.id], 'failed': {}})
+
+    def test_checkpoint_of_other_filters_refused(self):
+        self.regenerate('--nature', 'pfe')
+
+        with self.assertRaises(CommandError):
+            self.regenerate('--nature', 'pfa')
+        self.assertIn("1 already done", self.regenerate('--nature', 'pfe', '--dry-run'))
+        self.assertIn("0 already done", self.regenerate('--nature', 'pfa', '--restart', '--dry-run'))
+
+
+class ExportDossiersTests(StageTestCase):
+    """ZIP export of the dossiers, with a manifest of what each one contains"""
+
+    def setUp(self):
+        super().setUp()
+        self.stage.set_document('convention', text_pdf("Convention de stage"))
+        self.stage.set_document('cv', text_pdf("Curriculum vitae"))
+        self.stage.set_document('assurance', None)
+        self.stage.save()
+        self.name = f"stage_{self.stage.id}_Alaoui_Ahmed"
+        self.client.force_authenticate(user=self.admin_rh)
+
+    def export(self, **params):
+        response = self.client.get(reverse('export_dossiers_stages'), {'ids': self.stage.id, **params})
+        self.assertEqual(response.status_code, 200)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.addCleanup(archive.close)
+        return archive
+
+    def test_merged_dossier(self):
+        archive = self.export()
+
+        self.assertEqual(archive.namelist(), [f"{self.name}.pdf", 'manifest.json'])
+        entry, = json.loads(archive.read('manifest.json'))
+        self.assertEqual(entry['stage_id'], self.stage.id)
+        self.assertEqual(entry['stagiaire'], "Ahmed Alaoui")
+        self.assertEqual(entry['documents'], ['demande_de_stage', 'convention', 'cv'])
+        self.assertEqual(entry['manquants'], ['assurance'])
+        # Stored as '%PDF-lettre_motivation', not a readable PDF
+        self.assertEqual(list(entry['erreurs']), ['lettre_motivation'])
+
+        with fitz.open(stream=archive.read(f"{self.name}.pdf"), filetype='pdf') as merged:
+            self.assertEqual(merged.page_count, 3)
+            self.assertIn("Curriculum vitae", merged[2].get_text())
+
+    def test_documents_as_uploaded(self):
+        archive = self.export(contenu='documents')
+
+        self.assertEqual(archive.namelist(), [
+            f"{self.name}/demande_de_stage.pdf", f"{self.name}/convention.pdf", f"{self.name}/cv.pdf",
+            f"{self.name}/lettre_motivation.pdf", 'manifest.json',
+        ])
+        self.assertEqual(archive.read(f"{self.name}/lettre_motivation.pdf"), b'%PDF-lettre_motivation')
+        entry, = json.loads(archive.read('manifest.json'))
+        self.assertEqual(entry['manquants'], ['assurance'])
+        self.assertEqual(entry['erreurs'], {})
+
+    @override_settings(EXPORT_MAX_STAGES=0)
+    def test_selection_too_large(self):
+        response = self.client.get(reverse('export_dossiers_stages'), {'ids': self.stage.id})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['max_stages'], 0)
+
+
+class DocumentDownloadTests(StageTestCase):
+    """ETag, 304 and byte ranges of the document downloads, from the blob store or a binary column"""
+
+    CONTENT = b'%PDF-1.4 ' + bytes(range(256)) * 4
+
+    def setUp(self):
+        super().setUp()
+        self.stage.set_document('cv', self.CONTENT)
+        # Not moved to the blob store
+        self.stage.convention = self.CONTENT
+        self.stage.save()
+        self.etag = f'"{hashlib.sha256(self.CONTENT).hexdigest()}"'
+        self.client.force_authenticate(user=self.admin)
+
+    def download(self, document_type, **headers):
+        response = self.client.get(reverse('get_stage_document', args=[self.stage.id, document_type]), **headers)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, content
+
+    def test_whole_document(self):
+        for document_type in ('cv', 'convention'):
+            with self.subTest(document_type=document_type):
+                response, content = self.download(document_type)
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(content, self.CONTENT)
+                self.assertEqual(response['ETag'], self.etag)
+                self.assertEqual(response['Content-Length'], str(len(self.CONTENT)))
+                self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_not_modified(self):
+        for document_type in ('cv', 'convention'):
+            with self.subTest(document_type=document_type):
+                with mock.patch('resume_service.downloads.iter_blob') as iter_blob:
+                    response, content = self.download(document_type, HTTP_IF_NONE_MATCH=self.etag)
+
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(content, b'')
+                iter_blob.assert_not_called()
+
+        response, content = self.download('cv', HTTP_IF_NONE_MATCH='"version-precedente"')
+        self.assertEqual((response.status_code, content), (200, self.CONTENT))
+
+    def test_byte_range(self):
+        size = len(self.CONTENT)
+        for document_type in ('cv', 'convention'):
+            for header, start, end in (('bytes=10-19', 10, 19), ('bytes=-5', size - 5, size - 1),
+                                       (f'bytes=1000-{size * 2}', 1000, size - 1)):
+                with self.subTest(document_type=document_type, header=header):
+                    response, content = self.download(document_type, HTTP_RANGE=header)
+
+                    self.assertEqual(response.status_code, 206)
+                    self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{size}')
+                    self.assertEqual(content, self.CONTENT[start:end + 1])
+                    self.assertEqual(response['Content-Length'], str(end - start + 1))
+
+    def test_range_not_satisfiable(self):
+        size = len(self.CONTENT)
+        response, _ = self.download('cv', HTTP_RANGE=f'bytes={size}-')
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+
+    def test_range_of_another_version(self):
+        response, content = self.download('cv', HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"version-precedente"')
+        self.assertEqual((response.status_code, content), (200, self.CONTENT))
+
+        response, content = self.download('cv', HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE=self.etag)
+        self.assertEqual((response.status_code, content), (206, self.CONTENT[10:20]))
+
+
+class DocumentDedupTests(StageTestCase):
+    """Identical documents share one blob, counted by its references"""
+
+    def setUp(self):
+        super().setUp()
+        self.cv_key = self.stage.cv_blob_id
+        # The same CV brought again to a second stage
+        self.second = Stage.objects.create(stagiaire=self.stagiaire, nature='pfa', statut='termine',
+                                           date_debut=datetime.date(2024, 7, 1), date_fin=datetime.date(2024, 8, 31))
+        self.second.set_document('cv', b'%PDF-cv')
+        self.second.save()
+
+    def references(self, key):
+        return Blob.objects.get(sha256=key).references
+
+    def test_same_document_stored_once(self):
+        self.assertEqual(self.second.cv_blob_id, self.cv_key)
+        self.assertEqual(self.references(self.cv_key), 2)
+
+        report = dedup_report()
+        self.assertEqual(report['shared_blobs'], 1)
+        self.assertEqual(report['by_document']['stage.cv'], {
+            'documents': 2, 'blobs': 1, 'bytes': 2 * len(b'%PDF-cv'), 'legacy_documents': 0, 'legacy_bytes': 0,
+        })
+
+    def test_references_follow_changes(self):
+        self.second.set_document('cv', b'%PDF-nouveau-cv')
+        self.second.save()
+        new_key = self.second.cv_blob_id
+        self.assertEqual((self.references(self.cv_key), self.references(new_key)), (1, 1))
+
+        self.second.delete()
+        self.assertEqual(self.references(new_key), 0)
+
+        self.assertEqual(delete_unreferenced_blobs(grace=0), (1, len(b'%PDF-nouveau-cv')))
+        self.assertFalse(Blob.objects.filter(sha256=new_key).exists())
+        self.assertFalse(get_blob_store().exists(new_key))
+        self.assertEqual(read_blob(self.cv_key), b'%PDF-cv')
+
+    def test_wrong_counts_recounted(self):
+        Blob.objects.update(references=0)
+
+        # Still referenced by the stages, kept whatever the counts say
+        self.assertEqual(delete_unreferenced_blobs(grace=0), (0, 0))
+        self.assertEqual(recount_references(), Blob.objects.count())
+        self.assertEqual(self.references(self.cv_key), 2)
+        self.assertEqual(recount_references(), 0)
+
+    def test_legacy_copies_moved_to_one_blob(self):
+        Stage.objects.filter(id=self.second.id).update(convention=b'%PDF-convention')
+
+        call_command('dedupe_documents', '--gc', stdout=io.StringIO())
+
+        first, second = (Stage.objects.get(id=stage.id) for stage in (self.stage, self.second))
+        self.assertEqual(first.convention_blob_id, second.convention_blob_id)
+        self.assertIsNone(first.convention)
+        self.assertEqual(second.get_document('convention'), b'%PDF-convention')
+        self.assertEqual(self.references(first.convention_blob_id), 2)
+
+
+class ImmediateExecutor:
+    """Render thread pool running the submitted functions right away"""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+class DemandeRenderTests(StageTestCase):
+    """creer_stage renders the demande de stage in the background, once the stage is committed"""
+
+    def setUp(self):
+        super().setUp()
+        for patcher in (
+            mock.patch('resume_service.documents.get_render_executor', return_value=ImmediateExecutor()),
+            # The render thread closes its connection, not the one of the test
+            mock.patch('resume_service.documents.connection'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        Stagiaire.objects.create(matricule='CD654321', nom='Bennani', prenom='Salma', email='salma@example.ma')
+        self.client.force_authenticate(user=self.admin_rh)
+
+    def creer_stage(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('creer_stage'), {
+                'matricule': 'CD654321', 'nature': 'pfe', 'date_debut': '2025-07-01', 'date_fin': '2025-08-31',
+                'cv_file': SimpleUploadedFile('cv.pdf', b'%PDF-1.4 cv'),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return response, callbacks
+
+    def test_rendered_after_commit(self):
+        response, callbacks = self.creer_stage()
+
+        stage = Stage.objects.get(id=response.data['stage_id'])
+        self.assertEqual(response.data['demande_de_stage_statut'], 'en_attente')
+        self.assertEqual(stage.demande_de_stage_statut, 'en_attente')
+        self.assertFalse(stage.has_document('demande_de_stage_pdf'))
+        self.assertEqual(len(callbacks), 1)
+
+        callbacks[0]()
+        stage.refresh_from_db()
+        self.assertEqual(stage.demande_de_stage_statut, 'pret')
+        self.assertTrue(stage.has_document('demande_de_stage_pdf'))
+        self.assertTrue(stage.demande_de_stage_data['pdf_fields']['anchors'])
+
+    def test_failed_rendering_recorded(self):
+        with mock.patch('resume_service.documents.render_pdf', side_effect=ConverterError("LibreOffice indisponible")):
+            response, callbacks = self.creer_stage()
+            callbacks[0]()
+
+        stage = Stage.objects.get(id=response.data['stage_id'])
+        self.assertEqual(stage.demande_de_stage_statut, 'echoue')
+        self.assertEqual(stage.demande_de_stage_erreur, "LibreOffice indisponible")
+
+
+class TemplateActivationTests(TestCase):
+    """Template versions uploaded and activated through the API, picked up without a restart"""
+
+    def setUp(self):
+        # Registry of this test only
+        patcher = mock.patch('resume_service.template_registry._registry', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        admin = Utilisateur.objects.create(email='admin@cosumar.ma', nom='Admin', prenom='Test', role='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(user=admin)
+
+    def upload(self, text, nature='pfe'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('document_templates'), {
+                'fichier': SimpleUploadedFile('modele.docx', template_docx([text])), 'nature': nature,
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def rendered_text(self, nature='pfe', registry=None):
+        template = (registry or get_template_registry()).get(DEMANDE_DE_STAGE, nature)
+        return Document(io.BytesIO(template.render({'«NOM»': 'Alaoui'}))).paragraphs[-1].text
+
+    def test_uploaded_version_used(self):
+        bundled = get_template(DEMANDE_DE_STAGE, 'pfe')
+        uploaded = self.upload("Version 1 de «NOM»")
+
+        self.assertEqual((uploaded['version'], uploaded['actif']), (1, True))
+        self.assertEqual(uploaded['placeholders'], ['«NOM»'])
+        self.assertEqual(uploaded['placeholders_manquants'], sorted(ANCHOR_TOKENS))
+        self.assertEqual(self.rendered_text(), "Version 1 de Alaoui")
+        # Other natures keep the bundled template
+        self.assertIs(get_template(DEMANDE_DE_STAGE, 'pfa'), bundled)
+
+    def test_previous_version_activated_again(self):
+        first = self.upload("Version 1 de «NOM»")
+        second = self.upload("Version 2 de «NOM»")
+        self.assertEqual(second['version'], 2)
+        self.assertFalse(DocumentTemplate.objects.get(id=first['id']).actif)
+        self.assertEqual(self.rendered_text(), "Version 2 de Alaoui")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('activer_document_template', args=[first['id']]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.rendered_text(), "Version 1 de Alaoui")
+        self.assertFalse(DocumentTemplate.objects.get(id=second['id']).actif)
+
+    def test_other_worker_picks_up_activation(self):
+        worker = TemplateRegistry(check_interval=60)
+        self.upload("Version 1 de «NOM»")
+        self.assertEqual(self.rendered_text(registry=worker), "Version 1 de Alaoui")
+
+        self.upload("Version 2 de «NOM»")
+        self.assertEqual(self.rendered_text(registry=worker), "Version 1 de Alaoui")
+        # Its next check of the active versions
+        worker.checked_at -= 60
+        self.assertEqual(self.rendered_text(registry=worker), "Version 2 de Alaoui")
+
+    def test_invalid_docx_refused(self):
+        response = self.client.post(reverse('document_templates'), {
+            'fichier': SimpleUploadedFile('modele.docx', b'pas un docx'),
+        }, format='multipart')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(DocumentTemplate.objects.exists())
+
+
+class ChunkedUploadTests(TestCase):
+    """Documents sent by chunks, checked against their SHA-256 when the upload is finished"""
+
+    CONTENT = b'%PDF-1.4 ' + bytes(range(256)) * 10
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        patcher = mock.patch('resume_service.blobstore._store',
+                             LocalBlobStore({'LOCATION': os.path.join(self.temp_dir, 'blobs')}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        overridden = override_settings(CHUNKED_UPLOADS={
+            'TEMP_DIR': os.path.join(self.temp_dir, 'uploads'), 'MAX_CHUNK_SIZE': 1024,
+        })
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+        user = Utilisateur.objects.create(email='rh@cosumar.ma', nom='Rh', prenom='Test', role='admin_rh')
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+
+    def start(self, **data):
+        response = self.client.post(reverse('creer_upload'),
+                                    {'taille': len(self.CONTENT), 'nom_fichier': 'cv.pdf', **data}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['upload_id']
+
+    def put(self, upload_id, offset, chunk):
+        return self.client.generic('PUT', reverse('upload_chunk', args=[upload_id]), chunk,
+                                   content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def send(self, upload_id):
+        for offset in range(0, len(self.CONTENT), 1000):
+            response = self.put(upload_id, offset, self.CONTENT[offset:offset + 1000])
+            self.assertEqual(response.status_code, 200)
+        return response
+
+    def finish(self, upload_id, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('finaliser_upload', args=[upload_id]), data, format='json')
+
+    def test_upload_finished(self):
+        sha256 = hashlib.sha256(self.CONTENT).hexdigest()
+        upload_id = self.start(sha256=sha256)
+
+        self.assertEqual(self.send(upload_id).data['offset'], len(self.CONTENT))
+        response = self.finish(upload_id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['status'], response.data['sha256']), ('termine', sha256))
+        self.assertEqual(read_blob(sha256), self.CONTENT)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'uploads', f'{upload_id}.part')))
+        # The response was lost, the client finishes it again
+        self.assertEqual(self.finish(upload_id).status_code, 200)
+
+    def test_chunk_at_wrong_offset(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, self.CONTENT[:1000])
+
+        response = self.put(upload_id, 500, self.CONTENT[500:1500])
+        self.assertEqual((response.status_code, response.data['offset']), (409, 1000))
+        self.assertEqual(self.client.get(reverse('upload_chunk', args=[upload_id])).data['offset'], 1000)
+        self.assertEqual(self.put(upload_id, 1000, b'x' * 2048).status_code, 413)
+
+    def test_incomplete_upload_not_finished(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, self.CONTENT[:1000])
+
+        response = self.finish(upload_id, sha256=hashlib.sha256(self.CONTENT).hexdigest())
+        self.assertEqual((response.status_code, response.data['offset']), (409, 1000))
+        self.assertEqual(Upload.objects.get(id=upload_id).statut, 'en_cours')
+
+    def test_hash_mismatch(self):
+        upload_id = self.start()
+        self.send(upload_id)
+
+        response = self.finish(upload_id, sha256='0' * 64)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['status'], 'echoue')
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'uploads', f'{upload_id}.part')))
+        self.assertEqual(self.finish(upload_id, sha256=hashlib.sha256(self.CONTENT).hexdigest()).status_code, 409)
+
+
+class OcrBatchTests(TestCase):
+    """ocr_batch queues the files and answers without waiting for the OCR"""
+
+    def test_lines_sent_as_jobs_are_queued(self):
+        user = Utilisateur.objects.create(email='rh@cosumar.ma', nom='Rh', prenom='Test', role='admin_rh')
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        response = client.post(reverse('ocr_batch'), {'files': [
+            SimpleUploadedFile('cin.jpg', b'\xff\xd8\xff' + b'0' * 100),
+            SimpleUploadedFile('cv.pdf', b'%PDF-1.4 cv'),
+            SimpleUploadedFile('notes.txt', b'texte'),
+        ]}, format='multipart')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+        self.assertEqual(response.status_code, 200)
+        by_name = {line['filename']: line for line in lines[:-1]}
+        self.assertEqual(by_name['cin.jpg']['status'], 'en_attente')
+        self.assertEqual(by_name['cv.pdf']['status'], 'en_attente')
+        self.assertEqual(by_name['notes.txt']['status'], 'echoue')
+        self.assertEqual(OcrJob.objects.get(id=by_name['cin.jpg']['job_id']).kind, 'cin')
+        self.assertEqual(lines[-1]['summary'], {'termine': 0, 'echoue': 1, 'en_attente': 2, 'total': 3})
+
+
+class OcrJobTests(TestCase):
+    """CV extraction queued as an OcrJob and followed with ocr_job_status"""
+
+    RESULT = {'email': 'ahmed.alaoui@exemple.ma', 'phone': '+212612345678'}
+
+    def setUp(self):
+        self.user = Utilisateur.objects.create(email='rh@cosumar.ma', nom='Rh', prenom='Test', role='admin_rh')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        self.extractor = mock.Mock(return_value=self.RESULT)
+        patcher = mock.patch('resume_service.jobs.get_extractor', return_value=(self.extractor, 'cv-test'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def submit(self, content=b'%PDF-1.4 cv'):
+        response = self.client.post(reverse('process_cv_async'),
+                                    {'cv': SimpleUploadedFile('cv.pdf', content)}, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        return response.data
+
+    def job_status(self, job_id):
+        return self.client.get(reverse('ocr_job_status', args=[job_id]))
+
+    def test_job_queued_then_run_by_worker(self):
+        submitted = self.submit()
+        self.assertEqual(submitted['status'], 'en_attente')
+        self.assertEqual(self.job_status(submitted['job_id']).data['status'], 'en_attente')
+        self.extractor.assert_not_called()
+
+        job = claim_next_job()
+        self.assertEqual(str(job.id), submitted['job_id'])
+        self.assertEqual(job.statut, 'en_cours')
+        self.assertIsNone(claim_next_job())
+        run_job(job)
+
+        response = self.job_status(submitted['job_id'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'termine')
+        self.assertEqual(response.data['data'], self.RESULT)
+        self.assertIsNone(OcrJob.objects.get(id=job.id).fichier)
+        self.extractor.assert_called_once_with(b'%PDF-1.4 cv')
+
+    def test_file_already_read_finished_at_once(self):
+        run_job(OcrJob.objects.get(id=self.submit()['job_id']))
+
+        submitted = self.submit()
+        self.assertEqual(submitted['status'], 'termine')
+        self.assertTrue(submitted['cached'])
+        self.assertEqual(submitted['data'], self.RESULT)
+        self.assertIsNone(claim_next_job())
+
+    def test_failed_extraction(self):
+        self.extractor.side_effect = ValueError("PDF illisible")
+        submitted = self.submit()
+        run_job(claim_next_job())
+
+        response = self.job_status(submitted['job_id'])
+        self.assertEqual(response.data['status'], 'echoue')
+        self.assertEqual(response.data['error'], "PDF illisible")
+        self.assertIsNone(lookup_cached_result('cv', 'cv-test', b'%PDF-1.4 cv'))
+
+    def test_job_of_another_user(self):
+        submitted = self.submit()
+        other = Utilisateur.objects.create(email='autre@cosumar.ma', nom='Autre', prenom='Test', role='admin_rh')
+        self.client.force_authenticate(user=other)
+
+        self.assertEqual(self.job_status(submitted['job_id']).status_code, 403)
+
+
+class OcrCacheTests(TestCase):
+    """Extraction results reused for the same uploaded bytes"""
+
+    RESULT = {'email': 'ahmed.alaoui@exemple.ma', 'phone': '+212612345678'}
+
+    def test_hit_after_miss(self):
+        extractor = mock.Mock(return_value=self.RESULT)
+
+        self.assertEqual(cached_extraction('cv', 'cv-test', b'cv', extractor), (self.RESULT, False))
+        self.assertEqual(cached_extraction('cv', 'cv-test', b'cv', extractor), (self.RESULT, True))
+        extractor.assert_called_once_with(b'cv')
+        self.assertEqual(lookup_cached_result('cv', 'cv-test', b'cv'), self.RESULT)
+
+    def test_miss_for_other_bytes_or_version(self):
+        cached_extraction('cv', 'cv-test', b'cv', mock.Mock(return_value=self.RESULT))
+
+        self.assertIsNone(lookup_cached_result('cv', 'cv-test', b'autre cv'))
+        self.assertIsNone(lookup_cached_result('cv', 'cv-next', b'cv'))
+        self.assertIsNone(lookup_cached_result('cin', 'cv-test', b'cv'))
+
+    def test_empty_result_not_cached(self):
+        extractor = mock.Mock(return_value={'email': None, 'phone': None})
+
+        cached_extraction('cv', 'cv-test', b'cv', extractor)
+        self.assertEqual(cached_extraction('cv', 'cv-test', b'cv', extractor), (extractor.return_value, False))
+        self.assertEqual(extractor.call_count, 2)
+
+
+class ContactExtractionTests(SimpleTestCase):
+    """The single-pass contact scanner against the outputs of the former regex extraction"""
+
+    # (text, emails, phones in E.164) found by the former extract_emails / extract_phones
+    COMPAT_CASES = [
+        ("Email : ahmed.alaoui@gmail.com Tél : 06 12 34 56 78", ['ahmed.alaoui@gmail.com'], ['+212612345678']),
+        ("Contact: f.bennani@outlook.fr / +212 6 54 32 10 98", ['f.bennani@outlook.fr'], ['+212654321098']),
+        ("GSM 0612345678 - Fixe 0712345678", [], ['+212612345678', '+212712345678']),
+        ("Tel: +212612345678, mail: salma_tazi@yahoo.fr", ['salma_tazi@yahoo.fr'], ['+212612345678']),
+        ("06-61-22-33-44 o.chraibi@um5.ac.ma", ['o.chraibi@um5.ac.ma'], ['+212661223344']),
+        ("+212 6 61 223 344", [], ['+212661223344']),
+        ("+212-7-01-02-03-04", [], ['+212701020304']),
+        ("deux emails a@b.ma et c.d@e-f.org.ma", ['a@b.ma', 'c.d@e-f.org.ma'], []),
+        ("adresses avec chiffres: ahmed.2001+cv@gmail.com, a0612@sms.ma",
+         ['ahmed.2001+cv@gmail.com', 'a0612@sms.ma'], []),
+        ("Né le 12.03.2001, bac 2019, aucun numéro", [], []),
+        ("", [], []),
+    ]
+
+    # Formats the former extraction missed or mangled
+    NEW_FORMAT_CASES = [
+        ("Tél. : 05 22 33 44 55", ['+212522334455']),
+        ("00212 6 12 34 56 78", ['+212612345678']),
+        ("+212 (0) 6 12 34 56 78", ['+212612345678']),
+        ("06.12.34.56.78", ['+212612345678']),
+        ("Réf 123456789012 0612345678", ['+212612345678']),
+        ("0612345678@sms.ma", []),
+        # Dates followed by digits
+        ("Né le 05.11.1999 12 34 à Rabat", []),
+        ("Du 06/07/2024 12:30 au 07-08-2024 1530", []),
+        ("Né le 06/07/2001 Tél 0612345678", ['+212612345678']),
+    ]
+
+    def test_same_contacts_as_former_extraction(self):
+        for text, emails, phones in self.COMPAT_CASES:
+            with self.subTest(text=text):
+                self.assertEqual(extract_emails(text), emails)
+                self.assertEqual(sorted(extract_phones(text)), phones)
+
+    def test_new_phone_formats(self):
+        for text, phones in self.NEW_FORMAT_CASES:
+            with self.subTest(text=text):
+                self.assertEqual(extract_phones(text), phones)
+
+    def test_cv_contact_split_across_pages(self):
+        pdf_bytes = text_pdf("Curriculum vitae de Ahmed Alaoui, ingénieur. Tél : 06 12 34",
+                             "56 78, disponible pour un stage PFE de six mois.")
+
+        self.assertEqual(extract_cv_data(pdf_bytes), {'email': None, 'phone': '+212612345678'})
+
+
+class CompiledDocxTemplateTests(SimpleTestCase):
+    """DOCX templates filled from their compiled segments"""
+
+    def render(self, replacements):
+        template = CompiledDocxTemplate(template_docx(
+            ["Stagiaire : «NOM»"],
+            # Placeholder split by Word across runs of different formatting
+            ["École : «ETA", "BLISSEMENT", "» (", "«VILLE»", ")"],
+            ["Encadrant : «SIGNATURE_ENCADRANT»"],
+        ))
+        document = Document(io.BytesIO(template.render(replacements)))
+        return template, document
+
+    def test_placeholders_filled(self):
+        template, document = self.render({
+            '«NOM»': 'Ahmed Alaoui',
+            '«ETABLISSEMENT»': 'ENSA <Fès> & Meknès',
+            '«VILLE»': 'Fès',
+            '«SIGNATURE_ENCADRANT»': 'Signé',
+        })
+
+        self.assertEqual(template.placeholders,
+                         {'«NOM»', '«ETABLISSEMENT»', '«VILLE»', '«SIGNATURE_ENCADRANT»'})
+        self.assertEqual([p.text for p in document.paragraphs], [
+            "Stagiaire : Ahmed Alaoui",
+            "École : ENSA <Fès> & Meknès (Fès)",
+            "Encadrant : Signé",
+        ])
+        self.assertEqual(document.sections[0].header.paragraphs[0].text, "Dossier de Ahmed Alaoui")
+        self.assertTrue([run for run in document.paragraphs[2].runs if run.text == 'Signé'][0].bold)
+
+    def test_missing_placeholders_kept(self):
+        _, document = self.render({'«NOM»': 'Ahmed Alaoui'})
+
+        self.assertEqual(document.paragraphs[1].text, "École : «ETABLISSEMENT» («VILLE»)")
+
+    def test_template_reused(self):
+        template = CompiledDocxTemplate(template_docx(["«NOM»"]))
+
+        first = Document(io.BytesIO(template.render({'«NOM»': 'Ahmed'})))
+        second = Document(io.BytesIO(template.render({'«NOM»': 'Salma'})))
+        self.assertEqual(first.paragraphs[0].text, "Ahmed")
+        self.assertEqual(second.paragraphs[0].text, "Salma")
+
+
+class CvTextLayerTests(SimpleTestCase):
+    """The text layer of a CV is read before OCR, scanned pages are rendered only when reached"""
+
+    CV_TEXT = "Ahmed Alaoui, ingénieur d'état. Email : ahmed.alaoui@exemple.ma Tél : 06 12 34 56 78"
+
+    def setUp(self):
+        self.reader = mock.Mock()
+        self.reader.readtext.return_value = ['ahmed.alaoui@exemple.ma', '06 12 34 56 78']
+        patcher = mock.patch('resume_service.PDF.get_reader', return_value=self.reader)
+        self.get_reader = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_text_layer_read_without_ocr(self):
+        result = extract_cv_data(text_pdf(self.CV_TEXT), dpi_ladder=[72])
+
+        self.assertEqual(result, {'email': 'ahmed.alaoui@exemple.ma', 'phone': '+212612345678'})
+        self.get_reader.assert_not_called()
+
+    def test_scanned_page_sent_to_ocr(self):
+        result = extract_cv_data(text_pdf(None), dpi_ladder=[72])
+
+        self.assertEqual(result, {'email': 'ahmed.alaoui@exemple.ma', 'phone': '+212612345678'})
+        self.reader.readtext.assert_called_once()
+
+    def test_pages_after_contacts_not_rendered(self):
+        with mock.patch('resume_service.PDF.render_pdf_page', wraps=render_pdf_page) as render:
+            result = extract_cv_data(text_pdf(None, None, None), dpi_ladder=[72, 150])
+
+        self.assertEqual(result, {'email': 'ahmed.alaoui@exemple.ma', 'phone': '+212612345678'})
+        self.assertEqual([c.args[1:] for c in render.call_args_list], [(0, 72)])
+
+    def test_page_rendered_again_when_nothing_found(self):
+        self.reader.readtext.side_effect = [[], ['ahmed.alaoui@exemple.ma'], ['06 12 34 56 78'], ['non lu']]
+        with mock.patch('resume_service.PDF.render_pdf_page', wraps=render_pdf_page) as render:
+            result = extract_cv_data(text_pdf(None, None, None), dpi_ladder=[72, 150])
+
+        self.assertEqual(result, {'email': 'ahmed.alaoui@exemple.ma', 'phone': '+212612345678'})
+        self.assertEqual([c.args[1:] for c in render.call_args_list], [(0, 72), (0, 150), (1, 72)])
+
+
+class FakeReader:
+    """EasyOCR reader answering the detection and recognition calls after a short delay"""
+
+    def detect(self, img, **kwargs):
+        time.sleep(0.005)
+        return [[[0, 10, 0, 10]]], [[]]
+
+    def recognize(self, img, horizontal_list=None, free_list=None, detail=1, **kwargs):
+        time.sleep(0.005)
+        return ['texte'] if detail == 0 else [([[0, 0], [10, 0], [10, 10], [0, 10]], 'texte', 0.9)]
+
+
+class OcrStageTimingTests(SimpleTestCase):
+    """Stage timings of the shared readers"""
+
+    def setUp(self):
+        self.reader = FakeReader()
+        # Reader already loaded, as after warm_up_readers()
+        patcher = mock.patch.dict('resume_service.ocr._readers', {_reader_key(['fr'], 'cpu'): self.reader})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_warmed_reader_is_timed(self):
+        with collect_stage_timings() as timings:
+            lines = get_reader(['fr'], 'cpu').readtext(np.zeros((20, 20, 3), np.uint8), detail=0)
+
+        self.assertEqual(lines, ['texte'])
+        self.assertGreater(timings['detect'], 0)
+        self.assertGreater(timings['recognise'], 0)
+
+    def test_reader_not_wrapped_outside_timings(self):
+        self.assertIs(get_reader(['fr'], 'cpu'), self.reader)
+
+
+
+class FakeConverterProcess:
+    """LibreOffice process converting in memory, b'lent' times out and b'bloque' waits for release"""
+
+    def __init__(self, index, command, startup_timeout=30):
+        self.index = index
+        self.process = None
+        self.crashed = False
+        self.starts = 0
+        self.converting = threading.Event()
+        self.release = threading.Event()
+
+    def is_alive(self):
+        return self.process is not None and not self.crashed
+
+    def start(self):
+        self.starts += 1
+        self.process = object()
+        self.crashed = False
+
+    def stop(self):
+        self.process = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def convert(self, docx_bytes, timeout):
+        if docx_bytes == b'lent':
+            raise socket.timeout()
+        if docx_bytes == b'bloque':
+            self.converting.set()
+            self.release.wait(5)
+        return b'%PDF ' + docx_bytes
+
+    def close(self):
+        self.stop()
+
+
+class LibreOfficePoolTests(SimpleTestCase):
+    """Queueing, timeouts and restarts of the converter pool"""
+
+    def make_pool(self, **options):
+        with mock.patch('resume_service.converters.LibreOfficeProcess', FakeConverterProcess):
+            pool = LibreOfficePool(**{'size': 1, 'queue_timeout': 5, **options})
+        self.addCleanup(pool.shutdown)
+        return pool, pool.processes[0]
+
+    def test_process_started_once(self):
+        pool, process = self.make_pool()
+
+        self.assertEqual(pool.convert(b'docx'), b'%PDF docx')
+        self.assertEqual(pool.convert(b'docx'), b'%PDF docx')
+        self.assertEqual(process.starts, 1)
+        self.assertEqual(pool.metrics()['conversions'], 2)
+
+    def test_process_restarted_after_timeout(self):
+        pool, process = self.make_pool()
+
+        with self.assertRaises(ConversionTimeout):
+            pool.convert(b'lent')
+        # Waits for the process restarted in the background
+        self.assertEqual(pool.convert(b'docx'), b'%PDF docx')
+
+        self.assertEqual(process.starts, 2)
+        metrics = pool.metrics()
+        self.assertEqual((metrics['timeouts'], metrics['restarts'], metrics['conversions']), (1, 1, 1))
+
+    def test_crashed_process_restarted(self):
+        pool, process = self.make_pool()
+        pool.convert(b'docx')
+        process.crashed = True
+
+        self.assertEqual(pool.convert(b'docx'), b'%PDF docx')
+        self.assertEqual(process.starts, 2)
+        self.assertEqual(pool.metrics()['restarts'], 1)
+
+    def test_full_queue_rejected(self):
+        pool, process = self.make_pool(queue_size=0)
+        worker = threading.Thread(target=pool.convert, args=(b'bloque',))
+        worker.start()
+        process.converting.wait(5)
+
+        try:
+            with self.assertRaises(ConverterBusy):
+                pool.convert(b'docx')
+        finally:
+            process.release.set()
+            worker.join()
+
+        self.assertEqual(pool.metrics()['rejected'], 1)
+        self.assertEqual(pool.convert(b'docx'), b'%PDF docx')
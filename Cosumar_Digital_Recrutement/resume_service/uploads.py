@@ -0,0 +1,313 @@
+import hashlib
+import os
+import re
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from .blobstore import CHUNK_SIZE, store_blob_file
+from .exports import document_extension
+
+# Chunked, resumable upload of the stage / stagiaire documents.
+# The client starts an upload with the size of the file (and its SHA-256),
+# sends it in chunks, each one with the offset it starts at, and finishes it.
+# Chunks are appended to a temporary file in CHUNKED_UPLOADS TEMP_DIR as they
+# arrive, so a worker never holds more than CHUNK_SIZE bytes of a document, and
+# the size and type (first bytes) are checked chunk by chunk. After a dropped
+# connection the client asks for the offset received and sends the rest.
+# A finished upload is moved to the blob store; its id is then sent to
+# creer_stage / enregistrer_stagiaire / upload_stage_document instead of the file.
+# Unfinished uploads are deleted by `manage.py purge_uploads` after EXPIRY seconds.
+
+DEFAULT_CHUNKED_UPLOADS = {
+    'TEMP_DIR': os.path.join(settings.BASE_DIR, 'uploads'),
+    'MAX_SIZE': 50 * 1024 * 1024,
+    # Chunk size suggested to the clients, and the largest chunk accepted
+    'CHUNK_SIZE': 1024 * 1024,
+    'MAX_CHUNK_SIZE': 8 * 1024 * 1024,
+    'EXPIRY': 24 * 3600,
+}
+
+ALLOWED_TYPES = ('pdf', 'jpg', 'png')
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(Exception):
+    """
+    Upload request refused
+
+    Args:
+        message: Error shown to the client (French)
+        status_code: HTTP status of the response
+        upload: The Upload concerned, its offset is sent back to the client
+    """
+
+    def __init__(self, message, status_code=400, upload=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.upload = upload
+
+
+def get_upload_config():
+    config = dict(DEFAULT_CHUNKED_UPLOADS)
+    config.update(getattr(settings, 'CHUNKED_UPLOADS', {}))
+    return config
+
+
+def upload_path(upload):
+    return os.path.join(get_upload_config()['TEMP_DIR'], f"{upload.id}.part")
+
+
+def remove_upload_file(upload):
+    try:
+        os.remove(upload_path(upload))
+    except FileNotFoundError:
+        pass
+
+
+def serialize_upload(upload):
+    config = get_upload_config()
+    return {
+        "upload_id": str(upload.id),
+        "filename": upload.nom_fichier,
+        "size": upload.taille,
+        "offset": upload.recu,
+        "type": upload.type_fichier or None,
+        "status": upload.statut,
+        "sha256": upload.blob_id if upload.statut == 'termine' else (upload.sha256 or None),
+        "error": upload.erreur if upload.statut == 'echoue' else None,
+        "chunk_size": config['CHUNK_SIZE'],
+        "max_chunk_size": config['MAX_CHUNK_SIZE'],
+        "created_at": upload.created_at.strftime('%Y-%m-%d %H:%M:%S') if upload.created_at else None,
+        "finished_at": upload.finished_at.strftime('%Y-%m-%d %H:%M:%S') if upload.finished_at else None,
+    }
+
+
+def parse_sha256(value):
+    value = (value or '').strip().lower()
+    if value and not SHA256_RE.match(value):
+        raise UploadError("Le SHA-256 doit contenir 64 caractères hexadécimaux.")
+    return value
+
+
+def start_upload(user, taille, nom_fichier='', sha256=''):
+    """
+    Create an upload waiting for its first chunk
+
+    Raises:
+        UploadError when the size is missing or too large
+    """
+    from .models import Upload
+
+    try:
+        taille = int(taille)
+    except (TypeError, ValueError):
+        raise UploadError("La taille du fichier est requise.")
+    max_size = get_upload_config()['MAX_SIZE']
+    if taille <= 0:
+        raise UploadError("Le fichier est vide.")
+    if taille > max_size:
+        raise UploadError(f"Le fichier dépasse la taille maximale de {max_size // (1024 * 1024)} Mo.", 413)
+
+    return Upload.objects.create(
+        nom_fichier=(nom_fichier or '')[:255],
+        taille=taille,
+        sha256=parse_sha256(sha256),
+        created_by=user,
+    )
+
+
+def get_upload(upload_id, user, lock=False):
+    """Upload of a user, locked until the end of the transaction when lock is True"""
+    from .models import Upload
+
+    uploads = Upload.objects.select_for_update() if lock else Upload.objects
+    try:
+        upload = uploads.filter(id=upload_id).first()
+    except (ValueError, ValidationError):
+        raise UploadError("Identifiant d'upload invalide.")
+    if upload is None:
+        raise UploadError("Upload non trouvé.", 404)
+    if upload.created_by_id != user.id:
+        raise UploadError("Vous n'avez pas l'autorisation d'accéder à cet upload.", 403)
+    return upload
+
+
+def append_chunk(upload_id, user, offset, stream, length):
+    """
+    Write a chunk of an upload to its temporary file
+
+    Args:
+        offset: Position of the chunk in the file, must be the number of bytes
+            received so far (a chunk already received is refused with a 409
+            giving the offset to send next)
+        stream: Binary stream of the request body, read CHUNK_SIZE bytes at a time
+        length: Content-Length of the chunk
+
+    Returns:
+        The Upload, with the new offset
+
+    Raises:
+        UploadError when the chunk is refused, nothing is kept from it
+    """
+    config = get_upload_config()
+
+    with transaction.atomic():
+        # Chunks of the same upload are written one at a time
+        upload = get_upload(upload_id, user, lock=True)
+        if upload.statut != 'en_cours':
+            raise UploadError("Cet upload est déjà terminé.", 409, upload)
+        try:
+            offset = int(offset)
+        except (TypeError, ValueError):
+            raise UploadError("L'en-tête Upload-Offset est requis.", 400, upload)
+        if offset != upload.recu:
+            raise UploadError(f"Le morceau doit commencer à l'octet {upload.recu}.", 409, upload)
+        if not length:
+            raise UploadError("Le morceau est vide.", 400, upload)
+        if length > config['MAX_CHUNK_SIZE']:
+            raise UploadError(f"Un morceau ne peut pas dépasser {config['MAX_CHUNK_SIZE']} octets.", 413, upload)
+        if upload.recu + length > upload.taille:
+            raise UploadError("Le morceau dépasse la taille annoncée du fichier.", 413, upload)
+
+        path = upload_path(upload)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            # Bytes of a chunk interrupted earlier are dropped
+            f.truncate(upload.recu)
+            f.seek(upload.recu)
+            received = 0
+            head = b''
+            try:
+                while received < length:
+                    chunk = stream.read(min(CHUNK_SIZE, length - received))
+                    if not chunk:
+                        break
+                    if upload.recu == 0 and len(head) < 8:
+                        head += chunk[:8 - len(head)]
+                    f.write(chunk)
+                    received += len(chunk)
+            except Exception:
+                f.truncate(upload.recu)
+                raise
+
+            if received < length:
+                f.truncate(upload.recu)
+                raise UploadError("Morceau incomplet, renvoyez-le.", 400, upload)
+
+            if upload.recu == 0:
+                file_type = document_extension(head)
+                if file_type not in ALLOWED_TYPES:
+                    f.truncate(0)
+                    raise UploadError("Type de fichier non autorisé. Veuillez télécharger un PDF, JPG ou PNG.",
+                                      415, upload)
+                upload.type_fichier = file_type
+
+        upload.recu += received
+        upload.save(update_fields=['recu', 'type_fichier', 'updated_at'])
+    return upload
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def finish_upload(upload_id, user, sha256=''):
+    """
+    Check the SHA-256 of a complete upload and move it to the blob store
+
+    Finishing an upload already finished returns it again, so the client
+    can retry when the response was lost.
+
+    Raises:
+        UploadError when chunks are missing or the SHA-256 does not match
+        (the upload then failed and must be started again)
+    """
+    with transaction.atomic():
+        upload = get_upload(upload_id, user, lock=True)
+        if upload.statut == 'termine':
+            return upload
+        if upload.statut != 'en_cours':
+            raise UploadError("Cet upload a échoué, recommencez-le.", 409, upload)
+
+        expected = parse_sha256(sha256) or upload.sha256
+        if not expected:
+            raise UploadError("Le SHA-256 du fichier est requis.", 400, upload)
+        if upload.recu != upload.taille:
+            raise UploadError(f"Fichier incomplet: {upload.recu} octets reçus sur {upload.taille}.", 409, upload)
+
+        path = upload_path(upload)
+        if not os.path.exists(path):
+            raise UploadError("Le fichier temporaire de l'upload a expiré, recommencez-le.", 410, upload)
+        key = file_hash(path)
+        if key == expected:
+            with open(path, 'rb') as f:
+                upload.blob = store_blob_file(f, key=key, size=upload.taille)
+            upload.sha256 = key
+            upload.statut = 'termine'
+            upload.finished_at = timezone.now()
+            upload.save(update_fields=['blob', 'sha256', 'statut', 'finished_at', 'updated_at'])
+        else:
+            upload.statut = 'echoue'
+            upload.erreur = "Le SHA-256 du fichier reçu ne correspond pas."
+            upload.save(update_fields=['statut', 'erreur', 'updated_at'])
+        transaction.on_commit(lambda: remove_upload_file(upload))
+
+    if upload.statut == 'echoue':
+        raise UploadError(upload.erreur, 400, upload)
+    return upload
+
+
+def attach_upload(upload_id, user):
+    """
+    Blob of a finished upload, to reference it from a stage / stagiaire
+
+    Raises:
+        UploadError when the upload is not finished or belongs to another user
+    """
+    upload = get_upload(upload_id, user)
+    if upload.statut != 'termine' or not upload.blob_id:
+        raise UploadError(f"L'upload {upload.id} n'est pas terminé.", 400, upload)
+    return upload.blob
+
+
+def document_blob(source, user):
+    """
+    Blob of a document sent with a request
+
+    Args:
+        source: The uploaded file, or the id of a finished upload
+        user: User of the request, owner of the upload
+
+    Returns:
+        The Blob, None when no document was sent
+    """
+    if not source:
+        return None
+    if hasattr(source, 'read'):
+        # Read from the uploaded file by chunks, not loaded whole in memory
+        return store_blob_file(source)
+    return attach_upload(source, user)
+
+
+def purge_expired_uploads():
+    """
+    Delete the uploads not updated for EXPIRY seconds and their temporary files
+
+    The documents of finished uploads stay in the blob store.
+    """
+    from .models import Upload
+
+    expired = Upload.objects.filter(updated_at__lt=timezone.now() - timedelta(seconds=get_upload_config()['EXPIRY']))
+    deleted = 0
+    for upload in expired.iterator():
+        remove_upload_file(upload)
+        upload.delete()
+        deleted += 1
+    return deleted
@@ -12,12 +12,25 @@ urlpatterns = [
     path('chercher_stages/', views.chercher_stages, name='chercher_stages'),
     path('chercher_sujets/', views.chercher_sujets, name='chercher_sujets'),
     path('process_cv/', views.process_cv, name='process_cv'),
+    path('scan_cin_async/', views.scan_cin_async, name='scan_cin_async'),
+    path('process_cv_async/', views.process_cv_async, name='process_cv_async'),
+    path('ocr_batch/', views.ocr_batch, name='ocr_batch'),
+    path('ocr_jobs/<uuid:job_id>/', views.ocr_job_status, name='ocr_job_status'),
+    path('pdf_converter/metrics/', views.pdf_converter_metrics, name='pdf_converter_metrics'),
+    path('document_storage/', views.document_storage_report, name='document_storage_report'),
+    path('document_templates/', views.document_templates, name='document_templates'),
+    path('document_templates/<int:template_id>/activer/', views.activer_document_template, name='activer_document_template'),
     path('get_candidate_documents/<str:matricule>/', views.get_candidate_documents, name='get_candidate_documents'),
     path('recuperer_stage/<str:stage_id>/', views.recuperer_stage, name='recuperer_stage'),
     path('update_stage/<str:stage_id>/', views.update_stage, name='update_stage'),
     path('get_cin/<str:matricule>/', views.get_cin, name='get_cin'),
     path('get_stage_document/<str:stage_id>/<str:document_type>/', views.get_stage_document, name='get_stage_document'),
+    path('export_dossier_stage/<str:stage_id>/', views.export_dossier_stage, name='export_dossier_stage'),
+    path('export_dossiers_stages/', views.export_dossiers_stages, name='export_dossiers_stages'),
     path('upload_stage_document/<str:stage_id>/', views.upload_stage_document, name='upload_stage_document'),
+    path('uploads/', views.creer_upload, name='creer_upload'),
+    path('uploads/<uuid:upload_id>/', views.upload_chunk, name='upload_chunk'),
+    path('uploads/<uuid:upload_id>/finaliser/', views.finaliser_upload, name='finaliser_upload'),
     path('sign_demande_stage/<str:stage_id>/', views.sign_demande_stage, name='sign_demande_stage'),
     path('sign_demande_stage_rh/<str:stage_id>/', views.sign_demande_stage_rh, name='sign_demande_stage_rh'),
     path('sign_demande_stage_chef_dept/<str:stage_id>/', views.sign_demande_stage_chef_dept, name='sign_demande_stage_chef_dept'),
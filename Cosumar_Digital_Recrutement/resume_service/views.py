@@ -1,29 +1,52 @@
 from rest_framework.decorators import api_view, permission_classes, parser_classes
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import render
+from django.http import StreamingHttpResponse, FileResponse
 from rest_framework.response import Response
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from rest_framework import status
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.core.exceptions import ValidationError
+import io
 import os
-from .PDF import extract_cv_data, create_pdf_from_docx_template_xml, create_docx_from_template_xml, convert_docx_bytes_to_pdf_bytes
+import zipfile
+from .PDF import extract_cv_data, create_pdf_from_docx_template_xml, CV_EXTRACTOR_VERSION
+from .converters import get_pdf_converter, ConverterError, ConverterBusy, ConversionTimeout
+from .render_cache import render_cache_stats
+from .dedup import dedup_report
+from .documents import (
+    ANCHOR_TOKENS, DOCUMENT_COLUMNS, demande_template_available, render_demande_de_stage, sign_demande_de_stage, schedule_demande_render,
+    is_render_stale,
+)
+from .template_registry import DEMANDE_DE_STAGE, serialize_template, create_template_version, activate_template
+from .ocr_cache import cached_extraction
+from .downloads import document_response
+from .uploads import (
+    UploadError, serialize_upload, start_upload, get_upload, append_chunk, finish_upload, document_blob,
+)
+from .exports import EXPORT_CONTENUS, EXPORT_STAGE_FIELDS, merge_stage_documents, stream_dossiers_zip
+from .jobs import submit_ocr_job, serialize_job, stream_batch_results
+from resume_service.models import OcrJob, DocumentTemplate
 from resume_service.models import Stage, Stagiaire, Sujet
 from auth_service.models import Utilisateur
+from django.db import transaction
 from django.db.models import Count, Q
 from datetime import datetime, timedelta
+from django.utils import timezone
 from django.db.models import Value, CharField
 from django.db.models.functions import Concat
 from .decorators import allow_roles, admin_required, admin_or_rh_required, exclude_utilisateur_role
 
 # Handle CIN module import with fallback
 try:
-    from .CIN import extract_cin_data
+    from .CIN import extract_cin_data, CIN_EXTRACTOR_VERSION
 except ImportError:
     try:
-        from CIN import extract_cin_data
+        from CIN import extract_cin_data, CIN_EXTRACTOR_VERSION
     except ImportError:
+        CIN_EXTRACTOR_VERSION = 'unavailable'
+
         def extract_cin_data(image_bytes):
             """Fallback function when CIN module is not available"""
             return {}
@@ -82,19 +105,21 @@ def scan_cin(request):
         # Read file bytes
         cin_bytes = cin_file.read()
 
-        # Extract data
-        data = extract_cin_data(cin_bytes)
+        # Extract data (reused when the same image was already scanned)
+        data, cached = cached_extraction('cin', CIN_EXTRACTOR_VERSION, cin_bytes, extract_cin_data)
 
 
         if not data or not data.get('cin') or data.get('cin') == 'unknown':
             return Response({
                 "message": "CIN scan échoué - aucune donnée valide extraite",
-                "data": data
+                "data": data,
+                "cached": cached
             }, status=status.HTTP_200_OK)
 
         return Response({
             "message": "CIN scannée avec succès",
-            "data": data
+            "data": data,
+            "cached": cached
         }, status=status.HTTP_200_OK)
 
     except Exception as e:
@@ -117,8 +142,8 @@ def enregistrer_stagiaire(request):
         phone = request.data.get('phone')
         introduit_par_id = request.data.get('introduit_par_id')
         
-        # Required files for new stagiaire
-        cin_file = request.FILES.get('cin_file')
+        # Required files for new stagiaire, sent as a file or as the id of a finished chunked upload
+        cin_file = request.FILES.get('cin_file') or request.data.get('cin_upload_id')
 
         # Validation for new candidate only
         if not all([nom, prenom, cin, cin_file, email, phone]):
@@ -137,9 +162,6 @@ def enregistrer_stagiaire(request):
                     "error": "L'utilisateur spécifié pour 'introduit par' n'existe pas."
                 }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Read CIN file
-        cin_bytes = cin_file.read()
-
         parsed_date = None
         if date_naissance:
             try:
@@ -156,13 +178,19 @@ def enregistrer_stagiaire(request):
                 "error": "Un stagiaire avec ce numéro CIN existe déjà."
             }, status=status.HTTP_400_BAD_REQUEST)
 
+        # Store the CIN file (or take the chunked upload) without reading it whole in memory
+        try:
+            cin_blob = document_blob(cin_file, request.user)
+        except UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+
         # Create new stagiaire only
         stagiaire = Stagiaire.objects.create(
             nom=nom,
             prenom=prenom,
             matricule=cin,
             date_naissance=parsed_date,
-            cin=cin_bytes,
+            cin_blob=cin_blob,
             email=email,
             num_tel=phone,
             introduit_par=introduit_par
@@ -195,11 +223,11 @@ def creer_stage(request):
         status_stage = request.data.get('status', 'stage_created')
         introduit_par_id = request.data.get('introduit_par_id')  # Optional introducer user ID
         
-        # Required files for stage
-        cv_file = request.FILES.get('cv_file')
-        assurance_file = request.FILES.get('assurance_file')
-        convention_file = request.FILES.get('convention_file')
-        lettre_motivation_file = request.FILES.get('lettre_motivation_file')
+        # Required files for stage, sent as files or as the ids of finished chunked uploads
+        cv_file = request.FILES.get('cv_file') or request.data.get('cv_upload_id')
+        assurance_file = request.FILES.get('assurance_file') or request.data.get('assurance_upload_id')
+        convention_file = request.FILES.get('convention_file') or request.data.get('convention_upload_id')
+        lettre_motivation_file = request.FILES.get('lettre_motivation_file') or request.data.get('lettre_motivation_upload_id')
 
         # Validation
         if not all([matricule, cv_file, nature, date_debut, date_fin]):
@@ -281,6 +309,15 @@ def creer_stage(request):
                     "error": "Sujet sélectionné non trouvé."
                 }, status=status.HTTP_400_BAD_REQUEST)
 
+        # Store the files (or take the chunked uploads) one at a time, by chunks
+        try:
+            cv_blob = document_blob(cv_file, request.user)
+            convention_blob = document_blob(convention_file, request.user)
+            assurance_blob = document_blob(assurance_file, request.user)
+            lettre_motivation_blob = document_blob(lettre_motivation_file, request.user)
+        except UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+
         # Create new stage for the stagiaire
         try:
             stage = Stage.objects.create(
@@ -290,10 +327,10 @@ def creer_stage(request):
                 date_fin=parsed_date_fin,
                 sujet=sujet,
                 introduit_par=introduit_par_user,  # Set the introducer
-                cv=cv_file.read() if cv_file else None,
-                convention=convention_file.read() if convention_file else None,
-                assurance=assurance_file.read() if assurance_file else None,
-                lettre_motivation=lettre_motivation_file.read() if lettre_motivation_file else None,
+                cv_blob=cv_blob,
+                convention_blob=convention_blob,
+                assurance_blob=assurance_blob,
+                lettre_motivation_blob=lettre_motivation_blob,
                 statut=statut_stage
             )
         except ValidationError as e:
@@ -310,66 +347,14 @@ def creer_stage(request):
             sujet_creator.capacite_restante += 1
             sujet_creator.save()
 
-        # Generate PDF demande de stage from DOCX template
+        # Generate the demande de stage (DOCX and PDF) in the background, once the stage is committed
         try:
-            # Load DOCX template
-            docx_template_path = os.path.join(settings.BASE_DIR, 'resume_service', 'media', 'DEMANDE DE STAGE.docx')
-            
-            if os.path.exists(docx_template_path):
-                # Prepare replacements dictionary
-                replacements = {
-                    '«NOM»': stagiaire.nom.upper() if stagiaire.nom else '',
-                    '«PRENOM»': stagiaire.prenom.title() if stagiaire.prenom else '',
-                    '«CIN»': stagiaire.matricule if stagiaire.matricule else '',
-                    '«EMAIL»': stagiaire.email if stagiaire.email else '',
-                    '«TELEPHONE»': stagiaire.num_tel if stagiaire.num_tel else '',
-                    '«DATE_NAISSANCE»': stagiaire.date_naissance.strftime('%d/%m/%Y') if stagiaire.date_naissance else '',
-                    '«NATURE»': stage.nature.upper() if stage.nature else '',
-                    '«DATE_DEBUT»': stage.date_debut.strftime('%d/%m/%Y') if stage.date_debut else '',
-                    '«DATE_FIN»': stage.date_fin.strftime('%d/%m/%Y') if stage.date_fin else '',
-                    '«PERIODE_DU»': stage.date_debut.strftime('%d/%m/%Y') if stage.date_debut else '',
-                    '«PERIODE_AU»': stage.date_fin.strftime('%d/%m/%Y') if stage.date_fin else '',
-                    '«PERIODE_ACCORDEE_DU»': stage.date_debut.strftime('%d/%m/%Y') if stage.date_debut else '',
-                    '«PERIODE_ACCORDEE_AU»': stage.date_fin.strftime('%d/%m/%Y') if stage.date_fin else '',
-                    '«SUJET»': sujet.titre if sujet and sujet.titre else '',
-                    '«DESCRIPTION_SUJET»': sujet.description if sujet and sujet.description else '',
-                    '«DATE_DEMANDE»': datetime.now().strftime('%d/%m/%Y'),
-                    '«SPECIALITE»': '',
-                    '«ETABLISSEMENT»': '',
-                    '«DIRECTION»': '',
-                    '«ENCADRANT»': '',
-                    '«SERVICE»': '',
-                    '«NOM_ENCADRANT»': '',
-                    '«DATE_SIGNATURE_ENCADRANT»': '',
-                    '«SIGNATURE_ENCADRANT»': '',
-                    '«NOM_RESPONSABLE_SERVICE»': '',
-                    '«DATE_SIGNATURE_RESPONSABLE_SERVICE»': '',
-                    '«DATE_SIGNATURE_RH»': ''
-                }
-                
-                filled_docx_bytes = create_docx_from_template_xml(
-                    docx_path=docx_template_path,
-                    replacements=replacements
-                )
-                
-                if filled_docx_bytes:
-                    stage.demande_de_stage = filled_docx_bytes
-                    
-                    # Convert DOCX to PDF and cache it
-                    try:
-                        pdf_bytes = convert_docx_bytes_to_pdf_bytes(filled_docx_bytes)
-                        if pdf_bytes:
-                            stage.demande_de_stage_pdf = pdf_bytes
-                    except Exception:
-                        pass  # PDF will be generated on-demand if conversion fails
-                    
-                    stage.save()
-                    
-            else:
-                pass  # Template not found, skip PDF generation
-                
-        except Exception:
-            pass  # Don't fail stage creation if PDF generation fails
+            if demande_template_available(stage):
+                schedule_demande_render(stage)
+
+        except Exception as e:
+            # Don't fail stage creation if PDF generation fails
+            print(f"❌ Demande de stage {stage.id} not scheduled: {e}")
 
         # Determine success message based on status
         if status_stage == 'dossier_complete':
@@ -381,7 +366,8 @@ def creer_stage(request):
             "message": message,
             "matricule": stagiaire.matricule,
             "stage_id": stage.id,
-            "status": statut_stage
+            "status": statut_stage,
+            "demande_de_stage_statut": stage.demande_de_stage_statut
         }, status=status.HTTP_201_CREATED)
 
     except Exception as e:
@@ -434,7 +420,7 @@ def get_candidate_documents(request, matricule):
     """Get candidate documents from their latest stage"""
     try:
         # Get the latest stage for this candidate
-        latest_stage = Stage.objects.filter(
+        latest_stage = Stage.objects.select_related('stagiaire').filter(
             stagiaire__matricule=matricule,
             deleted=False
         ).order_by('-created_at').first()
@@ -450,12 +436,12 @@ def get_candidate_documents(request, matricule):
         cv_data = {}
         
         # Get CV file and data
-        if latest_stage.cv:
+        if latest_stage.has_document('cv'):
             documents['cv_file'] = f"cv_stagiaire_{matricule}.pdf"
             documents['has_cv'] = True
             
         # Get CIN file from stagiaire (stored in Stagiaire model)
-        if latest_stage.stagiaire.cin:
+        if latest_stage.stagiaire.has_document('cin'):
             documents['cin_file'] = f"cin_stagiaire_{matricule}.jpg"
             documents['has_cin'] = True
             
@@ -638,13 +624,213 @@ def process_cv(request):
         # Read file bytes
         cv_bytes = cv_file.read()
 
-        data = extract_cv_data(cv_bytes)
+        # Reused when the same CV was already processed
+        data, cached = cached_extraction('cv', CV_EXTRACTOR_VERSION, cv_bytes, extract_cv_data)
 
-        return Response({"status": "success", "data": data}, status=status.HTTP_200_OK)
+        return Response({"status": "success", "data": data, "cached": cached}, status=status.HTTP_200_OK)
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@exclude_utilisateur_role
+def scan_cin_async(request):
+    """Queue a CIN scan and return the job id immediately"""
+    try:
+        cin_file = request.FILES.get('cin')
+
+        if not cin_file:
+            return Response({"error": "Fichier CIN manquant."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Validate extension
+        allowed_extensions = ['jpg', 'jpeg', 'png']
+        ext = os.path.splitext(cin_file.name)[1].lower().lstrip('.')
+        if ext not in allowed_extensions:
+            return Response({
+                "error": "Type de fichier non autorisé. Veuillez télécharger JPG, JPEG ou PNG.",
+                "type": ext
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        job = submit_ocr_job('cin', cin_file.read(), filename=cin_file.name, user=request.user)
+
+        return Response(serialize_job(job), status=status.HTTP_202_ACCEPTED)
+
+    except Exception as e:
+        return Response({
+            "error": f"CIN processing error: {str(e)}"
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def process_cv_async(request):
+    """Queue a CV extraction and return the job id immediately"""
+    try:
+        cv_file = request.FILES.get('cv')
+
+        if not cv_file:
+            return Response({"error": "Fichier CV manquant."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Validate extension
+        allowed_extensions = ['pdf']
+        ext = os.path.splitext(cv_file.name)[1].lower().lstrip('.')
+        if ext not in allowed_extensions:
+            return Response({
+                "error": "Type de fichier non autorisé. Veuillez télécharger un fichier PDF.",
+                "type": ext
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        job = submit_ocr_job('cv', cv_file.read(), filename=cv_file.name, user=request.user)
+
+        return Response(serialize_job(job), status=status.HTTP_202_ACCEPTED)
+
+    except Exception as e:
+        return Response({
+            "error": f"CV processing error: {str(e)}"
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@exclude_utilisateur_role
+def ocr_batch(request):
+    """Queue a batch of CIN images and CV PDFs (files or ZIP archives) and stream one NDJSON line per queued file"""
+    try:
+        files = request.FILES.getlist('files')
+
+        if not files:
+            return Response({"error": "Aucun fichier fourni."}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(
+            stream_batch_results(files, user=request.user),
+            content_type='application/x-ndjson'
+        )
+        # Do not let a reverse proxy hold the lines back
+        response['X-Accel-Buffering'] = 'no'
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def ocr_job_status(request, job_id):
+    """Return the progress and, once finished, the result of an OCR job"""
+    try:
+        job = OcrJob.objects.defer('fichier').filter(id=job_id).first()
+
+        if not job:
+            return Response({"error": "Tâche OCR non trouvée."}, status=status.HTTP_404_NOT_FOUND)
+
+        if job.created_by_id and job.created_by_id != request.user.id:
+            return Response({
+                "error": "Vous n'avez pas l'autorisation d'accéder à cette tâche."
+            }, status=status.HTTP_403_FORBIDDEN)
+
+        return Response(serialize_job(job), status=status.HTTP_200_OK)
+
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@admin_required
+def pdf_converter_metrics(request):
+    """Return the counters and latencies of the DOCX to PDF converter and the render cache of this worker"""
+    try:
+        metrics = get_pdf_converter().metrics()
+        metrics['render_cache'] = render_cache_stats()
+        metrics['pid'] = os.getpid()
+        return Response(metrics, status=status.HTTP_200_OK)
+
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@admin_required
+def document_storage_report(request):
+    """Return the space used by the stage / stagiaire documents and the bytes saved by deduplication"""
+    try:
+        return Response(dedup_report(), status=status.HTTP_200_OK)
+
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+@admin_required
+def document_templates(request):
+    """List the template versions (GET) or upload a new version of a template (POST)"""
+    try:
+        if request.method == 'GET':
+            templates = DocumentTemplate.objects.defer('fichier').order_by('type_document', 'nature', '-version')
+            if request.GET.get('type_document'):
+                templates = templates.filter(type_document=request.GET['type_document'])
+            return Response({
+                "templates": [serialize_template(template) for template in templates]
+            }, status=status.HTTP_200_OK)
+
+        fichier = request.FILES.get('fichier')
+        type_document = request.data.get('type_document', DEMANDE_DE_STAGE)
+        nature = request.data.get('nature') or ''
+
+        if not fichier:
+            return Response({"error": "Aucun fichier fourni."}, status=status.HTTP_400_BAD_REQUEST)
+        if not fichier.name.lower().endswith('.docx'):
+            return Response({"error": "Le modèle doit être un fichier .docx."}, status=status.HTTP_400_BAD_REQUEST)
+        if type_document not in dict(DocumentTemplate._meta.get_field('type_document').choices):
+            return Response({"error": f"Type de document invalide: {type_document}"}, status=status.HTTP_400_BAD_REQUEST)
+        if nature and nature not in dict(Stage._meta.get_field('nature').choices):
+            return Response({"error": f"Nature de stage invalide: {nature}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            template = create_template_version(type_document, fichier.read(), nature=nature,
+                                               nom_fichier=fichier.name, user=request.user)
+        except (zipfile.BadZipFile, KeyError, UnicodeDecodeError) as e:
+            return Response({"error": f"Fichier .docx invalide: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serialize_template(template)
+        if type_document == DEMANDE_DE_STAGE:
+            # The signatures are written at these placeholders
+            data["placeholders_manquants"] = sorted(set(ANCHOR_TOKENS) - set(template.placeholders))
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@admin_required
+def activer_document_template(request, template_id):
+    """Make a template version the active one of its type and nature, e.g. to roll back"""
+    try:
+        template = DocumentTemplate.objects.defer('fichier').filter(id=template_id).first()
+        if not template:
+            return Response({"error": "Modèle non trouvé."}, status=status.HTTP_404_NOT_FOUND)
+
+        activate_template(template)
+        return Response(serialize_template(template), status=status.HTTP_200_OK)
+
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 @csrf_exempt
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -793,21 +979,36 @@ def get_cin(request, matricule):
                 status=status.HTTP_404_NOT_FOUND
             )
             
-        if not stagiaire.cin:
+        if not stagiaire.has_document('cin'):
             return Response(
                 {"error": "CIN document not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
             
-        from django.http import HttpResponse
-        response = HttpResponse(stagiaire.cin, content_type='image/jpeg')
-        response['Content-Disposition'] = f'inline; filename="cin_{matricule}.jpg"'
-        return response
+        return document_response(request, stagiaire, 'cin', 'image/jpeg', f"cin_{matricule}.jpg")
         
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def can_access_stage_documents(user, stage):
+    """Whether a user may read the documents of a stage"""
+    if not hasattr(user, 'role'):
+        return False
+    if user.role in ['admin', 'admin_rh', 'utilisateur_rh']:
+        # RH and admin roles can access all stages
+        return True
+    if user.role == 'utilisateur':
+        # Utilisateur can only access stages with sujets they created
+        return bool(stage.sujet and stage.sujet.created_by == user)
+    if user.role == 'responsable_de_service':
+        # Responsable de service can access stages from their department
+        if stage.sujet and stage.sujet.created_by and user.departement:
+            return (stage.sujet.created_by.departement == user.departement
+                    and stage.sujet.created_by.role == 'utilisateur')
+    return False
+
+
 @csrf_exempt
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -823,24 +1024,7 @@ def get_stage_document(request, stage_id, document_type):
             )
         
         # Role-based access control: Check if user can access this stage
-        current_user = request.user
-        can_access = False
-        
-        if hasattr(current_user, 'role'):
-            if current_user.role in ['admin', 'admin_rh', 'utilisateur_rh']:
-                # RH and admin roles can access all stages
-                can_access = True
-            elif current_user.role == 'utilisateur':
-                # Utilisateur can only access stages with sujets they created
-                if stage.sujet and stage.sujet.created_by == current_user:
-                    can_access = True
-            elif current_user.role == 'responsable_de_service':
-                # Responsable de service can access stages from their department
-                if stage.sujet and stage.sujet.created_by and current_user.departement:
-                    if stage.sujet.created_by.departement == current_user.departement and stage.sujet.created_by.role == 'utilisateur':
-                        can_access = True
-        
-        if not can_access:
+        if not can_access_stage_documents(request.user, stage):
             return Response(
                 {"error": "Vous n'avez pas l'autorisation d'accéder à ce document"},
                 status=status.HTTP_403_FORBIDDEN
@@ -848,30 +1032,50 @@ def get_stage_document(request, stage_id, document_type):
         
 
             
-        document_data = None
+        document_name = None
         content_type = 'application/pdf'
         filename_prefix = document_type
         
-        if document_type == 'cv' and stage.cv:
-            document_data = stage.cv
-        elif document_type == 'convention' and stage.convention:
-            document_data = stage.convention
-        elif document_type == 'assurance' and stage.assurance:
-            document_data = stage.assurance
-        elif document_type == 'lettre_motivation' and stage.lettre_motivation:
-            document_data = stage.lettre_motivation
-        elif document_type == 'demande_de_stage' and stage.demande_de_stage:
+        if document_type in ('cv', 'convention', 'assurance', 'lettre_motivation') and stage.has_document(document_type):
+            document_name = document_type
+        elif document_type == 'demande_de_stage' and stage.demande_de_stage_statut == 'en_attente':
+            # Still rendered in the background
+            if is_render_stale(stage):
+                schedule_demande_render(stage)
+            response = Response({
+                "message": "La demande de stage est en cours de génération, veuillez réessayer",
+                "demande_de_stage_statut": stage.demande_de_stage_statut
+            }, status=status.HTTP_202_ACCEPTED)
+            response['Retry-After'] = str(settings.DOCUMENT_RENDER_RETRY_AFTER)
+            return response
+        elif document_type == 'demande_de_stage' and (stage.has_document('demande_de_stage') or stage.demande_de_stage_statut == 'echoue'):
             # First, try to serve cached PDF if available
-            if stage.demande_de_stage_pdf:
-                document_data = stage.demande_de_stage_pdf
+            if stage.has_document('demande_de_stage_pdf'):
+                document_name = 'demande_de_stage_pdf'
             else:
-                # Convert stored DOCX to PDF and cache it
-                pdf_data = convert_docx_bytes_to_pdf_bytes(stage.demande_de_stage)
-                if pdf_data:
+                # Render the document again (with its signatures) and cache the PDF
+                try:
+                    render_demande_de_stage(stage)
+                    pdf_rendered = stage.has_document('demande_de_stage_pdf')
+                except (ConverterBusy, ConversionTimeout) as e:
+                    print(f"⚠️ Demande de stage {stage_id} not converted: {e}")
+                    response = Response(
+                        {"error": "Le service de conversion PDF est occupé, veuillez réessayer"},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE
+                    )
+                    response['Retry-After'] = '5'
+                    return response
+                except ConverterError as e:
+                    print(f"❌ Demande de stage {stage_id} not converted: {e}")
+                    pdf_rendered = False
+
+                if pdf_rendered:
                     # Cache the PDF for future requests
-                    stage.demande_de_stage_pdf = pdf_data
-                    stage.save()
-                    document_data = pdf_data
+                    stage.demande_de_stage_statut = 'pret'
+                    stage.demande_de_stage_erreur = None
+                    stage.demande_de_stage_statut_at = timezone.now()
+                    stage.save(update_fields=DOCUMENT_COLUMNS)
+                    document_name = 'demande_de_stage_pdf'
                 else:
                     return Response(
                         {"error": "Failed to convert demande de stage to PDF"},
@@ -883,14 +1087,115 @@ def get_stage_document(request, stage_id, document_type):
                 status=status.HTTP_404_NOT_FOUND
             )
             
-        from django.http import HttpResponse
-        response = HttpResponse(document_data, content_type=content_type)
-        response['Content-Disposition'] = f'inline; filename="{filename_prefix}_{stage_id}.pdf"'
-        return response
+        return document_response(request, stage, document_name, content_type, f"{filename_prefix}_{stage_id}.pdf")
         
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_dossier_stage(request, stage_id):
+    """Return every document of a stage merged in one PDF"""
+    try:
+        stage = Stage.objects.only('id', 'sujet').select_related('sujet__created_by').filter(
+            id=stage_id, deleted=False
+        ).first()
+
+        if not stage:
+            return Response({"error": "Stage not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        if not can_access_stage_documents(request.user, stage):
+            return Response(
+                {"error": "Vous n'avez pas l'autorisation d'accéder à ce document"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        pdf_bytes, summary = merge_stage_documents(stage.id)
+        if not pdf_bytes:
+            return Response({
+                "error": "Aucun document disponible pour ce stage.",
+                "erreurs": summary['erreurs'],
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        response = FileResponse(io.BytesIO(pdf_bytes), content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="dossier_stage_{stage.id}.pdf"'
+        response['X-Documents'] = ','.join(summary['documents'])
+        response['X-Documents-Manquants'] = ','.join(summary['manquants'])
+        return response
+
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@admin_or_rh_required
+def export_dossiers_stages(request):
+    """Stream a ZIP archive with the dossier of every selected stage"""
+    try:
+        ids = request.GET.get('ids', '').strip()
+        nature = request.GET.get('nature', '').strip()
+        statut = request.GET.get('statut', '').strip()
+        date_fin_apres = request.GET.get('date_fin_apres', '').strip()
+        date_fin_avant = request.GET.get('date_fin_avant', '').strip()
+        contenu = request.GET.get('contenu', 'fusionne').strip()
+
+        if contenu not in EXPORT_CONTENUS:
+            return Response({
+                "error": f"Contenu invalide, valeurs possibles: {', '.join(EXPORT_CONTENUS)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        filters = {"deleted": False}
+        try:
+            if ids:
+                filters["id__in"] = [int(stage_id) for stage_id in ids.split(',') if stage_id.strip()]
+            if date_fin_apres:
+                filters["date_fin__gte"] = datetime.strptime(date_fin_apres, '%Y-%m-%d').date()
+            if date_fin_avant:
+                filters["date_fin__lte"] = datetime.strptime(date_fin_avant, '%Y-%m-%d').date()
+        except ValueError:
+            return Response({
+                "error": "ids doit être une liste d'identifiants séparés par des virgules, les dates au format YYYY-MM-DD"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if nature:
+            filters["nature"] = nature
+        if statut:
+            filters["statut"] = statut
+
+        if len(filters) == 1:
+            return Response({
+                "error": "Sélectionnez les stages à exporter (ids, nature, statut ou dates de fin)."
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Only the fields naming the files, the documents are read one by one while streaming
+        stages = Stage.objects.filter(**filters).order_by('id').values(*EXPORT_STAGE_FIELDS)
+        count = stages.count()
+        if not count:
+            return Response({"error": "Aucun stage ne correspond à la sélection."}, status=status.HTTP_404_NOT_FOUND)
+        # The archive is built while streaming, within the worker timeout
+        if count > settings.EXPORT_MAX_STAGES:
+            return Response({
+                "error": f"La sélection contient {count} stages, au plus {settings.EXPORT_MAX_STAGES} peuvent être "
+                         f"exportés à la fois. Affinez les filtres ou exportez par lots (ids).",
+                "max_stages": settings.EXPORT_MAX_STAGES,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(
+            stream_dossiers_zip(stages.iterator(), contenu=contenu),
+            content_type='application/zip'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="dossiers_stages_{datetime.now().strftime("%Y%m%d_%H%M%S")}.zip"'
+        )
+        # Do not let a reverse proxy hold the archive back
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 @csrf_exempt
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
@@ -912,21 +1217,15 @@ def upload_stage_document(request, stage_id):
         # Handle different document types
         updated_fields = []
         
-        if 'convention' in request.FILES:
-            stage.convention = request.FILES['convention'].read()
-            updated_fields.append('convention')
-            
-        if 'assurance' in request.FILES:
-            stage.assurance = request.FILES['assurance'].read()
-            updated_fields.append('assurance')
-            
-        if 'lettre_motivation' in request.FILES:
-            stage.lettre_motivation = request.FILES['lettre_motivation'].read()
-            updated_fields.append('lettre_motivation')
-            
-        if 'demande_de_stage' in request.FILES:
-            stage.demande_de_stage = request.FILES['demande_de_stage'].read()
-            updated_fields.append('demande_de_stage')
+        for document_type in ['convention', 'assurance', 'lettre_motivation', 'demande_de_stage']:
+            # A file, or the id of a finished chunked upload
+            source = request.FILES.get(document_type) or request.data.get(f'{document_type}_upload_id')
+            if source:
+                try:
+                    stage.set_document_blob(document_type, document_blob(source, request.user))
+                except UploadError as e:
+                    return Response({"error": str(e)}, status=e.status_code)
+                updated_fields.append(document_type)
         
         if not updated_fields:
             return Response(
@@ -935,10 +1234,10 @@ def upload_stage_document(request, stage_id):
             )
         
         # Check if all required documents are now present
-        has_convention = stage.convention is not None
-        has_assurance = stage.assurance is not None
-        has_lettre_motivation = stage.lettre_motivation is not None
-        has_demande_de_stage = stage.demande_de_stage is not None
+        has_convention = stage.has_document('convention')
+        has_assurance = stage.has_document('assurance')
+        has_lettre_motivation = stage.has_document('lettre_motivation')
+        has_demande_de_stage = stage.has_document('demande_de_stage')
         
         # Update status if all documents are uploaded
         if has_convention and has_assurance and has_lettre_motivation and has_demande_de_stage:
@@ -960,6 +1259,79 @@ def upload_stage_document(request, stage_id):
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def upload_error_response(error):
+    data = {"error": str(error)}
+    if error.upload is not None:
+        # Where the client resumes the upload
+        data.update({"upload_id": str(error.upload.id), "offset": error.upload.recu, "status": error.upload.statut})
+    return Response(data, status=error.status_code)
+
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@exclude_utilisateur_role
+def creer_upload(request):
+    """Start a chunked upload of a document (size, file name and optionally its SHA-256)"""
+    try:
+        upload = start_upload(
+            request.user,
+            request.data.get('taille'),
+            nom_fichier=request.data.get('nom_fichier', ''),
+            sha256=request.data.get('sha256', ''),
+        )
+        return Response(serialize_upload(upload), status=status.HTTP_201_CREATED)
+
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@api_view(['GET', 'PUT'])
+@permission_classes([IsAuthenticated])
+@exclude_utilisateur_role
+def upload_chunk(request, upload_id):
+    """
+    GET: progress of a chunked upload, the offset is where to resume
+    PUT: append a chunk, raw bytes in the body starting at the Upload-Offset header
+    """
+    try:
+        if request.method == 'GET':
+            return Response(serialize_upload(get_upload(upload_id, request.user)), status=status.HTTP_200_OK)
+
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        # The body is read from the stream chunk by chunk, never parsed by DRF
+        upload = append_chunk(upload_id, request.user, request.META.get('HTTP_UPLOAD_OFFSET'),
+                              request.stream, length)
+        return Response(serialize_upload(upload), status=status.HTTP_200_OK)
+
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@exclude_utilisateur_role
+def finaliser_upload(request, upload_id):
+    """Check the SHA-256 of a complete upload and store it; its id can then be attached to a stage"""
+    try:
+        upload = finish_upload(upload_id, request.user, sha256=request.data.get('sha256', ''))
+        return Response(serialize_upload(upload), status=status.HTTP_200_OK)
+
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 @csrf_exempt
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -1274,133 +1646,64 @@ def sign_demande_stage(request, stage_id):
                 "error": "Seuls les utilisateurs avec le rôle 'utilisateur' ou 'responsable_de_service' peuvent signer les demandes de stage."
             }, status=status.HTTP_403_FORBIDDEN)
         
-        # Get the stage
-        stage = Stage.objects.get(id=stage_id, deleted=False)
-        
-        # Role-specific validation and signing logic
-        if user.role == 'utilisateur':
-            # Check if this user is the owner of a sujet in this stage (encadrant)
-            if not stage.sujet or stage.sujet.created_by != user:
-                return Response({
-                    "error": "Vous ne pouvez signer que les stages pour lesquels vous avez créé le sujet."
-                }, status=status.HTTP_403_FORBIDDEN)
+        # The stage stays locked until the signature is saved: two signatures of the
+        # same stage are recorded one after the other, neither is lost
+        with transaction.atomic():
+            # Get the stage (of: the sujet joined may be NULL, only the stage row is locked)
+            stage = Stage.objects.select_for_update(of=('self',)).select_related(
+                'stagiaire', 'sujet__created_by'
+            ).get(id=stage_id, deleted=False)
+        
+            # Role-specific validation and signing logic
+            if user.role == 'utilisateur':
+                # Check if this user is the owner of a sujet in this stage (encadrant)
+                if not stage.sujet or stage.sujet.created_by != user:
+                    return Response({
+                        "error": "Vous ne pouvez signer que les stages pour lesquels vous avez créé le sujet."
+                    }, status=status.HTTP_403_FORBIDDEN)
             
-            # Check if already signed as encadrant
-            if stage.is_signed_by_role('encadrant'):
-                return Response({
-                    "error": "Ce stage a déjà été signé en tant qu'encadrant."
-                }, status=status.HTTP_400_BAD_REQUEST)
+                # Check if already signed as encadrant
+                if stage.is_signed_by_role('encadrant'):
+                    return Response({
+                        "error": "Ce stage a déjà été signé en tant qu'encadrant."
+                    }, status=status.HTTP_400_BAD_REQUEST)
             
-            signature_role = 'encadrant'
-            success_message_prefix = "Signature encadrant ajoutée avec succès!"
+                signature_role = 'encadrant'
+                success_message_prefix = "Signature encadrant ajoutée avec succès!"
             
-        elif user.role == 'responsable_de_service':
-            # Check if already signed as responsable_de_service
-            if stage.is_signed_by_role('responsable_de_service'):
-                return Response({
-                    "error": "Ce stage a déjà été signé en tant que responsable de service."
-                }, status=status.HTTP_400_BAD_REQUEST)
+            elif user.role == 'responsable_de_service':
+                # Check if already signed as responsable_de_service
+                if stage.is_signed_by_role('responsable_de_service'):
+                    return Response({
+                        "error": "Ce stage a déjà été signé en tant que responsable de service."
+                    }, status=status.HTTP_400_BAD_REQUEST)
             
-            signature_role = 'responsable_de_service'
-            success_message_prefix = "Signature responsable de service ajoutée avec succès!"
-        
-        # Check if demande_de_stage exists
-        if not stage.demande_de_stage:
-            return Response({
-                "error": "Aucune demande de stage n'est disponible pour ce stage."
-            }, status=status.HTTP_404_NOT_FOUND)
+                signature_role = 'responsable_de_service'
+                success_message_prefix = "Signature responsable de service ajoutée avec succès!"
+        
+            # The document may still be rendered in the background
+            if stage.demande_de_stage_statut == 'en_attente':
+                response = Response({
+                    "error": "La demande de stage est en cours de génération, veuillez réessayer."
+                }, status=status.HTTP_409_CONFLICT)
+                response['Retry-After'] = str(settings.DOCUMENT_RENDER_RETRY_AFTER)
+                return response
+
+            # Check if demande_de_stage exists
+            if not stage.has_document('demande_de_stage'):
+                return Response({
+                    "error": "Aucune demande de stage n'est disponible pour ce stage."
+                }, status=status.HTTP_404_NOT_FOUND)
         
-        try:
-            # Load DOCX template (or use the existing demande_de_stage)
-            docx_template_path = os.path.join(settings.BASE_DIR, 'resume_service', 'media', 'DEMANDE DE STAGE.docx')
-            
-            if os.path.exists(docx_template_path):
-                # Get current date
-                current_date = datetime.now().strftime('%d/%m/%Y')
-                
-                # Update document data in JSON structure
-                stage.update_document_data()
-                
-                # Prepare replacements dictionary from JSON data and existing signatures
-                document_data = stage.demande_de_stage_data.get('document_data', {})
-                replacements = {
-                    '«NOM»': document_data.get('nom', ''),
-                    '«PRENOM»': document_data.get('prenom', ''),
-                    '«CIN»': document_data.get('cin', ''),
-                    '«TELEPHONE»': document_data.get('telephone', ''),
-                    '«SPECIALITE»': document_data.get('specialite', ''),
-                    '«ETABLISSEMENT»': document_data.get('etablissement', ''),
-                    '«PERIODE_DU»': document_data.get('periode_du', ''),
-                    '«PERIODE_AU»': document_data.get('periode_au', ''),
-                    '«ENCADRANT»': document_data.get('encadrant', ''),
-                    '«SERVICE»': document_data.get('service', ''),
-                    '«PERIODE_ACCORDEE_DU»': document_data.get('periode_accordee_du', ''),
-                    '«PERIODE_ACCORDEE_AU»': document_data.get('periode_accordee_au', ''),
-                    '«SUJET»': document_data.get('sujet', ''),
-                    # Initialize signature fields as empty (will be filled based on existing signatures)
-                    '«NOM_ENCADRANT»': '',
-                    '«DATE_SIGNATURE_ENCADRANT»': '',
-                    '«SIGNATURE_ENCADRANT»': '',
-                    '«NOM_RESPONSABLE_SERVICE»': '',
-                    '«DATE_SIGNATURE_RESPONSABLE_SERVICE»': '',
-                    '«SIGNATURE_RESPONSABLE_SERVICE»': '',
-                    '«DATE_SIGNATURE_RH»': '',
-                    '«SIGNATURE_RH»': ''
-                }
-                
-                # Preserve existing signatures from JSON data
-                encadrant_signature = stage.get_signature_info('encadrant')
-                if encadrant_signature:
-                    replacements['«NOM_ENCADRANT»'] = encadrant_signature['full_name']
-                    replacements['«DATE_SIGNATURE_ENCADRANT»'] = encadrant_signature['signed_at']
-                    replacements['«SIGNATURE_ENCADRANT»'] = encadrant_signature['full_name']
-                
-                responsable_service_signature = stage.get_signature_info('responsable_de_service')
-                if responsable_service_signature:
-                    replacements['«NOM_RESPONSABLE_SERVICE»'] = responsable_service_signature['full_name']
-                    replacements['«DATE_SIGNATURE_RESPONSABLE_SERVICE»'] = responsable_service_signature['signed_at']
-                    replacements['«SIGNATURE_RESPONSABLE_SERVICE»'] = responsable_service_signature['full_name']
-                
-                rh_signature = stage.get_signature_info('responsable_rh')
-                if rh_signature:
-                    replacements['«DATE_SIGNATURE_RH»'] = rh_signature['signed_at']
-                    replacements['«SIGNATURE_RH»'] = rh_signature['full_name']
-                
-                # Apply current user's signature to the appropriate field
-                if signature_role == 'encadrant':
-                    replacements.update({
-                        '«NOM_ENCADRANT»': f"{user.prenom} {user.nom}".title() if user.prenom and user.nom else user.email,
-                        '«DATE_SIGNATURE_ENCADRANT»': current_date,
-                        '«SIGNATURE_ENCADRANT»': f"{user.prenom} {user.nom}".title() if user.prenom and user.nom else user.email,
-                    })
-                elif signature_role == 'responsable_de_service':
-                    replacements.update({
-                        '«NOM_RESPONSABLE_SERVICE»': f"{user.prenom} {user.nom}".title() if user.prenom and user.nom else user.email,
-                        '«DATE_SIGNATURE_RESPONSABLE_SERVICE»': current_date,
-                        '«SIGNATURE_RESPONSABLE_SERVICE»': f"{user.prenom} {user.nom}".title() if user.prenom and user.nom else user.email,
-                    })
+            try:
+                if demande_template_available(stage):
+                    # Get current date
+                    current_date = datetime.now().strftime('%d/%m/%Y')
                 
-                # Generate DOCX from template with signature information
-                filled_docx_bytes = create_docx_from_template_xml(
-                    docx_path=docx_template_path,
-                    replacements=replacements
-                )
+                    # Record the signature and stamp it on the PDF (no DOCX to PDF conversion, a document
+                    # without anchors is rendered in the background after the commit)
+                    sign_demande_de_stage(stage, signature_role, user, current_date)
                 
-                if filled_docx_bytes:
-                    # Save signed DOCX to database
-                    stage.demande_de_stage = filled_docx_bytes
-                    
-                    # Convert DOCX to PDF and cache it
-                    try:
-                        pdf_bytes = convert_docx_bytes_to_pdf_bytes(filled_docx_bytes)
-                        if pdf_bytes:
-                            stage.demande_de_stage_pdf = pdf_bytes
-                    except Exception:
-                        pass  # PDF will be generated on-demand
-                    
-                    # Add signature to JSON structure
-                    stage.add_signature(signature_role, user, current_date)
-                    
                     # Check if all signatures are present and update stage status
                     if stage.are_all_signatures_complete():
                         stage.statut = 'stage_en_cours'
@@ -1410,29 +1713,28 @@ def sign_demande_stage(request, stage_id):
                         if stage.statut != 'en_attente_des_signatures':
                             stage.statut = 'en_attente_des_signatures'
                         status_message = f"{success_message_prefix} En attente des autres signatures."
-                    
+                
                     stage.save()
-                    
+                
                     return Response({
                         "message": status_message,
                         "signer_name": f"{user.prenom} {user.nom}".title() if user.prenom and user.nom else user.username,
                         "signature_date": current_date,
                         "stage_status": stage.statut,
-                        "signatures_complete": stage.are_all_signatures_complete()
+                        "signatures_complete": stage.are_all_signatures_complete(),
+                        "demande_de_stage_statut": stage.demande_de_stage_statut
                     }, status=status.HTTP_200_OK)
                 else:
                     return Response({
-                        "error": "Erreur lors de la génération du document signé."
-                    }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            else:
-                return Response({
-                    "error": "Template de demande de stage non trouvé."
-                }, status=status.HTTP_404_NOT_FOUND)
+                        "error": "Template de demande de stage non trouvé."
+                    }, status=status.HTTP_404_NOT_FOUND)
                 
-        except Exception as signing_error:
-            return Response({
-                "error": f"Erreur lors de la signature: {str(signing_error)}"
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            except Exception as signing_error:
+                # Nothing of a signature that failed halfway is kept
+                transaction.set_rollback(True)
+                return Response({
+                    "error": f"Erreur lors de la signature: {str(signing_error)}"
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
     except Stage.DoesNotExist:
         return Response({
@@ -1458,99 +1760,43 @@ def sign_demande_stage_rh(request, stage_id):
                 "error": "Seuls les utilisateurs avec le rôle RH peuvent signer les demandes de stage."
             }, status=status.HTTP_403_FORBIDDEN)
         
-        # Get the stage
-        stage = Stage.objects.get(id=stage_id, deleted=False)
+        # The stage stays locked until the signature is saved: two signatures of the
+        # same stage are recorded one after the other, neither is lost
+        with transaction.atomic():
+            # Get the stage (of: the sujet joined may be NULL, only the stage row is locked)
+            stage = Stage.objects.select_for_update(of=('self',)).select_related(
+                'stagiaire', 'sujet__created_by'
+            ).get(id=stage_id, deleted=False)
         
-        # Check if already signed as responsable_rh
-        if stage.is_signed_by_role('responsable_rh'):
-            return Response({
-                "error": "Ce stage a déjà été signé par les RH."
-            }, status=status.HTTP_400_BAD_REQUEST)
+            # Check if already signed as responsable_rh
+            if stage.is_signed_by_role('responsable_rh'):
+                return Response({
+                    "error": "Ce stage a déjà été signé par les RH."
+                }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Check if demande_de_stage exists
-        if not stage.demande_de_stage:
-            return Response({
-                "error": "Aucune demande de stage n'est disponible pour ce stage."
-            }, status=status.HTTP_404_NOT_FOUND)
+            # The document may still be rendered in the background
+            if stage.demande_de_stage_statut == 'en_attente':
+                response = Response({
+                    "error": "La demande de stage est en cours de génération, veuillez réessayer."
+                }, status=status.HTTP_409_CONFLICT)
+                response['Retry-After'] = str(settings.DOCUMENT_RENDER_RETRY_AFTER)
+                return response
+
+            # Check if demande_de_stage exists
+            if not stage.has_document('demande_de_stage'):
+                return Response({
+                    "error": "Aucune demande de stage n'est disponible pour ce stage."
+                }, status=status.HTTP_404_NOT_FOUND)
         
-        try:
-            # Load DOCX template
-            docx_template_path = os.path.join(settings.BASE_DIR, 'resume_service', 'media', 'DEMANDE DE STAGE.docx')
-            
-            if os.path.exists(docx_template_path):
-                # Get current date
-                current_date = datetime.now().strftime('%d/%m/%Y')
-                
-                # Update document data in JSON structure
-                stage.update_document_data()
-                
-                # Prepare replacements dictionary from JSON data and existing signatures
-                document_data = stage.demande_de_stage_data.get('document_data', {})
-                replacements = {
-                    '«NOM»': document_data.get('nom', ''),
-                    '«PRENOM»': document_data.get('prenom', ''),
-                    '«CIN»': document_data.get('cin', ''),
-                    '«TELEPHONE»': document_data.get('telephone', ''),
-                    '«SPECIALITE»': document_data.get('specialite', ''),
-                    '«ETABLISSEMENT»': document_data.get('etablissement', ''),
-                    '«PERIODE_DU»': document_data.get('periode_du', ''),
-                    '«PERIODE_AU»': document_data.get('periode_au', ''),
-                    '«ENCADRANT»': document_data.get('encadrant', ''),
-                    '«SERVICE»': document_data.get('service', ''),
-                    '«PERIODE_ACCORDEE_DU»': document_data.get('periode_accordee_du', ''),
-                    '«PERIODE_ACCORDEE_AU»': document_data.get('periode_accordee_au', ''),
-                    '«SUJET»': document_data.get('sujet', ''),
-                    # Initialize signature fields as empty (will be filled based on existing signatures)
-                    '«NOM_ENCADRANT»': '',
-                    '«DATE_SIGNATURE_ENCADRANT»': '',
-                    '«SIGNATURE_ENCADRANT»': '',
-                    '«NOM_RESPONSABLE_SERVICE»': '',
-                    '«DATE_SIGNATURE_RESPONSABLE_SERVICE»': '',
-                    '«SIGNATURE_RESPONSABLE_SERVICE»': '',
-                    '«DATE_SIGNATURE_RH»': '',
-                    '«SIGNATURE_RH»': ''
-                }
-                
-                # Preserve existing signatures from JSON data
-                encadrant_signature = stage.get_signature_info('encadrant')
-                if encadrant_signature:
-                    replacements['«NOM_ENCADRANT»'] = encadrant_signature['full_name']
-                    replacements['«DATE_SIGNATURE_ENCADRANT»'] = encadrant_signature['signed_at']
-                    replacements['«SIGNATURE_ENCADRANT»'] = encadrant_signature['full_name']
-                
-                responsable_service_signature = stage.get_signature_info('responsable_de_service')
-                if responsable_service_signature:
-                    replacements['«NOM_RESPONSABLE_SERVICE»'] = responsable_service_signature['full_name']
-                    replacements['«DATE_SIGNATURE_RESPONSABLE_SERVICE»'] = responsable_service_signature['signed_at']
-                    replacements['«SIGNATURE_RESPONSABLE_SERVICE»'] = responsable_service_signature['full_name']
-                
-                # Apply current RH user's signature
-                replacements.update({
-                    '«DATE_SIGNATURE_RH»': current_date,
-                    '«SIGNATURE_RH»': f"{user.prenom} {user.nom}".title() if user.prenom and user.nom else user.email,
-                })
+            try:
+                if demande_template_available(stage):
+                    # Get current date
+                    current_date = datetime.now().strftime('%d/%m/%Y')
                 
-                # Generate DOCX from template with RH signature information
-                filled_docx_bytes = create_docx_from_template_xml(
-                    docx_path=docx_template_path,
-                    replacements=replacements
-                )
+                    # Record the signature and stamp it on the PDF (no DOCX to PDF conversion, a document
+                    # without anchors is rendered in the background after the commit)
+                    sign_demande_de_stage(stage, 'responsable_rh', user, current_date)
                 
-                if filled_docx_bytes:
-                    # Save signed DOCX to database
-                    stage.demande_de_stage = filled_docx_bytes
-                    
-                    # Convert DOCX to PDF and cache it
-                    try:
-                        pdf_bytes = convert_docx_bytes_to_pdf_bytes(filled_docx_bytes)
-                        if pdf_bytes:
-                            stage.demande_de_stage_pdf = pdf_bytes
-                    except Exception:
-                        pass  # PDF will be generated on-demand
-                    
-                    # Add signature to JSON structure
-                    stage.add_signature('responsable_rh', user, current_date)
-                    
                     # Check if all signatures are present and update stage status
                     if stage.are_all_signatures_complete():
                         stage.statut = 'stage_en_cours'
@@ -1560,29 +1806,28 @@ def sign_demande_stage_rh(request, stage_id):
                         if stage.statut != 'en_attente_des_signatures':
                             stage.statut = 'en_attente_des_signatures'
                         status_message = "Signature RH ajoutée avec succès! En attente des autres signatures."
-                    
+                
                     stage.save()
-                    
+                
                     return Response({
                         "message": status_message,
                         "signer_name": f"{user.prenom} {user.nom}".title() if user.prenom and user.nom else user.username,
                         "signature_date": current_date,
                         "stage_status": stage.statut,
-                        "signatures_complete": stage.are_all_signatures_complete()
+                        "signatures_complete": stage.are_all_signatures_complete(),
+                        "demande_de_stage_statut": stage.demande_de_stage_statut
                     }, status=status.HTTP_200_OK)
                 else:
                     return Response({
-                        "error": "Erreur lors de la génération du document signé."
-                    }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            else:
-                return Response({
-                    "error": "Template de demande de stage non trouvé."
-                }, status=status.HTTP_404_NOT_FOUND)
+                        "error": "Template de demande de stage non trouvé."
+                    }, status=status.HTTP_404_NOT_FOUND)
                 
-        except Exception as signing_error:
-            return Response({
-                "error": f"Erreur lors de la signature: {str(signing_error)}"
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            except Exception as signing_error:
+                # Nothing of a signature that failed halfway is kept
+                transaction.set_rollback(True)
+                return Response({
+                    "error": f"Erreur lors de la signature: {str(signing_error)}"
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
     except Stage.DoesNotExist:
         return Response({
@@ -1609,121 +1854,66 @@ def sign_demande_stage_chef_dept(request, stage_id):
                 "error": "Seuls les utilisateurs avec le rôle admin peuvent signer en tant que chef de département."
             }, status=status.HTTP_403_FORBIDDEN)
         
-        # Get the stage
-        stage = Stage.objects.get(id=stage_id, deleted=False)
-        
-        # Check if demande_de_stage exists
-        if not stage.demande_de_stage:
-            return Response({
-                "error": "Aucune demande de stage n'est disponible pour ce stage."
-            }, status=status.HTTP_404_NOT_FOUND)
+        # The stage stays locked until the signature is saved: two signatures of the
+        # same stage are recorded one after the other, neither is lost
+        with transaction.atomic():
+            # Get the stage (of: the sujet joined may be NULL, only the stage row is locked)
+            stage = Stage.objects.select_for_update(of=('self',)).select_related(
+                'stagiaire', 'sujet__created_by'
+            ).get(id=stage_id, deleted=False)
+        
+            # The document may still be rendered in the background
+            if stage.demande_de_stage_statut == 'en_attente':
+                response = Response({
+                    "error": "La demande de stage est en cours de génération, veuillez réessayer."
+                }, status=status.HTTP_409_CONFLICT)
+                response['Retry-After'] = str(settings.DOCUMENT_RENDER_RETRY_AFTER)
+                return response
+
+            # Check if demande_de_stage exists
+            if not stage.has_document('demande_de_stage'):
+                return Response({
+                    "error": "Aucune demande de stage n'est disponible pour ce stage."
+                }, status=status.HTTP_404_NOT_FOUND)
         
-        try:
-            # Load DOCX template
-            docx_template_path = os.path.join(settings.BASE_DIR, 'resume_service', 'media', 'DEMANDE DE STAGE.docx')
-            
-            if os.path.exists(docx_template_path):
-                # Get current date
-                current_date = datetime.now().strftime('%d/%m/%Y')
-                
-                # Prepare replacements dictionary
-                replacements = {
-                    '«NOM»': stage.stagiaire.nom.upper() if stage.stagiaire.nom else '',
-                    '«PRENOM»': stage.stagiaire.prenom.title() if stage.stagiaire.prenom else '',
-                    '«CIN»': stage.stagiaire.matricule if stage.stagiaire.matricule else '',
-                    '«EMAIL»': stage.stagiaire.email if stage.stagiaire.email else '',
-                    '«TELEPHONE»': stage.stagiaire.num_tel if stage.stagiaire.num_tel else '',
-                    '«DATE_NAISSANCE»': stage.stagiaire.date_naissance.strftime('%d/%m/%Y') if stage.stagiaire.date_naissance else '',
-                    '«NATURE»': stage.nature.upper() if stage.nature else '',
-                    '«DATE_DEBUT»': stage.date_debut.strftime('%d/%m/%Y') if stage.date_debut else '',
-                    '«DATE_FIN»': stage.date_fin.strftime('%d/%m/%Y') if stage.date_fin else '',
-                    '«PERIODE_DU»': stage.date_debut.strftime('%d/%m/%Y') if stage.date_debut else '',
-                    '«PERIODE_AU»': stage.date_fin.strftime('%d/%m/%Y') if stage.date_fin else '',
-                    '«PERIODE_ACCORDEE_DU»': stage.date_debut.strftime('%d/%m/%Y') if stage.date_debut else '',
-                    '«PERIODE_ACCORDEE_AU»': stage.date_fin.strftime('%d/%m/%Y') if stage.date_fin else '',
-                    '«SUJET»': stage.sujet.titre if stage.sujet and stage.sujet.titre else '',
-                    '«DESCRIPTION_SUJET»': stage.sujet.description if stage.sujet and stage.sujet.description else '',
-                    '«DATE_DEMANDE»': current_date,
-                    '«SPECIALITE»': '',
-                    '«ETABLISSEMENT»': '',
-                    '«DIRECTION»': '',
-                    '«ENCADRANT»': '',
-                    '«SERVICE»': '',
-                    # Preserve existing signatures
-                    '«NOM_ENCADRANT»': '',
-                    '«DATE_SIGNATURE_ENCADRANT»': '',
-                    '«SIGNATURE_ENCADRANT»': '',
-                    # Chef de département signature fields - but don't set as Responsable du service yet
-                    '«NOM_RESPONSABLE_SERVICE»': '',
-                    '«DATE_SIGNATURE_RESPONSABLE_SERVICE»': '',
-                    '«SIGNATURE_RESPONSABLE_SERVICE»': '',
-                    # RH signature fields
-                    '«DATE_SIGNATURE_RH»': '',
-                    '«SIGNATURE_RH»': '',
-                }
-                
-                # Preserve existing signatures from JSON data
-                encadrant_signature = stage.get_signature_info('encadrant')
-                if encadrant_signature:
-                    # Encadrant should always be the "Responsable du service"
-                    replacements['«NOM_RESPONSABLE_SERVICE»'] = encadrant_signature['full_name']
-                    replacements['«DATE_SIGNATURE_RESPONSABLE_SERVICE»'] = encadrant_signature['signed_at']
-                    replacements['«SIGNATURE_RESPONSABLE_SERVICE»'] = encadrant_signature['full_name']
-                    # Also fill the encadrant-specific fields
-                    replacements['«NOM_ENCADRANT»'] = encadrant_signature['full_name']
-                    replacements['«DATE_SIGNATURE_ENCADRANT»'] = encadrant_signature['signed_at']
-                    replacements['«SIGNATURE_ENCADRANT»'] = encadrant_signature['full_name']
+            try:
+                if demande_template_available(stage):
+                    # Get current date
+                    current_date = datetime.now().strftime('%d/%m/%Y')
                 
-                rh_signature = stage.get_signature_info('responsable_rh')
-                if rh_signature:
-                    replacements['«DATE_SIGNATURE_RH»'] = rh_signature['signed_at']
-                    replacements['«SIGNATURE_RH»'] = rh_signature['full_name']
+                    # Record the signature and stamp it on the PDF (no DOCX to PDF conversion, a document
+                    # without anchors is rendered in the background after the commit)
+                    sign_demande_de_stage(stage, 'chef_departement', user, current_date)
                 
-                # Generate DOCX
-                filled_docx_bytes = create_docx_from_template_xml(
-                    docx_path=docx_template_path,
-                    replacements=replacements
-                )
-                
-                if filled_docx_bytes:
-                    stage.demande_de_stage = filled_docx_bytes
-                    
-                    # Convert DOCX to PDF and cache it
-                    try:
-                        pdf_bytes = convert_docx_bytes_to_pdf_bytes(filled_docx_bytes)
-                        if pdf_bytes:
-                            stage.demande_de_stage_pdf = pdf_bytes
-                    except Exception:
-                        pass  # PDF will be generated on-demand
-                    
-                    # Add signature to JSON structure
-                    stage.add_signature('chef_departement', user, current_date)
-                    
-                    # Check all signatures
+                    # Check if all signatures are present and update stage status
                     if stage.are_all_signatures_complete():
                         stage.statut = 'stage_en_cours'
                         status_message = "Toutes les signatures sont complètes, le stage est maintenant en cours."
                     else:
+                        # Update status to waiting for signatures if not already
                         if stage.statut != 'en_attente_des_signatures':
                             stage.statut = 'en_attente_des_signatures'
                         status_message = "Signature chef de département ajoutée. En attente des autres signatures."
-                    
+                
                     stage.save()
-                    
+                
                     return Response({
                         "message": status_message,
                         "signer_name": f"{user.prenom} {user.nom}".title() if user.prenom and user.nom else user.username,
                         "signature_date": current_date,
                         "stage_status": stage.statut,
-                        "signatures_complete": stage.are_all_signatures_complete()
+                        "signatures_complete": stage.are_all_signatures_complete(),
+                        "demande_de_stage_statut": stage.demande_de_stage_statut
                     }, status=status.HTTP_200_OK)
                 else:
-                    return Response({"error": "Erreur lors de la génération du document signé."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            else:
-                return Response({"error": "Template de demande de stage non trouvé."}, status=status.HTTP_404_NOT_FOUND)
+                    return Response({
+                        "error": "Template de demande de stage non trouvé."
+                    }, status=status.HTTP_404_NOT_FOUND)
                 
-        except Exception as signing_error:
-            return Response({"error": f"Erreur lors de la signature: {str(signing_error)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            except Exception as signing_error:
+                # Nothing of a signature that failed halfway is kept
+                transaction.set_rollback(True)
+                return Response({"error": f"Erreur lors de la signature: {str(signing_error)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
     except Stage.DoesNotExist:
         return Response({"error": "Stage non trouvé."}, status=status.HTTP_404_NOT_FOUND)